@@ -0,0 +1,197 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import google.cloud.firestore
+from firebase_admin import auth, firestore
+from google.api_core.exceptions import AlreadyExists
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from achievement_index import delete_achievement_index
+from llm_usage import delete_user_usage
+from user_cache import invalidate_user
+
+
+logger = logging.getLogger(__name__)
+
+# deletionJobs/{uid}: status is pending, running, failed (to be retried),
+# abandoned (out of attempts) or completed.
+# steps lists the finished steps ("auth", "index", "llmUsage", "sub:{name}",
+# "user"), so a resumed job skips them.
+DELETION_COLLECTION = "deletionJobs"
+# A running job whose lease has expired is assumed dead and may be resumed
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 5
+PARALLEL_STEPS = 4
+DELETE_CHUNK_SIZE = 500
+
+
+def request_deletion(db: google.cloud.firestore.Client, uid: str) -> Dict[str, Any]:
+    """
+    Creates the deletion job for uid, or returns the existing one. The
+    cascade itself runs in the background (run_deletion_job).
+    """
+    job_ref = db.collection(DELETION_COLLECTION).document(uid)
+    job = {
+        "uid": uid,
+        "status": "pending",
+        "steps": [],
+        "deletedDocs": 0,
+        "attempts": 0,
+        "requested": int(time.time()),
+        "updated": int(time.time()),
+        "leaseExpires": 0,
+    }
+    try:
+        job_ref.create(job)
+    except AlreadyExists:
+        job = job_ref.get().to_dict()
+    return job
+
+
+@firestore.transactional
+def _claim(transaction, job_ref) -> Optional[Dict[str, Any]]:
+    """Takes the job's lease; None when it is finished, leased or out of attempts"""
+    snapshot = job_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    job = snapshot.to_dict()
+    now = int(time.time())
+    if job["status"] == "completed":
+        return None
+    if job["status"] == "running" and job.get("leaseExpires", 0) > now:
+        return None
+    if job.get("attempts", 0) >= MAX_ATTEMPTS:
+        return None
+    transaction.update(
+        job_ref,
+        {
+            "status": "running",
+            "attempts": firestore.Increment(1),
+            "leaseExpires": now + LEASE_SECONDS,
+            "updated": now,
+        },
+    )
+    return job
+
+
+def _delete_auth_account(db, uid) -> int:
+    try:
+        auth.delete_user(uid)
+    except auth.UserNotFoundError:
+        pass
+    return 0
+
+
+def _delete_index(db, uid) -> int:
+    delete_achievement_index(db, uid)
+    return 0
+
+
+def _delete_subcollection(name: str) -> Callable[[Any, str], int]:
+    def delete(db, uid) -> int:
+        collection = db.collection("users").document(uid).collection(name)
+        return db.recursive_delete(
+            collection, bulk_writer=db.bulk_writer(), chunk_size=DELETE_CHUNK_SIZE
+        )
+
+    return delete
+
+
+def _finish_step(job_ref, step: str, deleted: int) -> None:
+    now = int(time.time())
+    job_ref.update(
+        {
+            "steps": firestore.ArrayUnion([step]),
+            "deletedDocs": firestore.Increment(deleted),
+            "leaseExpires": now + LEASE_SECONDS,
+            "updated": now,
+        }
+    )
+
+
+def run_deletion_job(db: google.cloud.firestore.Client, uid: str) -> bool:
+    """
+    Runs (or resumes) the deletion cascade for uid. The Auth account, the
+    achievement index, the per-user LLM usage counters and each
+    subcollection of users/{uid} are deleted in parallel, with subcollections paged through a BulkWriter; the user
+    document goes last, together with anything written under it meanwhile.
+    Returns whether the job is now complete.
+    """
+    job_ref = db.collection(DELETION_COLLECTION).document(uid)
+    job = _claim(db.transaction(), job_ref)
+    if job is None:
+        return False
+    done = set(job.get("steps", []))
+    user_ref = db.collection("users").document(uid)
+
+    steps = {
+        "auth": _delete_auth_account,
+        "index": _delete_index,
+        "llmUsage": delete_user_usage,
+    }
+    for collection in user_ref.collections():
+        steps[f"sub:{collection.id}"] = _delete_subcollection(collection.id)
+    pending = {name: step for name, step in steps.items() if name not in done}
+
+    try:
+        with ThreadPoolExecutor(max_workers=PARALLEL_STEPS) as pool:
+            futures = {
+                name: pool.submit(step, db, uid) for name, step in pending.items()
+            }
+            errors = []
+            for name, future in futures.items():
+                try:
+                    _finish_step(job_ref, name, future.result())
+                except Exception as e:
+                    logger.exception("Error in deletion step %s for %s", name, uid)
+                    errors.append(f"{name}: {e}")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+        deleted = db.recursive_delete(user_ref, chunk_size=DELETE_CHUNK_SIZE)
+        invalidate_user(uid)
+        now = int(time.time())
+        job_ref.update(
+            {
+                "status": "completed",
+                "steps": firestore.ArrayUnion(["user"]),
+                "deletedDocs": firestore.Increment(deleted),
+                "completed": now,
+                "updated": now,
+                "error": firestore.DELETE_FIELD,
+            }
+        )
+        logger.info("Deleted user %s", uid)
+        return True
+    except Exception as e:
+        logger.exception("Error deleting user %s", uid)
+        attempts = job.get("attempts", 0) + 1
+        job_ref.update(
+            {
+                "status": "failed" if attempts < MAX_ATTEMPTS else "abandoned",
+                "error": str(e)[:1000],
+                "leaseExpires": 0,
+                "updated": int(time.time()),
+            }
+        )
+        return False
+
+
+def resume_deletion_jobs(db: google.cloud.firestore.Client, limit: int = 50) -> int:
+    """Runs unfinished jobs that are not leased; returns how many completed"""
+    query = (
+        db.collection(DELETION_COLLECTION)
+        .where(filter=FieldFilter("status", "in", ["pending", "running", "failed"]))
+        .limit(limit)
+    )
+    now = int(time.time())
+    completed = 0
+    for snapshot in query.stream():
+        job = snapshot.to_dict()
+        if job.get("leaseExpires", 0) > now:
+            continue
+        if run_deletion_job(db, snapshot.id):
+            completed += 1
+    return completed
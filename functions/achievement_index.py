@@ -0,0 +1,310 @@
+import datetime
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+import google.cloud.firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from user_cache import write_stamp
+
+logger = logging.getLogger(__name__)
+
+
+# One small document per generated achievement, keyed "{uid}_{achievementId}".
+# The nightly rollover and the active/due lookups query this collection by
+# uid, type, status and dates instead of loading every user's plan.
+INDEX_COLLECTION = "achievementIndex"
+ROLLOVER_MODES = ["expire", "reanchor"]
+ROLLOVER_PAGE_SIZE = 500
+MAX_BATCH_WRITES = 500
+REMINDER_DATE_FIELDS = ["startDate", "endDate"]
+MAX_REMINDER_PAGE_SIZE = 1000
+
+
+def achievement_status(achievement: Dict[str, Any]) -> str:
+    if achievement.get("completed"):
+        return "completed"
+    if achievement.get("expired"):
+        return "expired"
+    return "active"
+
+
+def current_planet_index(achievements: Dict[str, Any]) -> int:
+    """Index of the first planet that still has an active achievement"""
+    planets = achievements.get("planets", [])
+    for index, planet in enumerate(planets):
+        for achievement in planet.get("achievements", []):
+            if achievement_status(achievement) == "active":
+                return index
+    return len(planets)
+
+
+def index_entries(uid: str, achievements: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    entries = {}
+    for planet_index, planet in enumerate(achievements.get("planets", [])):
+        for achievement in planet.get("achievements", []):
+            if "id" not in achievement:
+                continue
+            data = achievement.get("data", {})
+            entries[f"{uid}_{achievement['id']}"] = {
+                "uid": uid,
+                "achievementId": achievement["id"],
+                "planet": planet_index,
+                "name": achievement.get("name"),
+                "type": achievement.get("type"),
+                "startDate": data.get("startDate"),
+                "endDate": data.get("endDate"),
+                "status": achievement_status(achievement),
+            }
+    return entries
+
+
+def _existing_index_refs(db: google.cloud.firestore.Client, uid: str) -> list:
+    query = (
+        db.collection(INDEX_COLLECTION)
+        .where(filter=FieldFilter("uid", "==", uid))
+        .select([])
+    )
+    return [doc.reference for doc in query.stream()]
+
+
+def _replace_index(batch, collection, existing_refs, uid, achievements) -> None:
+    entries = index_entries(uid, achievements)
+    for ref in existing_refs:
+        if ref.id not in entries:
+            batch.delete(ref)
+    for doc_id, entry in entries.items():
+        batch.set(collection.document(doc_id), entry)
+
+
+def write_achievement_index(
+    db: google.cloud.firestore.Client,
+    batch: google.cloud.firestore.WriteBatch,
+    uid: str,
+    achievements: Dict[str, Any],
+) -> None:
+    """
+    Adds writes to batch that replace the uid's index entries with entries
+    for achievements, so the plan and its index are committed together.
+    """
+    _replace_index(
+        batch,
+        db.collection(INDEX_COLLECTION),
+        _existing_index_refs(db, uid),
+        uid,
+        achievements,
+    )
+
+
+def mark_index_completed(
+    db: google.cloud.firestore.Client,
+    writer,
+    uid: str,
+    achievements: Dict[str, Any],
+    achievement_ids: List[int],
+) -> None:
+    """Adds writes to writer (a batch or transaction) refreshing these entries"""
+    collection = db.collection(INDEX_COLLECTION)
+    entries = index_entries(uid, achievements)
+    for achievement_id in achievement_ids:
+        doc_id = f"{uid}_{achievement_id}"
+        if doc_id in entries:
+            writer.set(collection.document(doc_id), entries[doc_id])
+
+
+async def awrite_achievement_index(
+    adb: google.cloud.firestore.AsyncClient,
+    batch: google.cloud.firestore.AsyncWriteBatch,
+    uid: str,
+    achievements: Dict[str, Any],
+) -> None:
+    """write_achievement_index for the async Firestore client"""
+    collection = adb.collection(INDEX_COLLECTION)
+    query = collection.where(filter=FieldFilter("uid", "==", uid)).select([])
+    existing_refs = [doc.reference async for doc in query.stream()]
+    _replace_index(batch, collection, existing_refs, uid, achievements)
+
+
+def delete_achievement_index(db: google.cloud.firestore.Client, uid: str) -> None:
+    refs = _existing_index_refs(db, uid)
+    for start in range(0, len(refs), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref in refs[start : start + MAX_BATCH_WRITES]:
+            batch.delete(ref)
+        batch.commit()
+
+
+def active_achievements(
+    db: google.cloud.firestore.Client, uid: str, today: datetime.date
+) -> List[Dict[str, Any]]:
+    """Index entries for the uid's achievements running today, soonest deadline first"""
+    query = (
+        db.collection(INDEX_COLLECTION)
+        .where(filter=FieldFilter("uid", "==", uid))
+        .where(filter=FieldFilter("status", "==", "active"))
+        .where(filter=FieldFilter("endDate", ">=", today.isoformat()))
+        .order_by("endDate")
+    )
+    today_str = today.isoformat()
+    # Only one range filter per query, so startDate is checked here; a user
+    # has at most a few dozen entries
+    return [
+        entry
+        for entry in (doc.to_dict() for doc in query.stream())
+        if (entry.get("startDate") or "") <= today_str
+    ]
+
+
+def achievements_due_on(
+    db: google.cloud.firestore.Client,
+    date: datetime.date,
+    date_field: str = "endDate",
+    achievement_type: Optional[str] = None,
+    page_size: int = 500,
+    start_after: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Active achievements across all users whose date_field equals date, for
+    reminder jobs. Results are ordered by document id; pass the last entry's
+    "key" as start_after to fetch the next page.
+    """
+    if date_field not in REMINDER_DATE_FIELDS:
+        raise ValueError(f"Unknown date field: {date_field}")
+
+    query = (
+        db.collection(INDEX_COLLECTION)
+        .where(filter=FieldFilter("status", "==", "active"))
+        .where(filter=FieldFilter(date_field, "==", date.isoformat()))
+    )
+    if achievement_type is not None:
+        query = query.where(filter=FieldFilter("type", "==", achievement_type))
+    query = query.order_by("__name__").limit(page_size)
+    if start_after is not None:
+        query = query.start_after({"__name__": start_after})
+    return [{"key": doc.id, **doc.to_dict()} for doc in query.stream()]
+
+
+def _reanchor(data: Dict[str, Any], today: datetime.date) -> None:
+    """Restart an achievement today, keeping its original duration"""
+    start = datetime.date.fromisoformat(data["startDate"])
+    end = datetime.date.fromisoformat(data["endDate"])
+    data["startDate"] = today.isoformat()
+    data["endDate"] = (today + max(end - start, datetime.timedelta(0))).isoformat()
+
+
+def _roll_over_user(
+    db: google.cloud.firestore.Client,
+    uid: str,
+    achievement_ids: List[int],
+    today: datetime.date,
+    mode: str,
+) -> Optional[int]:
+    user_ref = db.collection("users").document(uid)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        # Entries left behind by a deleted user
+        delete_achievement_index(db, uid)
+        return None
+
+    achievements = (user_doc.to_dict() or {}).get("achievements") or {}
+    due = set(achievement_ids)
+    for planet in achievements.get("planets", []):
+        for achievement in planet.get("achievements", []):
+            if achievement.get("id") not in due:
+                continue
+            if achievement_status(achievement) != "active":
+                continue
+            if mode == "reanchor":
+                _reanchor(achievement["data"], today)
+            else:
+                achievement["expired"] = True
+
+    current_planet = current_planet_index(achievements)
+    batch = db.batch()
+    batch.update(
+        user_ref,
+        {
+            "achievements": achievements,
+            "currentPlanet": current_planet,
+            **write_stamp("achievements"),
+        },
+        option=db.write_option(last_update_time=user_doc.update_time),
+    )
+    write_achievement_index(db, batch, uid, achievements)
+    batch.commit()
+    return current_planet
+
+
+def rollover_expired(
+    db: google.cloud.firestore.Client,
+    today: datetime.date,
+    mode: str = "expire",
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Finds active achievements whose endDate is before today and either marks
+    them expired or restarts them, then moves each affected user to the
+    first planet that still has active achievements. Users are rolled over
+    one index page at a time; no new page is started after deadline (a
+    time.monotonic() value). Rolled-over entries no longer match the query,
+    so the next run continues with the rest.
+
+    Args:
+        db: Firestore client
+        today: Local date the deadlines are compared against
+        mode: "expire" or "reanchor"
+        deadline: Monotonic time after which the run stops early
+
+    Returns:
+        Counts of achievements and users processed, and whether every due
+        achievement was reached
+    """
+    if mode not in ROLLOVER_MODES:
+        raise ValueError(f"Unknown rollover mode: {mode}")
+
+    query = (
+        db.collection(INDEX_COLLECTION)
+        .where(filter=FieldFilter("status", "==", "active"))
+        .where(filter=FieldFilter("endDate", "<", today.isoformat()))
+        .order_by("endDate")
+        .order_by("__name__")
+        .limit(ROLLOVER_PAGE_SIZE)
+    )
+
+    achievements_due = 0
+    users_updated = 0
+    users_failed = 0
+    complete = False
+    last_doc = None
+    while deadline is None or time.monotonic() < deadline:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        page = list(page_query.stream())
+        due_by_uid: Dict[str, List[int]] = {}
+        for doc in page:
+            entry = doc.to_dict()
+            due_by_uid.setdefault(entry["uid"], []).append(entry["achievementId"])
+            achievements_due += 1
+
+        for uid, achievement_ids in due_by_uid.items():
+            try:
+                if _roll_over_user(db, uid, achievement_ids, today, mode) is not None:
+                    users_updated += 1
+            except Exception:
+                # Usually a concurrent write; the entry is still active and is
+                # picked up again on the next run
+                users_failed += 1
+                logger.warning(
+                    "Error rolling over achievements for %s", uid, exc_info=True
+                )
+
+        if len(page) < ROLLOVER_PAGE_SIZE:
+            complete = True
+            break
+        last_doc = page[-1]
+
+    return {
+        "achievementsDue": achievements_due,
+        "usersUpdated": users_updated,
+        "usersFailed": users_failed,
+        "complete": complete,
+    }
@@ -0,0 +1,95 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+from typing import Any, Coroutine, Optional
+
+from firebase_admin import firestore_async
+
+from load_control import DeadlineExceededError, remaining_seconds
+
+
+# Handlers stay synchronous (the functions framework calls them from its
+# worker threads) and hand their I/O-bound work to one event loop running
+# in a background thread, so concurrent requests share a single loop and a
+# single async Firestore client.
+# Sync helpers (Admin SDK calls, the sync Firestore client) run in this
+# many threads via asyncio.to_thread
+ASYNC_WORKER_THREADS = int(os.getenv("ASYNC_WORKER_THREADS", "64"))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_db = None
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=ASYNC_WORKER_THREADS, thread_name_prefix="async-worker"
+                )
+            )
+            thread = threading.Thread(
+                target=loop.run_forever, name="async-runtime", daemon=True
+            )
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+async def _with_deadline(coro: Coroutine[Any, Any, Any], remaining: float) -> Any:
+    try:
+        return await asyncio.wait_for(coro, max(remaining, 0))
+    except asyncio.TimeoutError:
+        raise DeadlineExceededError("Request deadline exceeded") from None
+
+
+def run(coro: Coroutine[Any, Any, Any]) -> Any:
+    """
+    Runs coro on the background loop and waits for its result. The caller's
+    context variables (request timer, deadline, ...) are visible to coro,
+    and coro is cancelled if the request's deadline passes.
+    """
+    loop = _get_loop()
+    context = contextvars.copy_context()
+    remaining = remaining_seconds()
+    if remaining is not None:
+        coro = _with_deadline(coro, remaining)
+    result: concurrent.futures.Future = concurrent.futures.Future()
+
+    def on_done(task: asyncio.Task) -> None:
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def start() -> None:
+        task = loop.create_task(coro, context=context)
+        task.add_done_callback(on_done)
+
+    loop.call_soon_threadsafe(start)
+    return result.result()
+
+
+async def _create_async_db():
+    return firestore_async.client()
+
+
+def async_db():
+    """
+    The async Firestore client, created on (and bound to) the background
+    loop. Call it from handler threads, not from coroutines on that loop.
+    """
+    global _async_db
+    if _async_db is None:
+        client = run(_create_async_db())
+        with _lock:
+            if _async_db is None:
+                _async_db = client
+    return _async_db
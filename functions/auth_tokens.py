@@ -0,0 +1,211 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import firebase_admin
+from firebase_admin import auth
+from google.auth import exceptions as google_auth_exceptions
+from google.auth import jwt
+
+
+logger = logging.getLogger(__name__)
+
+ID_TOKEN_CERT_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/"
+    "securetoken@system.gserviceaccount.com"
+)
+# Refresh this long before Google's Cache-Control max-age runs out
+KEY_REFRESH_MARGIN_SECONDS = 300
+KEY_RETRY_SECONDS = 60
+# After a failed fetch, requests use what is cached (or fail) for this long
+# instead of each waiting on another fetch
+KEY_FAILURE_BACKOFF_SECONDS = 5
+CLOCK_SKEW_SECONDS = 10
+MAX_CACHED_TOKENS = 10000
+
+
+class InvalidTokenError(Exception):
+    """Raised when a request carries no usable ID token"""
+
+
+class SigningKeys:
+    """
+    Google's ID-token signing certificates, fetched once and then refreshed
+    on a background timer before they expire, so verification normally
+    never waits on the network after the first request. The timer gets
+    little CPU between requests, so certs() also refetches synchronously
+    when the cached certificates are past their max-age or a token names an
+    unknown key (at most once per KEY_RETRY_SECONDS), but not within
+    KEY_FAILURE_BACKOFF_SECONDS of a failed fetch.
+    """
+
+    def __init__(self, url: str = ID_TOKEN_CERT_URL):
+        self.url = url
+        self._certs: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._failed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def _fetch(self) -> float:
+        """Loads the certificates; returns their max-age in seconds"""
+        self._fetched_at = time.monotonic()
+        with urllib.request.urlopen(self.url, timeout=10) as response:
+            certs = json.loads(response.read())
+            cache_control = response.headers.get("Cache-Control", "")
+        match = re.search(r"max-age=(\d+)", cache_control)
+        max_age = float(match.group(1)) if match else 3600.0
+        self._certs = certs
+        self._expires_at = self._fetched_at + max_age
+        return max_age
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self) -> None:
+        try:
+            max_age = self._fetch()
+            delay = max(KEY_RETRY_SECONDS, max_age - KEY_REFRESH_MARGIN_SECONDS)
+            self._failed_at = None
+        except Exception:
+            logger.warning("Error refreshing ID token signing keys", exc_info=True)
+            delay = KEY_RETRY_SECONDS
+            self._failed_at = time.monotonic()
+        self._schedule(delay)
+
+    def _stale(self, kid: Optional[str]) -> bool:
+        if (
+            self._failed_at is not None
+            and time.monotonic() - self._failed_at < KEY_FAILURE_BACKOFF_SECONDS
+        ):
+            return False
+        if not self._certs or time.monotonic() >= self._expires_at:
+            return True
+        return (
+            kid is not None
+            and kid not in self._certs
+            and time.monotonic() - self._fetched_at >= KEY_RETRY_SECONDS
+        )
+
+    def certs(self, kid: Optional[str] = None) -> Dict[str, str]:
+        """The current certificates, by key id; kid is the token's key"""
+        if self._stale(kid):
+            with self._lock:
+                if self._stale(kid):
+                    self._refresh()
+        return self._certs
+
+
+class TokenCache:
+    """Bounded LRU of decoded claims keyed by a hash of the token"""
+
+    def __init__(self, max_size: int = MAX_CACHED_TOKENS):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None:
+                return None
+            if claims["exp"] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, key: str, claims: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+_keys = SigningKeys()
+_cache = TokenCache()
+
+
+def _project_id() -> str:
+    return (
+        os.getenv("GCLOUD_PROJECT")
+        or os.getenv("GOOGLE_CLOUD_PROJECT")
+        or firebase_admin.get_app().project_id
+    )
+
+
+def _token_kid(token: str) -> Optional[str]:
+    """The unverified key id from the token's header, if it has one"""
+    try:
+        segment = token.split(".", 1)[0]
+        padded = segment + "=" * (-len(segment) % 4)
+        kid = json.loads(base64.urlsafe_b64decode(padded)).get("kid")
+    except Exception:
+        return None
+    return kid if isinstance(kid, str) else None
+
+
+def _verify_locally(token: str) -> Dict[str, Any]:
+    project_id = _project_id()
+    try:
+        claims = jwt.decode(
+            token,
+            certs=_keys.certs(_token_kid(token)),
+            audience=project_id,
+            clock_skew_in_seconds=CLOCK_SKEW_SECONDS,
+        )
+    except (ValueError, google_auth_exceptions.GoogleAuthError) as e:
+        raise InvalidTokenError(str(e)) from e
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise InvalidTokenError("Token has an invalid issuer")
+    if not claims.get("sub") or len(claims["sub"]) > 128:
+        raise InvalidTokenError("Token has an invalid subject")
+    if claims.get("auth_time", 0) > time.time() + CLOCK_SKEW_SECONDS:
+        raise InvalidTokenError("Token auth_time is in the future")
+    claims["uid"] = claims["sub"]
+    return claims
+
+
+def verify_id_token(token: str) -> Dict[str, Any]:
+    """
+    Decoded claims of a Firebase ID token. Tokens are verified against the
+    cached signing keys without a network call, and their claims are kept
+    until the token expires. Revocation is not checked. Emulator tokens are
+    unsigned, so under the Auth emulator the Admin SDK verifies them instead.
+    """
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = _cache.get(key)
+    if claims is not None:
+        return claims
+    if os.getenv("FIREBASE_AUTH_EMULATOR_HOST"):
+        try:
+            claims = auth.verify_id_token(token)
+        except (ValueError, auth.InvalidIdTokenError) as e:
+            raise InvalidTokenError(str(e)) from e
+    else:
+        claims = _verify_locally(token)
+    _cache.put(key, claims)
+    return claims
+
+
+def uid_from_request(req) -> str:
+    """uid of the verified bearer token in the Authorization header"""
+    header = req.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise InvalidTokenError("Missing bearer token")
+    return verify_id_token(token.strip())["uid"]
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import os
+import secrets
+import string
+import time
+from typing import Any, Dict, List
+
+import google.cloud.firestore
+from firebase_admin import auth
+
+from user_cache import write_stamp
+
+
+logger = logging.getLogger(__name__)
+
+# Limits of auth.import_users, auth.get_users and a Firestore batch
+IMPORT_CHUNK_SIZE = 1000
+LOOKUP_CHUNK_SIZE = 100
+FIRESTORE_BATCH_SIZE = 500
+MAX_BULK_USERS = 5000
+# Imported hashes are upgraded to Firebase's own scrypt on first sign-in, so
+# the rounds only need to cover the time until then
+PBKDF2_ROUNDS = int(os.getenv("BULK_PBKDF2_ROUNDS", "20000"))
+UID_ALPHABET = string.ascii_letters + string.digits
+
+
+def new_user_profile(email: str, first_name: str, last_name: str) -> Dict[str, Any]:
+    """Fields of a newly created user document"""
+    return {
+        "firstName": first_name,
+        "lastName": last_name,
+        "email": email,
+        "joined": int(time.time()),
+        "money": 0,
+        **write_stamp(),
+    }
+
+
+def _new_uid() -> str:
+    return "".join(secrets.choice(UID_ALPHABET) for _ in range(28))
+
+
+def _existing_emails(emails: List[str]) -> set:
+    existing = set()
+    for start in range(0, len(emails), LOOKUP_CHUNK_SIZE):
+        result = auth.get_users(
+            [
+                auth.EmailIdentifier(email)
+                for email in emails[start : start + LOOKUP_CHUNK_SIZE]
+            ]
+        )
+        existing.update(user.email.lower() for user in result.users if user.email)
+    return existing
+
+
+def _import_record(uid: str, row: Dict[str, Any]) -> auth.ImportUserRecord:
+    salt = secrets.token_bytes(16)
+    password_hash = hashlib.pbkdf2_hmac(
+        "sha256", row["password"].encode("utf-8"), salt, PBKDF2_ROUNDS
+    )
+    return auth.ImportUserRecord(
+        uid=uid,
+        email=row["email"],
+        display_name=f"{row['firstName']} {row['lastName']}",
+        password_hash=password_hash,
+        password_salt=salt,
+    )
+
+
+def _write_profiles(
+    db: google.cloud.firestore.Client, created: List[tuple]
+) -> List[tuple]:
+    """Writes profile documents for (uid, row) pairs; returns the failed pairs"""
+    failed = []
+    for start in range(0, len(created), FIRESTORE_BATCH_SIZE):
+        chunk = created[start : start + FIRESTORE_BATCH_SIZE]
+        batch = db.batch()
+        for uid, row in chunk:
+            batch.set(
+                db.collection("users").document(uid),
+                new_user_profile(row["email"], row["firstName"], row["lastName"]),
+            )
+        try:
+            batch.commit()
+        except Exception:
+            logger.exception("Error writing %d onboarded profiles", len(chunk))
+            failed.extend(chunk)
+    return failed
+
+
+def onboard_users(
+    db: google.cloud.firestore.Client, rows: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Creates Auth accounts and profile documents for already validated rows
+    (email, password, firstName, lastName). Accounts are created with
+    auth.import_users, 1000 at a time, and profiles are written in batches
+    of 500. Returns one {"index", "email", "uid" | "error"} per row, in order.
+    Accounts whose profile could not be written are deleted again.
+    """
+    results: List[Dict[str, Any]] = [
+        {"index": index, "email": row["email"]} for index, row in enumerate(rows)
+    ]
+    existing = _existing_emails([row["email"] for row in rows])
+
+    pending = []
+    for index, row in enumerate(rows):
+        if row["email"].lower() in existing:
+            results[index]["error"] = "Email already exists"
+        else:
+            pending.append(index)
+
+    for start in range(0, len(pending), IMPORT_CHUNK_SIZE):
+        indexes = pending[start : start + IMPORT_CHUNK_SIZE]
+        uids = [_new_uid() for _ in indexes]
+        records = [
+            _import_record(uid, rows[index]) for uid, index in zip(uids, indexes)
+        ]
+        import_result = auth.import_users(
+            records, hash_alg=auth.UserImportHash.pbkdf2_sha256(rounds=PBKDF2_ROUNDS)
+        )
+        failed_positions = {}
+        for error in import_result.errors:
+            failed_positions[error.index] = error.reason
+
+        created = []
+        for position, (uid, index) in enumerate(zip(uids, indexes)):
+            if position in failed_positions:
+                results[index]["error"] = failed_positions[position]
+            else:
+                created.append((uid, rows[index]))
+                results[index]["uid"] = uid
+
+        unwritten = _write_profiles(db, created)
+        if unwritten:
+            auth.delete_users([uid for uid, _ in unwritten])
+            unwritten_uids = {uid for uid, _ in unwritten}
+            for result in results:
+                if result.get("uid") in unwritten_uids:
+                    del result["uid"]
+                    result["error"] = "Error writing user profile"
+
+    return results
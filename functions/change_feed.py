@@ -0,0 +1,108 @@
+import base64
+import json
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import google.cloud.firestore
+
+from user_cache import SECTION_VERSIONS_FIELD, SECTIONS
+
+# Longest a single poll may wait for a change
+MAX_WAIT_SECONDS = 25
+MIN_WAIT_SECONDS = 1
+
+
+def section_versions(user_data: Dict[str, Any]) -> Dict[str, int]:
+    versions = user_data.get(SECTION_VERSIONS_FIELD) or {}
+    return {section: versions.get(section, 0) for section in SECTIONS}
+
+
+def encode_token(versions: Dict[str, int]) -> str:
+    """Opaque resume token for the given section versions"""
+    raw = json.dumps([versions[section] for section in SECTIONS]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_token(token: str) -> Dict[str, int]:
+    """Section versions of a resume token; raises ValueError when malformed"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception as e:
+        raise ValueError("Invalid resume token") from e
+    if (
+        not isinstance(values, list)
+        or len(values) != len(SECTIONS)
+        or not all(isinstance(v, int) and not isinstance(v, bool) for v in values)
+    ):
+        raise ValueError("Invalid resume token")
+    return dict(zip(SECTIONS, values))
+
+
+def _section_state(user_data: Dict[str, Any], section: str) -> Any:
+    if section == "money":
+        return user_data.get("money", 0)
+    if section == "achievements":
+        completed = [
+            achievement.get("id")
+            for planet in (user_data.get("achievements") or {}).get("planets", [])
+            for achievement in planet.get("achievements", [])
+            if achievement.get("completed")
+        ]
+        return {
+            "completed": completed,
+            "currentPlanet": user_data.get("currentPlanet", 0),
+        }
+    # gameData can be large; clients refetch it when its version moves
+    return {"version": section_versions(user_data)["gameData"]}
+
+
+def changes_since(
+    user_data: Dict[str, Any], since: Optional[Dict[str, int]]
+) -> Dict[str, Any]:
+    """The state of every section newer than since (all of them without since)"""
+    versions = section_versions(user_data)
+    # A token from before the document was recreated starts over
+    if since is not None and any(versions[s] < since[s] for s in SECTIONS):
+        since = None
+    return {
+        section: _section_state(user_data, section)
+        for section in SECTIONS
+        if since is None or versions[section] > since[section]
+    }
+
+
+def wait_for_changes(
+    db: google.cloud.firestore.Client,
+    uid: str,
+    since: Dict[str, int],
+    timeout: float,
+) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    Watches users/{uid} until a section moves past since or timeout seconds
+    pass. Returns (whether the user exists, latest document data); the data
+    is None when no snapshot arrived in time. The watch's initial snapshot
+    is the only read while nothing changes.
+    """
+    changed = threading.Event()
+    latest: Dict[str, Any] = {}
+
+    def on_snapshot(snapshots, changes, read_time):
+        snapshot = snapshots[0] if snapshots else None
+        if snapshot is None or not snapshot.exists:
+            latest["data"] = None
+            latest["exists"] = False
+            changed.set()
+            return
+        data = snapshot.to_dict()
+        latest["data"] = data
+        latest["exists"] = True
+        if changes_since(data, since):
+            changed.set()
+
+    watch = db.collection("users").document(uid).on_snapshot(on_snapshot)
+    try:
+        changed.wait(timeout)
+    finally:
+        watch.unsubscribe()
+    return latest.get("exists", True), latest.get("data")
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, Tuple
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# gameData is stored either verbatim as a map, or (GAME_DATA_CODEC=zlib) as
+# zlib-compressed compact JSON bytes with gameDataCodec set to the version
+# below. Reads handle both, so the codec can be switched at any time.
+CODEC_FIELD = "gameDataCodec"
+ZLIB_JSON_CODEC = 1
+GAME_DATA_CODEC = os.getenv("GAME_DATA_CODEC", "none").lower()
+GAME_DATA_CODECS = ["none", "zlib"]
+# Limit on the serialized JSON a client may store
+MAX_GAME_DATA_BYTES = int(os.getenv("MAX_GAME_DATA_BYTES", str(512 * 1024)))
+# Stored bytes must leave room for the rest of the 1 MiB user document
+MAX_STORED_GAME_DATA_BYTES = 768 * 1024
+
+
+class GameDataTooLargeError(ValueError):
+    """Raised when gameData exceeds the configured size limits"""
+
+
+def encode_game_data(
+    game_data: Dict[str, Any]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    The user document fields storing game_data under GAME_DATA_CODEC, and
+    stats for the save (rawBytes, storedBytes, encodeMs).
+    """
+    started = time.perf_counter()
+    raw = json.dumps(game_data, separators=(",", ":")).encode("utf-8")
+    if len(raw) > MAX_GAME_DATA_BYTES:
+        raise GameDataTooLargeError(
+            f"gameData must be at most {MAX_GAME_DATA_BYTES} bytes as JSON"
+        )
+
+    if GAME_DATA_CODEC == "zlib":
+        stored = zlib.compress(raw, 6)
+        fields = {"gameData": stored, CODEC_FIELD: ZLIB_JSON_CODEC}
+        stored_bytes = len(stored)
+    else:
+        fields = {"gameData": game_data, CODEC_FIELD: None}
+        stored_bytes = len(raw)
+    if stored_bytes > MAX_STORED_GAME_DATA_BYTES:
+        raise GameDataTooLargeError("gameData is too large to store")
+
+    stats = {
+        "codec": GAME_DATA_CODEC,
+        "rawBytes": len(raw),
+        "storedBytes": stored_bytes,
+        "encodeMs": round((time.perf_counter() - started) * 1000, 2),
+    }
+    return fields, stats
+
+
+def decode_game_data(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The gameData map of a user document, whichever way it was stored"""
+    game_data = user_data.get("gameData", {})
+    codec = user_data.get(CODEC_FIELD)
+    if codec is None:
+        return game_data
+    if codec != ZLIB_JSON_CODEC:
+        raise ValueError(f"Unknown gameData codec {codec}")
+    return json.loads(zlib.decompress(game_data))
+
+
+def decoded_user_data(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """A copy of a user document with gameData decoded and the codec field dropped"""
+    data = {key: value for key, value in user_data.items() if key != CODEC_FIELD}
+    if "gameData" in user_data:
+        data["gameData"] = decode_game_data(user_data)
+    return data
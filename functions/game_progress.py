@@ -0,0 +1,198 @@
+import copy
+import math
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.cloud.firestore
+from firebase_admin import firestore
+
+from achievement_index import (
+    current_planet_index,
+    index_entries,
+    mark_index_completed,
+)
+from user_cache import write_stamp
+
+
+# users/{uid}/gameProgress/{achievementId}: counters holds the running total
+# of every metric the game has reported, events the number of events.
+# Achievement ids restart with every generated plan, so each document also
+# records the user's planId; counters from another plan are discarded.
+PROGRESS_COLLECTION = "gameProgress"
+PLAN_ID_FIELD = "planId"
+MAX_EVENTS_PER_BATCH = 500
+# A game achievement without data.goal is met by one "completions" event
+DEFAULT_GOAL = {"metric": "completions", "value": 1}
+METRIC_REGEX = r"^[A-Za-z][A-Za-z0-9_]{0,39}$"
+
+
+def game_goal(achievement: Dict[str, Any]) -> Dict[str, Any]:
+    return achievement.get("data", {}).get("goal") or DEFAULT_GOAL
+
+
+def _event_error(event: Any) -> Optional[str]:
+    if not isinstance(event, dict):
+        return "Event must be an object"
+    achievement_id = event.get("achievementId")
+    if not isinstance(achievement_id, int) or isinstance(achievement_id, bool):
+        return "achievementId must be an integer"
+    metric = event.get("metric")
+    if not isinstance(metric, str) or not re.match(METRIC_REGEX, metric):
+        return "metric must be a name of letters, digits and underscores"
+    value = event.get("value", 1)
+    if (
+        not isinstance(value, (int, float))
+        or isinstance(value, bool)
+        or not math.isfinite(value)
+        or value <= 0
+    ):
+        return "value must be a positive number"
+    return None
+
+
+def aggregate_events(
+    events: List[Any],
+) -> Tuple[Dict[int, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Sums valid events per game: {achievementId: {"counters": {metric: sum},
+    "events": count}}. Invalid events are returned as {"index", "error"}.
+    """
+    deltas: Dict[int, Dict[str, Any]] = {}
+    rejected = []
+    for index, event in enumerate(events):
+        error = _event_error(event)
+        if error:
+            rejected.append({"index": index, "error": error})
+            continue
+        delta = deltas.setdefault(
+            event["achievementId"], {"counters": {}, "events": 0}
+        )
+        metric = event["metric"]
+        delta["counters"][metric] = delta["counters"].get(metric, 0) + event.get(
+            "value", 1
+        )
+        delta["events"] += 1
+    return deltas, rejected
+
+
+def _game_achievements(achievements: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    return {
+        achievement["id"]: achievement
+        for planet in achievements.get("planets", [])
+        for achievement in planet.get("achievements", [])
+        if achievement.get("type") == "game" and "id" in achievement
+    }
+
+
+def _accepts_events(entry: Dict[str, Any], today: str) -> bool:
+    """Whether an index entry is active and within its date window today"""
+    return (
+        entry["status"] == "active"
+        and (entry["startDate"] or today) <= today
+        and today <= (entry["endDate"] or today)
+    )
+
+
+@firestore.transactional
+def _apply(transaction, db, uid, deltas, today):
+    user_ref = db.collection("users").document(uid)
+    progress = user_ref.collection(PROGRESS_COLLECTION)
+    ids = sorted(deltas)
+    refs = [user_ref] + [progress.document(str(i)) for i in ids]
+    snapshots = {s.reference.path: s for s in transaction.get_all(refs)}
+    user_snapshot = snapshots[user_ref.path]
+    if not user_snapshot.exists:
+        return None
+
+    user_data = user_snapshot.to_dict()
+    achievements = copy.deepcopy(user_data.get("achievements") or {})
+    plan_id = user_data.get(PLAN_ID_FIELD)
+    games = _game_achievements(achievements)
+    entries = index_entries(uid, achievements)
+    now = int(time.time())
+    result = {
+        "games": {},
+        "completed": [],
+        "unknownAchievements": [],
+        "inactiveAchievements": [],
+    }
+    for achievement_id in ids:
+        achievement = games.get(achievement_id)
+        if achievement is None:
+            result["unknownAchievements"].append(achievement_id)
+            continue
+        if not _accepts_events(entries[f"{uid}_{achievement_id}"], today):
+            result["inactiveAchievements"].append(achievement_id)
+            continue
+        delta = deltas[achievement_id]
+        ref = progress.document(str(achievement_id))
+        stored = snapshots[ref.path].to_dict() or {}
+        if stored.get(PLAN_ID_FIELD) == plan_id:
+            counters = dict(stored.get("counters", {}))
+            for metric, value in delta["counters"].items():
+                counters[metric] = counters.get(metric, 0) + value
+            transaction.set(
+                ref,
+                {
+                    "counters": {
+                        metric: firestore.Increment(value)
+                        for metric, value in delta["counters"].items()
+                    },
+                    "events": firestore.Increment(delta["events"]),
+                    "updated": now,
+                },
+                merge=True,
+            )
+        else:
+            # Left over from an earlier plan that reused this id
+            counters = dict(delta["counters"])
+            transaction.set(
+                ref,
+                {
+                    "achievementId": achievement_id,
+                    PLAN_ID_FIELD: plan_id,
+                    "counters": counters,
+                    "events": delta["events"],
+                    "updated": now,
+                },
+            )
+
+        goal = game_goal(achievement)
+        if counters.get(goal["metric"], 0) >= goal["value"]:
+            achievement["completed"] = True
+            result["completed"].append(achievement_id)
+        result["games"][str(achievement_id)] = {
+            "counters": counters,
+            "completed": bool(achievement.get("completed")),
+        }
+
+    if result["completed"]:
+        transaction.update(
+            user_ref,
+            {
+                "achievements": achievements,
+                "currentPlanet": current_planet_index(achievements),
+                **write_stamp("achievements"),
+            },
+        )
+        mark_index_completed(db, transaction, uid, achievements, result["completed"])
+    return result
+
+
+def ingest_game_events(
+    db: google.cloud.firestore.Client,
+    uid: str,
+    deltas: Dict[int, Dict[str, Any]],
+    today: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Adds aggregated event deltas to the user's game progress counters in one
+    transaction, and completes every game achievement whose goal is now
+    met, together with its index entry. Events only count towards active
+    achievements whose startDate..endDate includes today (YYYY-MM-DD).
+    Returns the games' totals, the newly completed ids, ids that are not
+    game achievements of the user and ids not accepting events; None when
+    the user does not exist.
+    """
+    return _apply(db.transaction(), db, uid, deltas, today)
@@ -1,12 +1,12 @@
-from google import generativeai as genai
-import os
 from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
+import logging
+from llm import LLMResponse, get_provider
 
 
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
+logger = logging.getLogger(__name__)
 
 
 response_schema = {
@@ -342,25 +342,17 @@ response_sample = {
 }
 
 
-def generate_gamified_structure(questionnaire: List[Dict[str, str]]) -> Dict[str, Any]:
-    """
-    Generates gamified planet and achievement structure from user questionnaire responses.
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
 
-    Args:
-        questionnaire: List of dictionaries with 'question' and 'answer' keys
 
-    Returns:
-        Dictionary containing structured planet/achievement data
+def compile_system_instruction() -> str:
     """
-    # Create a formatted string of the questionnaire
-    questionnaire_text = "\n\n".join(
-        [
-            f"{idx + 1}. Q: {qa['question']}\n   A: {qa['answer']}"
-            for idx, qa in enumerate(questionnaire)
-        ]
-    )
-
-    system_instruction = f"""You are a financial gamification expert. Your job is to analyze user responses about their financial goals and spending habits, then create an engaging gamified structure with planets and achievements.
+    Builds the static part of the plan prompt once: the guidelines, the
+    response schema and the sample, with the JSON in compact form. Nothing
+    in it depends on the user, so it can be sent as a cached context.
+    """
+    return f"""You are a financial gamification expert. Your job is to analyze user responses about their financial goals and spending habits, then create an engaging gamified structure with planets and achievements.
 
 
 IMPORTANT GUIDELINES:
@@ -396,44 +388,185 @@ DATA FIELD RULES (only include relevant fields for each type):
 - game type: requires startDate, endDate
 
 
-You must respond with valid JSON matching the specified schema. Do not include any markdown formatting or code blocks. Follow the format of {response_schema}.
-\n Here is an example of the expected response format:
-{response_sample}"""
+You must respond with valid JSON matching the specified schema. Do not include any markdown formatting or code blocks.
+Schema: {_compact_json(response_schema)}
+Example response: {_compact_json(response_sample)}
 
-    user_prompt = f"""Based on the following user questionnaire responses, create a gamified planet and achievement structure:
+Generate planets and achievements that are:
+- Directly related to the user's stated goals and spending habits
+- Achievable but challenging
+- Varied in type (mix of progress, streak, and game achievements)
+- Motivating and fun"""
 
 
-{questionnaire_text}
+SYSTEM_INSTRUCTION = compile_system_instruction()
 
 
-Generate planets and achievements that are:
-- Directly related to their stated goals and spending habits
-- Achievable but challenging
-- Varied in type (mix of progress, streak, and game achievements)
-- Motivating and fun
+def log_usage(operation: str, response: LLMResponse) -> Dict[str, Any]:
+    """Logs prompt/completion/cached token counts and latency for one call"""
+    usage = {
+        "operation": operation,
+        "model": response.model,
+        "promptTokens": response.prompt_tokens,
+        "cachedTokens": response.cached_tokens,
+        "completionTokens": response.completion_tokens,
+        "latencyMs": response.latency_ms,
+    }
+    logger.info("LLM usage: %s", usage, extra={"fields": {"llmUsage": usage}})
+    return usage
+
 
+def generate_gamified_structure(
+    questionnaire: List[Dict[str, str]], usage: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Generates gamified planet and achievement structure from user questionnaire responses.
 
-Respond with a valid JSON object matching this structure:
-{json.dumps(response_schema, indent=2)}"""
+    Only the questionnaire is sent per call; the guidelines, schema and
+    sample live in the precompiled SYSTEM_INSTRUCTION.
+
+    Args:
+        questionnaire: List of dictionaries with 'question' and 'answer' keys
+        usage: Optional dict that receives the call's token counts and model;
+            "parsed" is False when the output was not JSON
 
-    # client = genai.Client(api_key=GEMINI_API_KEY)
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-pro", system_instruction=system_instruction
+    Returns:
+        Dictionary containing structured planet/achievement data
+    """
+    response = get_provider().generate(
+        "generate_gamified_structure",
+        SYSTEM_INSTRUCTION,
+        _structure_prompt(questionnaire),
+        response_schema,
+        cache_prefix=True,
     )
+    return _parse_structure(response, usage)
 
-    response = model.generate_content(
-        user_prompt,
-        generation_config=genai.types.GenerationConfig(
-            response_mime_type="application/json",
-            response_schema=response_schema,
-        ),
+
+async def agenerate_gamified_structure(
+    questionnaire: List[Dict[str, str]], usage: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """generate_gamified_structure without blocking the event loop"""
+    response = await get_provider().agenerate(
+        "generate_gamified_structure",
+        SYSTEM_INSTRUCTION,
+        _structure_prompt(questionnaire),
+        response_schema,
+        cache_prefix=True,
     )
+    return _parse_structure(response, usage)
+
+
+def _structure_prompt(questionnaire: List[Dict[str, str]]) -> str:
+    return f"""Create the gamified planet and achievement structure for these questionnaire responses:
+
+{_format_questionnaire(questionnaire)}"""
+
+
+def _parse_structure(
+    response: LLMResponse, usage: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    call_usage = log_usage("generate_gamified_structure", response)
+    if usage is not None:
+        usage.update(call_usage, parsed=True)
     try:
         data = json.loads(response.text)
-        # print("RESPONSE DATA: " + str(data))
-        # print(response.text)
         return data
     except Exception as e:
-        print(f"Error processing response: {e}")
+        logger.warning("Error processing response: %s", e)
+        if usage is not None:
+            usage["parsed"] = False
         return response_sample
+
+
+def _format_questionnaire(questionnaire: List[Dict[str, str]]) -> str:
+    return "\n".join(
+        f"{idx + 1}. Q: {qa['question']} A: {qa['answer']}"
+        for idx, qa in enumerate(questionnaire)
+    )
+
+
+def _summarize_achievement(achievement: Dict[str, Any]) -> str:
+    data = achievement.get("data", {})
+    parts = [achievement.get("type", "?")]
+    if "moneyToSave" in data:
+        parts.append(f"${data['moneyToSave']}")
+    if "numConsecutiveDays" in data:
+        parts.append(f"{data['numConsecutiveDays']} days")
+    if "minimumStreakAmount" in data:
+        parts.append(f"min ${data['minimumStreakAmount']} {data.get('frequency', '')}")
+    parts.append(f"{data.get('startDate')}..{data.get('endDate')}")
+    if achievement.get("completed"):
+        parts.append("(completed)")
+    return " ".join(parts)
+
+
+def summarize_plan(plan: Dict[str, Any]) -> str:
+    """One line per planet: a compact stand-in for the full plan in prompts"""
+    lines = []
+    for idx, planet in enumerate(plan.get("planets", [])):
+        achievements = "; ".join(
+            _summarize_achievement(a) for a in planet.get("achievements", [])
+        )
+        lines.append(f"{idx + 1}. {planet.get('name')} [{planet.get('image')}]: {achievements}")
+    return "\n".join(lines)
+
+
+def generate_planets(
+    questionnaire: List[Dict[str, str]],
+    plan: Dict[str, Any],
+    planet_indices: List[int],
+    today: str,
+    usage: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Regenerates only the given planets of an existing plan.
+
+    The prompt carries a one-line-per-planet summary of the current plan
+    instead of the full schema and sample, so it is a fraction of the size
+    of the generate_gamified_structure prompt.
+
+    Args:
+        questionnaire: List of dictionaries with 'question' and 'answer' keys
+        plan: The user's current planet/achievement structure
+        planet_indices: Zero-based indices of the planets to replace
+        today: Current date in YYYY-MM-DD format
+        usage: Optional dict that receives the call's token counts and model
+
+    Returns:
+        Dictionary with a 'planets' list holding one planet per index, in order
+    """
+    planet_numbers = ", ".join(str(idx + 1) for idx in planet_indices)
+
+    system_instruction = """You are a financial gamification expert revising part of an existing savings plan made of 8 progressively harder planets.
+Return only the requested planets, in order, as JSON {"planets": [...]} with 1-3 achievements each.
+Keep each planet's difficulty between its neighbours, keep amounts realistic for the user's answers, and make descriptions say exactly what to do.
+Achievement data fields: progress -> startDate, endDate, moneyToSave (integer); streak -> startDate, endDate, numConsecutiveDays, minimumStreakAmount (integer), frequency (daily|weekly|monthly); game -> startDate, endDate.
+Dates are YYYY-MM-DD. No markdown."""
+
+    user_prompt = f"""Today is {today}.
+
+Questionnaire:
+{_format_questionnaire(questionnaire)}
+
+Current plan:
+{summarize_plan(plan)}
+
+Regenerate planet(s) {planet_numbers}. Completed achievements are kept separately, so do not repeat them. No start date may be before today."""
+
+    response = get_provider().generate(
+        "generate_planets",
+        system_instruction,
+        user_prompt,
+        response_schema,
+        metadata={"planet_count": len(planet_indices)},
+    )
+    call_usage = log_usage("generate_planets", response)
+    if usage is not None:
+        usage.update(call_usage)
+    data = json.loads(response.text)
+    if len(data.get("planets", [])) != len(planet_indices):
+        raise ValueError(
+            f"Expected {len(planet_indices)} planets, got {len(data.get('planets', []))}"
+        )
+    return data
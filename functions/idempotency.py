@@ -0,0 +1,103 @@
+import datetime
+import hashlib
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import google.cloud.firestore
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+
+load_dotenv()
+
+# users/{uid}/idempotency/{hash of endpoint and key}, removed by the
+# expiresAt TTL policy once IDEMPOTENCY_TTL_SECONDS have passed
+IDEMPOTENCY_COLLECTION = "idempotency"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# A pending record older than this belongs to a request that died, and the
+# key may be claimed again
+PENDING_TIMEOUT_SECONDS = 300
+MAX_KEY_LENGTH = 255
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def idempotency_ref(
+    db: google.cloud.firestore.Client, uid: str, endpoint: str, key: str
+) -> google.cloud.firestore.DocumentReference:
+    digest = hashlib.sha256(f"{endpoint}:{key}".encode("utf-8")).hexdigest()
+    return (
+        db.collection("users")
+        .document(uid)
+        .collection(IDEMPOTENCY_COLLECTION)
+        .document(digest)
+    )
+
+
+@firestore.transactional
+def _claim(transaction, ref, endpoint: str, request_hash: str):
+    snapshot = ref.get(transaction=transaction)
+    now = _now()
+    if snapshot.exists:
+        record = snapshot.to_dict()
+        if record["expiresAt"] > now:
+            if record["requestHash"] != request_hash:
+                return "mismatch", None
+            if record["status"] == "completed":
+                return "replay", record["response"]
+            if record["pendingUntil"] > now:
+                return "in_progress", None
+    transaction.set(
+        ref,
+        {
+            "endpoint": endpoint,
+            "requestHash": request_hash,
+            "status": "pending",
+            "created": now,
+            "pendingUntil": now + datetime.timedelta(seconds=PENDING_TIMEOUT_SECONDS),
+            "expiresAt": now + datetime.timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        },
+    )
+    return "claimed", None
+
+
+def claim_idempotency_key(
+    db: google.cloud.firestore.Client,
+    ref: google.cloud.firestore.DocumentReference,
+    endpoint: str,
+    body: bytes,
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Claims the key for this request. Returns ("claimed", None) when the
+    request should run, ("replay", response) when it already ran,
+    ("in_progress", None) while the first request is still running, and
+    ("mismatch", None) when the key was used with a different body.
+    """
+    request_hash = hashlib.sha256(body).hexdigest()
+    return _claim(db.transaction(), ref, endpoint, request_hash)
+
+
+def complete_idempotency_key(
+    ref: google.cloud.firestore.DocumentReference, status: int, body: str
+) -> None:
+    """Stores the response that duplicates of the request are answered with"""
+    ref.update({"status": "completed", "response": {"status": status, "body": body}})
+
+
+def complete_idempotency_key_in(
+    transaction, ref: google.cloud.firestore.DocumentReference, status: int, body: str
+) -> None:
+    """
+    complete_idempotency_key as part of the transaction that made the
+    request's changes, so they can never commit without their response
+    """
+    transaction.update(
+        ref, {"status": "completed", "response": {"status": status, "body": body}}
+    )
+
+
+def release_idempotency_key(ref: google.cloud.firestore.DocumentReference) -> None:
+    """Forgets a claim whose request failed, so a retry runs it again"""
+    ref.delete()
@@ -0,0 +1,160 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import time
+import traceback
+import uuid
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from traffic_capture import capture_request
+
+
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of successful, fast requests that get a request log line
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+PROJECT_ID = os.getenv("GCLOUD_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT")
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimer:
+    """
+    Accumulates wall time per phase for one request. end_phase(name)
+    attributes the time since the previous boundary to name, so handlers
+    only need one call after each step.
+    """
+
+    def __init__(self, function: str, request_id: str, trace: Optional[str] = None):
+        self.function = function
+        self.request_id = request_id
+        self.trace = trace
+        self.started = time.perf_counter()
+        self._boundary = self.started
+        self.phases: Dict[str, float] = {}
+
+    def end_phase(self, name: str) -> None:
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self._boundary) * 1000
+        self._boundary = now
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.phases.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+
+current_timer: contextvars.ContextVar[Optional[RequestTimer]] = contextvars.ContextVar(
+    "current_timer", default=None
+)
+
+
+def end_phase(name: str) -> None:
+    """end_phase on the current request's timer; a no-op outside a request"""
+    timer = current_timer.get()
+    if timer is not None:
+        timer.end_phase(name)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, in the shape Cloud Logging parses"""
+
+    def format(self, record):
+        entry = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+        }
+        timer = current_timer.get()
+        if timer is not None:
+            entry["requestId"] = timer.request_id
+            entry["function"] = timer.function
+            if timer.trace and PROJECT_ID:
+                entry["logging.googleapis.com/trace"] = (
+                    f"projects/{PROJECT_ID}/traces/{timer.trace}"
+                )
+        if record.exc_info:
+            entry["exception"] = "".join(traceback.format_exception(*record.exc_info))
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+    """Route all loggers through the JSON formatter at LOG_LEVEL"""
+    root = logging.getLogger()
+    if any(isinstance(h.formatter, JsonFormatter) for h in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+def _request_ids(req):
+    """(request id, trace id) from the incoming headers"""
+    trace = None
+    trace_header = req.headers.get("X-Cloud-Trace-Context")
+    if trace_header:
+        trace = trace_header.split("/")[0] or None
+    request_id = req.headers.get("X-Request-Id") or trace or uuid.uuid4().hex
+    return request_id, trace
+
+
+def instrumented(func):
+    """
+    Times an HTTP handler and reports it: adds Server-Timing and
+    X-Request-Id headers and logs a structured request line. Errors and
+    requests slower than SLOW_REQUEST_MS are always logged, the rest at
+    LOG_SAMPLE_RATE. Sampled requests are also captured for replay.
+    """
+
+    @functools.wraps(func)
+    def wrapper(req):
+        started_at = time.time()
+        request_id, trace = _request_ids(req)
+        timer = RequestTimer(func.__name__, request_id, trace)
+        token = current_timer.set(timer)
+        status = 500
+        try:
+            response = func(req)
+            status = response.status_code
+            response.headers["Server-Timing"] = timer.server_timing()
+            response.headers["Timing-Allow-Origin"] = response.headers.get(
+                "Access-Control-Allow-Origin", "*"
+            )
+            response.headers["Access-Control-Expose-Headers"] = (
+                "Server-Timing, X-Request-Id, Idempotent-Replayed"
+            )
+            response.headers["X-Request-Id"] = request_id
+            return response
+        finally:
+            total = timer.total_ms()
+            if status >= 500 or total >= SLOW_REQUEST_MS or random.random() < LOG_SAMPLE_RATE:
+                logger.info(
+                    "%s %s %d in %.1fms",
+                    req.method,
+                    func.__name__,
+                    status,
+                    total,
+                    extra={
+                        "fields": {
+                            "httpStatus": status,
+                            "durationMs": round(total, 1),
+                            "phasesMs": {k: round(v, 1) for k, v in timer.phases.items()},
+                        }
+                    },
+                )
+            capture_request(req, func.__name__, status, started_at, total)
+            current_timer.reset(token)
+
+    return wrapper
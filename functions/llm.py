@@ -0,0 +1,491 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from google import generativeai as genai
+
+from load_control import call_timeout
+
+
+load_dotenv()
+GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
+GEMINI_MODEL = "gemini-2.5-pro"
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE", "true").lower() == "true"
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "default_response.json")
+
+
+class LLMError(Exception):
+    """Raised when a provider fails to produce a response"""
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: int = 0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+class LLMProvider:
+    """
+    Generates a JSON document from a system instruction and a prompt.
+
+    operation names the prompt ("generate_gamified_structure", ...) so that
+    stubs and cassettes can tell calls apart; metadata carries hints such as
+    the number of planets requested that a stub needs to shape its answer.
+    """
+
+    name = "base"
+
+    def generate(
+        self,
+        operation: str,
+        system_instruction: str,
+        prompt: str,
+        response_schema: Dict[str, Any],
+        cache_prefix: bool = False,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> LLMResponse:
+        raise NotImplementedError
+
+    async def agenerate(
+        self,
+        operation: str,
+        system_instruction: str,
+        prompt: str,
+        response_schema: Dict[str, Any],
+        cache_prefix: bool = False,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> LLMResponse:
+        """Async generate; providers without native async I/O use a worker thread"""
+        return await asyncio.to_thread(
+            self.generate,
+            operation,
+            system_instruction,
+            prompt,
+            response_schema,
+            cache_prefix,
+            metadata,
+        )
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        genai.configure(api_key=GEMINI_API_KEY)
+        self.model_name = model_name
+        self._caches: Dict[str, Any] = {}
+        self._cache_retry_at: Dict[str, float] = {}
+        self._cache_lock = threading.Lock()
+
+    def _cached_model(self, system_instruction: str) -> Optional[genai.GenerativeModel]:
+        """
+        A model bound to a cached copy of system_instruction, or None when the
+        provider rejects it (explicit caching has a minimum prompt size and
+        is not available on every model).
+        """
+        key = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+        with self._cache_lock:
+            now = time.time()
+            cached = self._caches.get(key)
+            if cached is not None and now > cached[1] - 60:
+                cached = None
+            if cached is None and now >= self._cache_retry_at.get(key, 0.0):
+                try:
+                    content = genai.caching.CachedContent.create(
+                        model=f"models/{self.model_name}",
+                        display_name=f"ad-astra-{key[:12]}",
+                        system_instruction=system_instruction,
+                        ttl=datetime.timedelta(seconds=PROMPT_CACHE_TTL_SECONDS),
+                    )
+                    cached = (content, now + PROMPT_CACHE_TTL_SECONDS)
+                except Exception as e:
+                    logger.warning("Prompt cache unavailable, sending prefix inline: %s", e)
+                    self._cache_retry_at[key] = now + PROMPT_CACHE_TTL_SECONDS
+            if cached is None:
+                self._caches.pop(key, None)
+                return None
+            self._caches[key] = cached
+            return genai.GenerativeModel.from_cached_content(cached_content=cached[0])
+
+    def _model(self, system_instruction: str, cache_prefix: bool) -> genai.GenerativeModel:
+        model = None
+        if cache_prefix and PROMPT_CACHE_ENABLED:
+            model = self._cached_model(system_instruction)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name=self.model_name, system_instruction=system_instruction
+            )
+        return model
+
+    def _response(self, response, started: float) -> LLMResponse:
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text,
+            model=self.model_name,
+            prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+            completion_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            latency_ms=round((time.perf_counter() - started) * 1000),
+        )
+
+    @staticmethod
+    def _generation_config(response_schema):
+        return genai.types.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=response_schema,
+        )
+
+    @staticmethod
+    def _request_options():
+        # Stop waiting on Gemini once the request's deadline has passed
+        timeout = call_timeout()
+        return {"timeout": timeout} if timeout is not None else None
+
+    def generate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        model = self._model(system_instruction, cache_prefix)
+        started = time.perf_counter()
+        response = model.generate_content(
+            prompt,
+            generation_config=self._generation_config(response_schema),
+            request_options=self._request_options(),
+        )
+        return self._response(response, started)
+
+    async def agenerate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        # Creating a prompt cache is a blocking call, so resolve the model off the loop
+        model = await asyncio.to_thread(self._model, system_instruction, cache_prefix)
+        started = time.perf_counter()
+        response = await model.generate_content_async(
+            prompt,
+            generation_config=self._generation_config(response_schema),
+            request_options=self._request_options(),
+        )
+        return self._response(response, started)
+
+
+DATE_PATTERN = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+
+
+def _base_date(prompt: str) -> Optional[datetime.date]:
+    """The first date in the prompt ("Today is ..." when there is one)"""
+    match = DATE_PATTERN.search(prompt)
+    return datetime.date.fromisoformat(match.group(0)) if match else None
+
+
+def _shift_dates(text: str, days: int) -> str:
+    def shift(match: re.Match) -> str:
+        date = datetime.date.fromisoformat(match.group(0))
+        return (date + datetime.timedelta(days=days)).isoformat()
+
+    return DATE_PATTERN.sub(shift, text)
+
+
+def cassette_key(operation: str, system_instruction: str, prompt: str) -> str:
+    """
+    Hash of the call. Dates in the prompt are hashed as day offsets from its
+    first date, so a cassette recorded on one day still matches the same
+    request made on a later day.
+    """
+    base = _base_date(prompt)
+    if base is not None:
+
+        def offset(match: re.Match) -> str:
+            date = datetime.date.fromisoformat(match.group(0))
+            return f"<day{(date - base).days:+d}>"
+
+        prompt = DATE_PATTERN.sub(offset, prompt)
+    return hashlib.sha256(
+        "\0".join([operation, system_instruction, prompt]).encode("utf-8")
+    ).hexdigest()
+
+
+class ReplayProvider(LLMProvider):
+    """
+    Serves responses from a JSONL cassette keyed by a hash of the prompt.
+    With record=True, misses are forwarded to inner and appended to the
+    cassette, so a cassette can be captured once against the real API and
+    replayed offline afterwards. Dates in a replayed response are moved by
+    as many days as the prompt's dates moved since it was recorded.
+    """
+
+    name = "replay"
+
+    def __init__(self, path: str, record: bool = False, inner: Optional[LLMProvider] = None):
+        self.path = path
+        self.record = record
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+
+    def generate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        key = cassette_key(operation, system_instruction, prompt)
+        base = _base_date(prompt)
+        entry = self._entries.get(key)
+        if entry is not None:
+            response = LLMResponse(**entry["response"])
+            response.latency_ms = 0
+            if base is not None and entry.get("baseDate"):
+                recorded = datetime.date.fromisoformat(entry["baseDate"])
+                response.text = _shift_dates(response.text, (base - recorded).days)
+            return response
+        if not self.record or self.inner is None:
+            raise LLMError(f"No cassette entry for {operation} ({key[:12]})")
+
+        response = self.inner.generate(
+            operation, system_instruction, prompt, response_schema, cache_prefix, metadata
+        )
+        entry = {
+            "key": key,
+            "operation": operation,
+            "baseDate": base.isoformat() if base is not None else None,
+            "response": response.__dict__,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return response
+
+
+def parse_latency(spec: str):
+    """
+    Latency distributions in milliseconds: "fixed:MS", "uniform:LO:HI",
+    "normal:MEAN:STDDEV" or "lognormal:MEDIAN:SIGMA".
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class StubProvider(LLMProvider):
+    """
+    Answers with default_response.json after a sampled delay, failing or
+    returning malformed output at configurable rates. Seeded, so a load test
+    sees the same sequence of latencies and failures on every run.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        failure_rate: float = 0.0,
+        invalid_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        with open(DEFAULT_RESPONSE_PATH, "r") as f:
+            self._plan = json.load(f)
+
+    def _draw(self):
+        with self._lock:
+            return (
+                self.sample_latency(self._rng) / 1000.0,
+                self._rng.random(),
+                self._rng.random(),
+            )
+
+    def respond(self, operation: str, metadata: Optional[Dict[str, Any]]):
+        """Draws this call's delay and either a response body or an error"""
+        delay, fail_roll, invalid_roll = self._draw()
+        if fail_roll < self.failure_rate:
+            return delay, None
+        if invalid_roll < self.invalid_rate:
+            return delay, '{"planets": ['
+        plan = self._plan
+        planet_count = (metadata or {}).get("planet_count")
+        if planet_count is not None:
+            plan = {"planets": self._plan["planets"][:planet_count]}
+        return delay, json.dumps(plan)
+
+    def generate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        delay, text = self.respond(operation, metadata)
+        time.sleep(delay)
+        return self._response(operation, system_instruction, prompt, delay, text)
+
+    async def agenerate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        delay, text = self.respond(operation, metadata)
+        await asyncio.sleep(delay)
+        return self._response(operation, system_instruction, prompt, delay, text)
+
+    @staticmethod
+    def _response(operation, system_instruction, prompt, delay, text):
+        if text is None:
+            raise LLMError(f"Injected stub failure for {operation}")
+        return LLMResponse(
+            text=text,
+            model="stub",
+            prompt_tokens=(len(system_instruction) + len(prompt)) // 4,
+            completion_tokens=len(text) // 4,
+            latency_ms=round(delay * 1000),
+        )
+
+
+class HttpProvider(LLMProvider):
+    """Forwards calls to a stub server (scripts/llm_stub_server.py)"""
+
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 120.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def generate(
+        self,
+        operation,
+        system_instruction,
+        prompt,
+        response_schema,
+        cache_prefix=False,
+        metadata=None,
+    ):
+        body = json.dumps(
+            {
+                "operation": operation,
+                "systemInstruction": system_instruction,
+                "prompt": prompt,
+                "metadata": metadata or {},
+            }
+        ).encode("utf-8")
+        request = urllib.request.Request(
+            f"{self.url}/generate",
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(
+                request, timeout=call_timeout(self.timeout)
+            ) as response:
+                payload = json.loads(response.read())
+        except Exception as e:
+            raise LLMError(f"Stub server call failed: {e}") from e
+        result = LLMResponse(**payload)
+        result.latency_ms = round((time.perf_counter() - started) * 1000)
+        return result
+
+
+def create_provider(kind: Optional[str] = None) -> LLMProvider:
+    """
+    Builds the provider selected by LLM_PROVIDER: gemini (default), stub,
+    http (LLM_STUB_URL), replay or record (LLM_CASSETTE).
+    """
+    kind = (kind or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    if kind == "gemini":
+        return GeminiProvider()
+    if kind == "stub":
+        seed = os.getenv("LLM_STUB_SEED")
+        return StubProvider(
+            latency=os.getenv("LLM_STUB_LATENCY", "fixed:0"),
+            failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", "0")),
+            invalid_rate=float(os.getenv("LLM_STUB_INVALID_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+    if kind == "http":
+        return HttpProvider(os.getenv("LLM_STUB_URL", "http://127.0.0.1:8089"))
+    if kind in ("replay", "record"):
+        path = os.getenv("LLM_CASSETTE", "llm_cassette.jsonl")
+        if kind == "replay":
+            return ReplayProvider(path)
+        inner = create_provider(os.getenv("LLM_RECORD_PROVIDER", "gemini"))
+        return ReplayProvider(path, record=True, inner=inner)
+    raise ValueError(f"Unknown LLM_PROVIDER: {kind}")
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider()
+    return _provider
+
+
+def set_provider(provider: Optional[LLMProvider]) -> None:
+    """Swap the process-wide provider (None re-reads LLM_PROVIDER on next use)"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,169 @@
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+import google.cloud.firestore
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from load_control import call_timeout
+
+
+load_dotenv()
+
+# Daily counters live under llmUsage/{YYYY-MM-DD}: the global totals are
+# spread over shards/{n} so concurrent calls do not contend on one
+# document, and each user gets users/{uid}. Every call is one batched
+# write of Increments; no per-call documents are stored.
+USAGE_COLLECTION = "llmUsage"
+USAGE_SHARDS = 10
+# Upper bounds in milliseconds; slower calls land in "inf"
+LATENCY_BUCKETS_MS = [1000, 2000, 5000, 10000, 20000, 30000, 60000]
+
+# 0 disables a budget
+USER_DAILY_CALLS = int(os.getenv("LLM_USER_DAILY_CALLS", "10"))
+GLOBAL_DAILY_CALLS = int(os.getenv("LLM_GLOBAL_DAILY_CALLS", "5000"))
+GLOBAL_DAILY_TOKENS = int(os.getenv("LLM_GLOBAL_DAILY_TOKENS", "0"))
+
+COUNTER_FIELDS = ["calls", "promptTokens", "cachedTokens", "completionTokens", "latencyMsTotal"]
+
+
+def latency_bucket(latency_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= bound:
+            return f"le{bound}"
+    return "inf"
+
+
+def _day_ref(db: google.cloud.firestore.Client, date: str):
+    return db.collection(USAGE_COLLECTION).document(date)
+
+
+def _shard_refs(db: google.cloud.firestore.Client, date: str) -> List[Any]:
+    shards = _day_ref(db, date).collection("shards")
+    return [shards.document(str(n)) for n in range(USAGE_SHARDS)]
+
+
+def _user_ref(db: google.cloud.firestore.Client, date: str, uid: str):
+    return _day_ref(db, date).collection("users").document(uid)
+
+
+def record_llm_call(
+    db: google.cloud.firestore.Client,
+    date: str,
+    uid: Optional[str],
+    operation: str,
+    outcome: str,
+    latency_ms: float,
+    usage: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Adds one call to the day's global and per-user counters. usage is the
+    dict filled in by the gemini module; it is empty when the call failed
+    before a response came back.
+    """
+    usage = usage or {}
+    increments = {
+        "calls": firestore.Increment(1),
+        "promptTokens": firestore.Increment(usage.get("promptTokens", 0)),
+        "cachedTokens": firestore.Increment(usage.get("cachedTokens", 0)),
+        "completionTokens": firestore.Increment(usage.get("completionTokens", 0)),
+        "latencyMsTotal": firestore.Increment(round(latency_ms)),
+        "outcomes": {outcome: firestore.Increment(1)},
+    }
+    batch = db.batch()
+    batch.set(
+        _shard_refs(db, date)[random.randrange(USAGE_SHARDS)],
+        {
+            **increments,
+            "operations": {operation: firestore.Increment(1)},
+            "models": {usage.get("model", "unknown"): firestore.Increment(1)},
+            "latencyBuckets": {latency_bucket(latency_ms): firestore.Increment(1)},
+        },
+        merge=True,
+    )
+    if uid:
+        batch.set(_user_ref(db, date, uid), increments, merge=True)
+    batch.commit()
+
+
+def record_rejection(db: google.cloud.firestore.Client, date: str, scope: str) -> None:
+    """Counts a call skipped because the user or global budget was spent"""
+    _shard_refs(db, date)[random.randrange(USAGE_SHARDS)].set(
+        {"rejected": {scope: firestore.Increment(1)}}, merge=True
+    )
+
+
+def _sum_shards(snapshots) -> Dict[str, Any]:
+    totals: Dict[str, Any] = {field: 0 for field in COUNTER_FIELDS}
+    for snapshot in snapshots:
+        data = snapshot.to_dict() or {}
+        for key, value in data.items():
+            if isinstance(value, dict):
+                nested = totals.setdefault(key, {})
+                for name, count in value.items():
+                    nested[name] = nested.get(name, 0) + count
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def delete_user_usage(db: google.cloud.firestore.Client, uid: str) -> int:
+    """
+    Deletes uid's per-day counters (llmUsage/{date}/users/{uid}) across all
+    days; returns how many existed. The global shards are not per-user and
+    are kept.
+    """
+    refs = [
+        _user_ref(db, day.id, uid)
+        for day in db.collection(USAGE_COLLECTION).list_documents()
+    ]
+    deleted = 0
+    writer = db.bulk_writer()
+    for start in range(0, len(refs), 300):
+        for snapshot in db.get_all(refs[start : start + 300]):
+            if snapshot.exists:
+                writer.delete(snapshot.reference)
+                deleted += 1
+    writer.close()
+    return deleted
+
+
+def check_budget(
+    db: google.cloud.firestore.Client, date: str, uid: Optional[str]
+) -> Optional[str]:
+    """
+    "user" or "global" when that daily budget is already spent, else None.
+    The user's counter and every global shard are read in one round trip.
+    """
+    if not (USER_DAILY_CALLS or GLOBAL_DAILY_CALLS or GLOBAL_DAILY_TOKENS):
+        return None
+    refs = _shard_refs(db, date)
+    if uid and USER_DAILY_CALLS:
+        refs.append(_user_ref(db, date, uid))
+    shards = []
+    for snapshot in db.get_all(refs, timeout=call_timeout()):
+        if snapshot.reference.parent.id == "users":
+            if (snapshot.to_dict() or {}).get("calls", 0) >= USER_DAILY_CALLS:
+                return "user"
+        else:
+            shards.append(snapshot)
+
+    totals = _sum_shards(shards)
+    if GLOBAL_DAILY_CALLS and totals["calls"] >= GLOBAL_DAILY_CALLS:
+        return "global"
+    tokens = totals["promptTokens"] + totals["completionTokens"]
+    if GLOBAL_DAILY_TOKENS and tokens >= GLOBAL_DAILY_TOKENS:
+        return "global"
+    return None
+
+
+def daily_usage(db: google.cloud.firestore.Client, date: str) -> Dict[str, Any]:
+    """The day's global counters summed over all shards"""
+    totals = _sum_shards(db.get_all(_shard_refs(db, date)))
+    totals["budgets"] = {
+        "userDailyCalls": USER_DAILY_CALLS,
+        "globalDailyCalls": GLOBAL_DAILY_CALLS,
+        "globalDailyTokens": GLOBAL_DAILY_TOKENS,
+    }
+    return totals
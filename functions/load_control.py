@@ -0,0 +1,253 @@
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+LOAD_SHEDDING_ENABLED = os.getenv("LOAD_SHEDDING", "true").lower() == "true"
+# Clients may shorten (never extend) an endpoint's deadline with this header
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+DEFAULT_DEADLINE_MS = 10000
+# timeout_sec of the functions that need longer than the platform's
+# default; main.py passes these to on_request and on_schedule
+DEFAULT_FUNCTION_TIMEOUT_SECONDS = 60
+FUNCTION_TIMEOUTS_SECONDS = {
+    "generate_ai_achievements": 120,
+    "regenerate_achievements": 120,
+    "bulk_create_users": 540,
+    "export_users": 540,
+    "rollover_expired_achievements": 540,
+}
+# Deadlines end this long before the function is killed, so there is still
+# time to answer with a 504
+DEADLINE_MARGIN_MS = 10000
+ENDPOINT_DEADLINES_MS = {
+    **{
+        endpoint: timeout * 1000 - DEADLINE_MARGIN_MS
+        for endpoint, timeout in FUNCTION_TIMEOUTS_SECONDS.items()
+    },
+    "fetch_changes": 30000,
+}
+# Requests one instance serves at once on the endpoints that mostly wait on
+# Gemini, Auth or Firestore
+IO_HANDLER_CONCURRENCY = int(os.getenv("IO_HANDLER_CONCURRENCY", "80"))
+# Open long polls per instance; they are idle until their user's document changes
+CHANGE_FEED_CONCURRENCY = int(os.getenv("CHANGE_FEED_CONCURRENCY", "500"))
+# concurrency of each function as deployed; main.py passes these to
+# on_request, and the rest get the platform's default of 80 (at 1 CPU)
+DEFAULT_FUNCTION_CONCURRENCY = 80
+FUNCTION_CONCURRENCY = {
+    "generate_ai_achievements": IO_HANDLER_CONCURRENCY,
+    "regenerate_achievements": IO_HANDLER_CONCURRENCY,
+    "fetch_changes": CHANGE_FEED_CONCURRENCY,
+}
+
+# Low-priority endpoints start smaller and back off at a lower latency
+# increase, so they are shed before the latency-critical reads. Every
+# function is its own service with its own instances, so this only decides
+# how readily each one sheds its own load; it cannot move capacity from
+# generation to the reads.
+ENDPOINT_PRIORITIES = {
+    "generate_ai_achievements": "low",
+    "regenerate_achievements": "low",
+    "bulk_create_users": "low",
+    "export_users": "low",
+    "fetch_user_data": "critical",
+    "fetch_achievements": "critical",
+    "fetch_game_data": "critical",
+    "fetch_stats": "critical",
+    "fetch_changes": "watch",
+}
+# initial and min_limit are shares of the function's deployed concurrency,
+# which is also the limit's maximum: the platform never routes more than
+# that, and anything it routes below it is only shed when latency degrades
+LIMITER_SETTINGS = {
+    "low": {"initial": 0.5, "min_limit": 0.0125, "tolerance": 1.5},
+    "normal": {"initial": 0.75, "min_limit": 0.025, "tolerance": 2.0},
+    "critical": {"initial": 1.0, "min_limit": 0.05, "tolerance": 3.0},
+    # Long polls are mostly idle and their latency is the wait itself
+    "watch": {"initial": 1.0, "min_limit": 0.2, "tolerance": 3.0},
+}
+# Latency is tracked as a short (about 5 requests) and a long (about 500
+# requests) moving average; the long one is the normal latency
+SMOOTHING = 0.2
+BASELINE_SMOOTHING = 0.002
+TIMEOUT_BACKOFF = 0.9
+# Below this, a call is not worth starting
+MIN_CALL_TIMEOUT_SECONDS = 0.05
+
+# Monotonic time by which the current request must be answered
+current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceededError(Exception):
+    """Raised when the current request's deadline has passed"""
+
+
+def remaining_seconds() -> Optional[float]:
+    """Time left before the current request's deadline, None without one"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(default: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout for a Firestore or LLM call made now: the time left before the
+    deadline (capped at default), or default outside a request. Raises
+    DeadlineExceededError when there is no time left.
+    """
+    remaining = remaining_seconds()
+    if remaining is None:
+        return default
+    if remaining < MIN_CALL_TIMEOUT_SECONDS:
+        raise DeadlineExceededError("Request deadline exceeded")
+    return remaining if default is None else min(default, remaining)
+
+
+def deadline_exceeded() -> bool:
+    remaining = remaining_seconds()
+    return remaining is not None and remaining <= 0
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that follows latency (a gradient limiter). While
+    recent latency stays within tolerance times the normal latency, a busy
+    limit grows by about its square root; beyond that it shrinks in
+    proportion, and requests that time out cut it by TIMEOUT_BACKOFF.
+    """
+
+    def __init__(
+        self, initial: int, min_limit: int, max_limit: int, tolerance: float
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.inflight = 0
+        self._baseline: Optional[float] = None
+        self._smoothed: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, latency: float, timed_out: bool = False) -> None:
+        with self._lock:
+            inflight = self.inflight
+            self.inflight -= 1
+            if timed_out:
+                self.limit = max(self.min_limit, self.limit * TIMEOUT_BACKOFF)
+                return
+            if self._smoothed is None:
+                self._smoothed = self._baseline = latency
+            else:
+                self._smoothed += SMOOTHING * (latency - self._smoothed)
+                self._baseline += BASELINE_SMOOTHING * (latency - self._baseline)
+
+            gradient = max(
+                0.5, min(1.0, self.tolerance * self._baseline / self._smoothed)
+            )
+            if gradient < 1.0:
+                target = self.limit * gradient
+            elif inflight >= self.limit / 2:
+                target = self.limit + math.sqrt(self.limit)
+            else:
+                # Only grow when the limit is actually being used
+                return
+            self.limit = min(
+                self.max_limit,
+                max(self.min_limit, self.limit + SMOOTHING * (target - self.limit)),
+            )
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+
+def limiter_for(endpoint: str) -> AdaptiveLimiter:
+    if endpoint not in _limiters:
+        settings = LIMITER_SETTINGS[ENDPOINT_PRIORITIES.get(endpoint, "normal")]
+        concurrency = FUNCTION_CONCURRENCY.get(endpoint, DEFAULT_FUNCTION_CONCURRENCY)
+        min_limit = max(1, round(concurrency * settings["min_limit"]))
+        _limiters[endpoint] = AdaptiveLimiter(
+            initial=max(min_limit, round(concurrency * settings["initial"])),
+            min_limit=min_limit,
+            max_limit=concurrency,
+            tolerance=settings["tolerance"],
+        )
+    return _limiters[endpoint]
+
+
+def request_deadline(req, endpoint: str) -> float:
+    """Monotonic deadline from the endpoint default and the client's header"""
+    function_timeout = FUNCTION_TIMEOUTS_SECONDS.get(
+        endpoint, DEFAULT_FUNCTION_TIMEOUT_SECONDS
+    )
+    timeout_ms = min(
+        ENDPOINT_DEADLINES_MS.get(endpoint, DEFAULT_DEADLINE_MS),
+        function_timeout * 1000 - DEADLINE_MARGIN_MS,
+    )
+    header = req.headers.get(DEADLINE_HEADER)
+    if header:
+        try:
+            requested = int(header)
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            timeout_ms = min(timeout_ms, requested)
+    return time.monotonic() + timeout_ms / 1000
+
+
+def load_controlled(reject: Callable[[int, str], object]):
+    """
+    Decorator for HTTP handlers: sets the request's deadline for
+    call_timeout and sheds requests over the endpoint's adaptive
+    concurrency limit. reject(status, message) builds the 503 for shed
+    requests and the 504 that replaces a server error once the deadline
+    has passed.
+    """
+
+    def decorate(func):
+        endpoint = func.__name__
+        limiter = limiter_for(endpoint)
+
+        @functools.wraps(func)
+        def wrapper(req):
+            if req.method == "OPTIONS":
+                return func(req)
+            deadline = request_deadline(req, endpoint)
+            if LOAD_SHEDDING_ENABLED and not limiter.try_acquire():
+                return reject(503, "Server is overloaded, retry shortly")
+
+            token = current_deadline.set(deadline)
+            started = time.monotonic()
+            timed_out = False
+            try:
+                response = func(req)
+                if response.status_code >= 500 and deadline_exceeded():
+                    timed_out = True
+                    response = reject(504, "Request deadline exceeded")
+                return response
+            finally:
+                current_deadline.reset(token)
+                if LOAD_SHEDDING_ENABLED:
+                    limiter.release(time.monotonic() - started, timed_out)
+
+        return wrapper
+
+    return decorate
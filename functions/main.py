@@ -1,24 +1,122 @@
 # Firebase Functions main.py - All functions consolidated with CORS support
 from firebase_admin import initialize_app, firestore, auth
-from firebase_functions import https_fn
+from firebase_functions import firestore_fn, https_fn, scheduler_fn
+import os
 import re
+import hmac
 import time
 import json
-import traceback
+import asyncio
+import datetime
+import logging
+import uuid
+from zoneinfo import ZoneInfo
 import google.cloud.firestore
-from gemini import generate_gamified_structure
+from google.api_core.exceptions import NotFound
+from instrumentation import configure_logging, end_phase, instrumented
+from load_control import (
+    DEADLINE_MARGIN_MS,
+    FUNCTION_CONCURRENCY,
+    FUNCTION_TIMEOUTS_SECONDS,
+    load_controlled,
+    remaining_seconds,
+)
+from game_progress import (
+    MAX_EVENTS_PER_BATCH,
+    PLAN_ID_FIELD,
+    aggregate_events,
+    ingest_game_events,
+)
+from change_feed import (
+    MAX_WAIT_SECONDS,
+    MIN_WAIT_SECONDS,
+    changes_since,
+    decode_token,
+    encode_token,
+    section_versions,
+    wait_for_changes,
+)
+from async_runtime import async_db, run
+from auth_tokens import InvalidTokenError, uid_from_request
+from account_deletion import request_deletion, resume_deletion_jobs, run_deletion_job
+from game_data_codec import (
+    GameDataTooLargeError,
+    decode_game_data,
+    decoded_user_data,
+    encode_game_data,
+)
+from savings_stats import fetch_summary, materialize_summary, record_deposit
+from idempotency import (
+    MAX_KEY_LENGTH,
+    claim_idempotency_key,
+    complete_idempotency_key,
+    complete_idempotency_key_in,
+    idempotency_ref,
+    release_idempotency_key,
+)
+from bulk_onboarding import MAX_BULK_USERS, new_user_profile, onboard_users
+from gemini import agenerate_gamified_structure, generate_planets
+from llm_usage import check_budget, daily_usage, record_llm_call, record_rejection
+from rate_limit import check_rate_limit
+from user_cache import aget_user_data, get_user_data, invalidate_user, write_stamp
+from user_export import (
+    EXPORT_FIELDS,
+    MAX_PAGE_SIZE,
+    decode_cursor,
+    stream_users_ndjson,
+)
+from validation import valid_questions, valid_achievements
+from migrations import ACHIEVEMENTS_SCHEMA_VERSION, VERSION_FIELD, upgrade_achievements
+from plan_store import (
+    DEFAULT_MAX_DISTANCE,
+    find_reusable_plan,
+    rebase_plan,
+    record_answer_traffic,
+    save_plan,
+)
+from regeneration import (
+    REGENERATION_SCOPES,
+    merge_regenerated_planets,
+    planets_to_regenerate,
+)
+from achievement_index import (
+    MAX_REMINDER_PAGE_SIZE,
+    REMINDER_DATE_FIELDS,
+    ROLLOVER_MODES,
+    achievements_due_on,
+    active_achievements,
+    awrite_achievement_index,
+    current_planet_index,
+    rollover_expired,
+    write_achievement_index,
+)
 
 app = initialize_app()
+configure_logging()
+logger = logging.getLogger(__name__)
 ALLOWED_ORIGINS = ["http://localhost:3000", "http://localhost:5178"]
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY")
+# Achievement dates are calendar dates in the users' local time
+PLAN_TIMEZONE = os.getenv("PLAN_TIMEZONE", "America/Chicago")
+ROLLOVER_MODE = os.getenv("ROLLOVER_MODE", "expire")
+PLAN_REUSE_ENABLED = os.getenv("PLAN_REUSE", "true").lower() == "true"
+PLAN_REUSE_MAX_DISTANCE = float(
+    os.getenv("PLAN_REUSE_MAX_DISTANCE", str(DEFAULT_MAX_DISTANCE))
+)
+# export_users stops starting pages after this long and ends with a cursor,
+# well inside its 540 second function timeout
+EXPORT_TIME_BUDGET_SECONDS = int(os.getenv("EXPORT_TIME_BUDGET_SECONDS", "480"))
 
 
 def cors_response(body, status=200, origin="*"):
     """Create an HTTP response with CORS headers"""
+    # The body has just been built, so the time since the last phase is serialization
+    end_phase("serialize")
     response = https_fn.Response(body, status=status)
     response.headers["Access-Control-Allow-Origin"] = "http://localhost:5173"
     response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
     response.headers["Access-Control-Allow-Headers"] = (
-        "Content-Type, Authorization, X-Requested-With"
+        "Content-Type, Authorization, X-Requested-With, Idempotency-Key"
     )
     response.headers["Access-Control-Max-Age"] = "86400"
     response.headers["Content-Type"] = "application/json"
@@ -36,19 +134,183 @@ def handle_cors(req):
     return None
 
 
+def too_many_requests(retry_after):
+    """429 response telling the client when to retry"""
+    response = cors_response(
+        json.dumps({"error": "Too many requests", "retryAfter": retry_after}),
+        status=429,
+    )
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def overload_response(status, message):
+    """503 for shed requests, 504 for requests past their deadline"""
+    response = cors_response(json.dumps({"error": message}), status=status)
+    if status == 503:
+        response.headers["Retry-After"] = "1"
+    return response
+
+
+load_shed = load_controlled(overload_response)
+
+
+def idempotent(req, db, uid, endpoint, execute, stores_response=False):
+    """
+    Runs execute() once per Idempotency-Key header value; duplicates within
+    IDEMPOTENCY_TTL_SECONDS get the first response without running it again.
+    Server errors and 429s are not stored, so those retries run again.
+    With stores_response, execute(ref) is given the claimed record and
+    completes it in its own transaction.
+    """
+    key = req.headers.get("Idempotency-Key")
+    if key is None:
+        return execute(None) if stores_response else execute()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return cors_response(
+            json.dumps(
+                {"error": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"}
+            ),
+            status=400,
+        )
+
+    ref = idempotency_ref(db, uid, endpoint, key)
+    outcome, stored = claim_idempotency_key(db, ref, endpoint, req.get_data())
+    end_phase("idempotency")
+    if outcome == "replay":
+        response = cors_response(stored["body"], status=stored["status"])
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+    if outcome == "in_progress":
+        response = cors_response(
+            json.dumps({"error": "A request with this Idempotency-Key is in progress"}),
+            status=409,
+        )
+        response.headers["Retry-After"] = "1"
+        return response
+    if outcome == "mismatch":
+        return cors_response(
+            json.dumps(
+                {"error": "Idempotency-Key was already used with a different request"}
+            ),
+            status=422,
+        )
+
+    try:
+        response = execute(ref) if stores_response else execute()
+    except Exception:
+        release_idempotency_key(ref)
+        raise
+    try:
+        if response.status_code >= 500 or response.status_code == 429:
+            release_idempotency_key(ref)
+        elif not stores_response:
+            complete_idempotency_key(
+                ref, response.status_code, response.get_data(as_text=True)
+            )
+    except Exception:
+        # The side effects happened; the client still gets their response
+        logger.warning("Error storing idempotent response", exc_info=True)
+    return response
+
+
+def is_admin_request(req):
+    """Check the X-Admin-Key header against the configured admin key"""
+    provided = req.headers.get("X-Admin-Key")
+    if not ADMIN_API_KEY or not provided:
+        return False
+    return hmac.compare_digest(provided, ADMIN_API_KEY)
+
+
 # Helper functions for validation
 def is_valid_email(email):
     email_regex = r"^[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,}$"
     return bool(re.match(email_regex, email, re.IGNORECASE))
 
 
+def parse_plan_date(value):
+    """Parse an optional YYYY-MM-DD string, defaulting to today in PLAN_TIMEZONE"""
+    if value is None:
+        return datetime.datetime.now(ZoneInfo(PLAN_TIMEZONE)).date()
+    if not isinstance(value, str) or not re.match(r"^\d{4}-\d{2}-\d{2}$", value):
+        raise ValueError("date must be in YYYY-MM-DD format")
+    return datetime.date.fromisoformat(value)
+
+
+def load_default_plan():
+    """The fallback plan, with its fixed dates moved to start today"""
+    with open("default_response.json", "r") as f:
+        return rebase_plan(json.load(f), parse_plan_date(None))
+
+
+def record_llm_outcome(db, date, uid, operation, outcome, started, usage):
+    """Record an LLM call in the usage counters without failing the request"""
+    try:
+        record_llm_call(
+            db,
+            date,
+            uid,
+            operation,
+            outcome,
+            (time.perf_counter() - started) * 1000,
+            usage,
+        )
+    except Exception:
+        logger.exception("Error recording LLM usage")
+
+
 min_password_length = 6
 password_regex = r"^[A-Za-z0-9!@#$%^&*()_+\-=\[\]{};':\"\\|,.<>\/?]+$"
 name_regex = r"^[A-Za-z]+$"
 
 
+def user_fields_error(email, password, firstName, lastName):
+    """The first problem with new-user fields, or None when they are valid"""
+    missing_fields = []
+    if not email:
+        missing_fields.append("email")
+    if not password:
+        missing_fields.append("password")
+    if not firstName:
+        missing_fields.append("firstName")
+    if not lastName:
+        missing_fields.append("lastName")
+
+    if len(missing_fields) > 0:
+        return f"Missing required fields: {', '.join(missing_fields)}"
+
+    # Validate input types
+    if not isinstance(email, str):
+        return "Invalid type for field: email"
+    if not isinstance(password, str):
+        return "Invalid type for field: password"
+    if not isinstance(firstName, str):
+        return "Invalid type for field: firstName"
+    if not isinstance(lastName, str):
+        return "Invalid type for field: lastName"
+
+    # Validate email format
+    if not is_valid_email(email):
+        return "Invalid email format"
+
+    # Validate password
+    if len(password) < min_password_length:
+        return f"Password must be at least {min_password_length} characters long"
+    if not re.match(password_regex, password):
+        return "Password contains invalid characters"
+
+    # Validate names
+    if not re.match(name_regex, firstName):
+        return "First name must only contain letters"
+    if not re.match(name_regex, lastName):
+        return "Last name must only contain letters"
+    return None
+
+
 # Test function
 @https_fn.on_request()
+@instrumented
+@load_shed
 def hello_world(req: https_fn.Request) -> https_fn.Response:
     cors_resp = handle_cors(req)
     if cors_resp:
@@ -59,6 +321,8 @@ def hello_world(req: https_fn.Request) -> https_fn.Response:
 
 # User management functions
 @https_fn.on_request()
+@instrumented
+@load_shed
 def create_user(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
@@ -66,205 +330,192 @@ def create_user(req: https_fn.Request):
 
     try:
         data = req.get_json()
-        missing_fields = []
+        end_phase("parse")
         email = data.get("email")
         password = data.get("password")
         firstName = data.get("firstName")
         lastName = data.get("lastName")
 
-        if not email:
-            missing_fields.append("email")
-        if not password:
-            missing_fields.append("password")
-        if not firstName:
-            missing_fields.append("firstName")
-        if not lastName:
-            missing_fields.append("lastName")
-
-        if len(missing_fields) > 0:
-            return cors_response(
-                json.dumps(
-                    {"error": f"Missing required fields: {', '.join(missing_fields)}"}
-                ),
-                status=400,
-            )
-
-        # Validate input types
-        if not isinstance(email, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: email"}), status=400
-            )
-        if not isinstance(password, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: password"}), status=400
-            )
-        if not isinstance(firstName, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: firstName"}), status=400
-            )
-        if not isinstance(lastName, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: lastName"}), status=400
-            )
+        error = user_fields_error(email, password, firstName, lastName)
+        if error:
+            return cors_response(json.dumps({"error": error}), status=400)
 
-        # Validate email format
-        if not is_valid_email(email):
-            return cors_response(
-                json.dumps({"error": "Invalid email format"}), status=400
-            )
-
-        # Validate password
-        if len(password) < min_password_length:
-            return cors_response(
-                json.dumps(
-                    {
-                        "error": f"Password must be at least {min_password_length} characters long"
-                    }
-                ),
-                status=400,
-            )
-        if not re.match(password_regex, password):
-            return cors_response(
-                json.dumps({"error": "Password contains invalid characters"}),
-                status=400,
-            )
-
-        # Validate names
-        if not re.match(name_regex, firstName):
-            return cors_response(
-                json.dumps({"error": "First name must only contain letters"}),
-                status=400,
-            )
-        if not re.match(name_regex, lastName):
-            return cors_response(
-                json.dumps({"error": "Last name must only contain letters"}), status=400
-            )
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+        retry_after = check_rate_limit(db, "create_user", req)
+        end_phase("rate_limit")
+        if retry_after is not None:
+            return too_many_requests(retry_after)
 
         # Create user in Firebase Auth
         userRecord = auth.create_user(
             email=email, password=password, display_name=f"{firstName} {lastName}"
         )
+        end_phase("auth")
 
         # Store additional user data in Firestore
-        db: google.cloud.firestore.Client = firestore.client()
         db.collection("users").document(userRecord.uid).set(
-            {
-                "firstName": firstName,
-                "lastName": lastName,
-                "email": email,
-                "joined": int(time.time()),
-                "money": 0,
-            }
+            new_user_profile(email, firstName, lastName)
         )
+        end_phase("firestore_write")
 
         return cors_response(
             json.dumps({"message": "User created successfully", "uid": userRecord.uid}),
             status=201,
         )
 
-    except Exception as e:
-        print(f"Error creating user: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error creating user")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def fetch_user_data(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
-        data = req.get_json()
-        uid = data.get("uid")
-
-        if not uid:
-            return cors_response(
-                json.dumps({"error": "Missing required field: uid"}), status=400
-            )
-
-        if not isinstance(uid, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: uid"}), status=400
-            )
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
 
         db: google.cloud.firestore.Client = firestore.client()
-        user_doc = db.collection("users").document(uid).get()
-        if not user_doc.exists:
+        user_data = get_user_data(db, uid)
+        end_phase("firestore_read")
+        if user_data is None:
             return cors_response(json.dumps({"error": "User not found"}), status=404)
 
-        user_data = user_doc.to_dict()
+        user_data = decoded_user_data(user_data)
+        end_phase("decode")
+
         return cors_response(json.dumps({"userData": user_data}), status=200)
 
-    except Exception as e:
-        print(f"Error fetching user data: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error fetching user data")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def delete_user(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
-        data = req.get_json()
-        uid = data.get("uid")
-
-        if not uid:
-            return cors_response(
-                json.dumps({"error": "Missing required field: uid"}), status=400
-            )
-
-        if not isinstance(uid, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: uid"}), status=400
-            )
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
 
         db: google.cloud.firestore.Client = firestore.client()
-        user_doc = db.collection("users").document(uid).get()
-        if not user_doc.exists:
+        if get_user_data(db, uid) is None:
             return cors_response(
                 json.dumps({"error": "User not found in Firestore"}), status=404
             )
+        end_phase("firestore_read")
 
-        # Check if user exists in Firebase Auth
-        try:
-            auth.get_user(uid)
-        except auth.UserNotFoundError:
-            return cors_response(
-                json.dumps({"error": "User not found in Firebase Auth"}), status=404
-            )
-
-        auth.delete_user(uid)
-        db.collection("users").document(uid).delete()
+        # The data is deleted by on_deletion_requested in the background
+        job = request_deletion(db, uid)
+        end_phase("firestore_write")
 
         return cors_response(
-            json.dumps({"message": "User deleted successfully"}), status=200
+            json.dumps({"message": "User deletion started", "status": job["status"]}),
+            status=202,
         )
 
-    except Exception as e:
-        print(f"Error deleting user: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error deleting user")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 # Bank/Money management functions
+def deposit_response(current_money, amount):
+    """add_money's status and body, given the balance before the deposit"""
+    if current_money is None:
+        return 404, json.dumps({"error": "User not found"})
+    return 200, json.dumps(
+        {
+            "message": "Money added successfully",
+            "previous_balance": current_money,
+            "amount_added": amount,
+            "new_balance": current_money + amount,
+        }
+    )
+
+
+@firestore.transactional
+def deposit(transaction, db, user_ref, amount, today, idempotency=None):
+    """
+    Adds amount to the balance and the savings stats atomically; returns the
+    response status and body. With an idempotency record, the response is
+    stored in the same transaction, and a record that is already completed
+    is returned without depositing again.
+    """
+    refs = [user_ref] + ([idempotency] if idempotency is not None else [])
+    snapshots = {s.reference.path: s for s in transaction.get_all(refs)}
+    if idempotency is not None:
+        record = snapshots[idempotency.path].to_dict() or {}
+        if record.get("status") == "completed":
+            return record["response"]["status"], record["response"]["body"]
+    user_doc = snapshots[user_ref.path]
+    if not user_doc.exists:
+        status, body = deposit_response(None, amount)
+        if idempotency is not None:
+            complete_idempotency_key_in(transaction, idempotency, status, body)
+        return status, body
+    user_data = user_doc.to_dict()
+    current_money = user_data.get("money", 0)
+    first_today = user_data.get("lastDepositDate") != today
+    transaction.update(
+        user_ref,
+        {
+            "money": current_money + amount,
+            "lastDepositDate": today,
+            **write_stamp("money"),
+        },
+    )
+    record_deposit(
+        transaction,
+        db,
+        today,
+        amount,
+        user_data.get("currentPlanet", 0) if first_today else None,
+    )
+    status, body = deposit_response(current_money, amount)
+    if idempotency is not None:
+        complete_idempotency_key_in(transaction, idempotency, status, body)
+    return status, body
+
+
 @https_fn.on_request()
+@instrumented
+@load_shed
 def add_money(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
         data = req.get_json()
-        uid = data.get("uid")
+        end_phase("parse")
         amount = data.get("amount")
 
-        if not uid or amount is None:
+        if amount is None:
             return cors_response(
-                json.dumps({"error": "Missing required fields: uid and amount"}),
+                json.dumps({"error": "Missing required field: amount"}),
                 status=400,
             )
 
@@ -274,41 +525,29 @@ def add_money(req: https_fn.Request):
                 status=400,
             )
 
+        end_phase("validate")
         db: google.cloud.firestore.Client = firestore.client()
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
 
-        if not user_doc.exists:
-            return cors_response(
-                json.dumps({"error": "User not found"}),
-                status=404,
+        def execute(idempotency):
+            user_ref = db.collection("users").document(uid)
+            today = parse_plan_date(None).isoformat()
+            status, body = deposit(
+                db.transaction(), db, user_ref, amount, today, idempotency
             )
+            invalidate_user(uid)
+            end_phase("firestore_write")
+            return cors_response(body, status=status)
 
-        user_data = user_doc.to_dict()
-        current_money = user_data.get("money", 0)
-        new_money = current_money + amount
-
-        user_ref.update({"money": new_money})
-
-        return cors_response(
-            json.dumps(
-                {
-                    "message": "Money added successfully",
-                    "previous_balance": current_money,
-                    "amount_added": amount,
-                    "new_balance": new_money,
-                }
-            ),
-            status=200,
-        )
+        return idempotent(req, db, uid, "add_money", execute, stores_response=True)
 
-    except Exception as e:
-        print(f"Error adding money: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error adding money")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def fetch_questions(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
@@ -323,310 +562,464 @@ def fetch_questions(req: https_fn.Request):
             json.dumps({"questions": questions}),
             status=200,
         )
-    except Exception as e:
-        print(f"Error fetching questions: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error fetching questions")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
-def valid_questions(questions_answers):
-    print(questions_answers)
-    if not isinstance(questions_answers, list):
-        print("Error: questions_answers is not a list.")
-        return False
-    for idx, item in enumerate(questions_answers):
-        if not isinstance(item, dict):
-            print(f"Error: Item at index {idx} is not a dictionary.")
-            return False
-        if "question" not in item or "answer" not in item:
-            print(f"Error: Item at index {idx} missing 'question' or 'answer' key.")
-            return False
-        if not isinstance(item["question"], str) or not isinstance(item["answer"], str):
-            print(
-                f"Error: 'question' or 'answer' in item at index {idx} is not a string."
-            )
-            return False
-        if len(item["question"].strip()) == 0 or len(item["answer"].strip()) == 0:
-            print(
-                f"Error: 'question' or 'answer' in item at index {idx} is empty or whitespace."
-            )
-            return False
-    return True
-
-
-def valid_achievements(achievements):
-    print(achievements)
-    print(type(achievements))
-    if not isinstance(achievements, dict):
-        print("Invalid: achievements is not a dictionary")
-        return False
-    if "planets" not in achievements:
-        print("Invalid: 'planets' key missing in achievements")
-        return False
-    if not isinstance(achievements["planets"], list):
-        print("Invalid: 'planets' is not a list")
-        return False
-    for planet in achievements["planets"]:
-        if not isinstance(planet, dict):
-            print("Invalid: planet entry is not a dictionary")
-            return False
-        if (
-            "name" not in planet
-            or "image" not in planet
-            or "achievements" not in planet
-        ):
-            print("Invalid: planet missing 'name', 'image', or 'achievements' key")
-            return False
-        if not isinstance(planet["name"], str) or not isinstance(planet["image"], str):
-            print("Invalid: planet 'name' or 'image' is not a string")
-            return False
-        if not isinstance(planet["achievements"], list):
-            print("Invalid: planet 'achievements' is not a list")
-            return False
-        for achievement in planet["achievements"]:
-            if not isinstance(achievement, dict):
-                print("Invalid: achievement entry is not a dictionary")
-                return False
-            if (
-                "name" not in achievement
-                or "description" not in achievement
-                or "type" not in achievement
-            ):
-                print(
-                    "Invalid: achievement missing 'name', 'description', or 'type' key"
-                )
-                return False
-            if not isinstance(achievement["name"], str) or not isinstance(
-                achievement["description"], str
-            ):
-                print("Invalid: achievement 'name' or 'description' is not a string")
-                return False
-            if achievement["type"] not in ["progress", "game", "streak"]:
-                print(
-                    f"Invalid: achievement 'type' is not valid ({achievement.get('type')})"
+def lookup_reusable_plan(db, questions_answers):
+    """A validated stored plan for answers close to these, or None"""
+    try:
+        record_answer_traffic(db, questions_answers)
+    except Exception:
+        logger.warning("Error recording answer traffic", exc_info=True)
+    try:
+        reused, distance = find_reusable_plan(
+            db, questions_answers, parse_plan_date(None), PLAN_REUSE_MAX_DISTANCE
+        )
+        if reused is not None:
+            reused, _ = upgrade_achievements(reused)
+            if valid_achievements(reused):
+                logger.info("Reusing stored plan at distance %.3f", distance)
+                return reused
+    except Exception:
+        logger.exception("Error looking up reusable plan")
+    return None
+
+
+async def no_reusable_plan():
+    return None
+
+
+async def generate_plan_for_user(db, adb, uid, questions_answers):
+    """
+    generate_ai_achievements after request validation, on the async runtime.
+    The user lookup, plan-store lookup and budget check are independent
+    reads and run together; the plan write, the usage counters and the
+    plan-store copy then run together too.
+    """
+    today = parse_plan_date(None).isoformat()
+    user_data, data, exceeded = await asyncio.gather(
+        aget_user_data(adb, uid),
+        (
+            asyncio.to_thread(lookup_reusable_plan, db, questions_answers)
+            if PLAN_REUSE_ENABLED
+            else no_reusable_plan()
+        ),
+        asyncio.to_thread(check_budget, db, today, uid),
+    )
+    end_phase("firestore_read")
+    if user_data is None:
+        return cors_response(
+            json.dumps({"error": "User not found"}),
+            status=404,
+        )
+
+    source = "reuse" if data is not None else "llm"
+    side_writes = []
+    if data is None:
+        if exceeded == "user":
+            await asyncio.to_thread(record_rejection, db, today, "user")
+            return cors_response(
+                json.dumps({"error": "Daily plan generation limit reached"}),
+                status=429,
+            )
+
+        if exceeded == "global":
+            side_writes.append(asyncio.to_thread(record_rejection, db, today, "global"))
+            logger.warning("Global LLM budget spent, serving the default plan")
+            data = load_default_plan()
+            source = "fallback"
+        else:
+            usage = {}
+            outcome = "success"
+            started = time.perf_counter()
+            try:
+                result = await agenerate_gamified_structure(questions_answers, usage)
+                end_phase("llm")
+                if usage.get("parsed") is False:
+                    raise ValueError("Generated achievements are not valid JSON")
+                # Bring the model output up to the current stored schema
+                data, _ = upgrade_achievements(result)
+                if not valid_achievements(data):
+                    raise ValueError("Generated achievements structure is invalid")
+                end_phase("validate")
+            except Exception:
+                logger.exception("Error generating gamified structure")
+                # A response that came back but was unusable is "invalid";
+                # a call that failed outright is "fallback"
+                outcome = "invalid" if usage else "fallback"
+                # Fallback to default response if Gemini fails
+                data = load_default_plan()
+                source = "fallback"
+            side_writes.append(
+                asyncio.to_thread(
+                    record_llm_outcome,
+                    db,
+                    today,
+                    uid,
+                    "generate_gamified_structure",
+                    outcome,
+                    started,
+                    usage,
                 )
-                return False
-            if "data" not in achievement:
-                print("Invalid: achievement missing 'data' key")
-                return False
-            if not isinstance(achievement["data"], dict):
-                print("Invalid: achievement 'data' is not a dictionary")
-                return False
-            # Validate achievement["data"] based on achievement["type"]
-            if achievement["type"] == "progress":
-                if (
-                    "startDate" not in achievement["data"]
-                    or "endDate" not in achievement["data"]
-                ):
-                    print(
-                        "Invalid: progress achievement missing 'startDate' or 'endDate'"
-                    )
-                    return False
-                if not isinstance(
-                    achievement["data"]["startDate"], str
-                ) or not isinstance(achievement["data"]["endDate"], str):
-                    print(
-                        "Invalid: progress achievement 'startDate' or 'endDate' is not a string"
-                    )
-                    return False
-                date_regex = r"^\d{4}-\d{2}-\d{2}$"
-                if not re.match(
-                    date_regex, achievement["data"]["startDate"]
-                ) or not re.match(date_regex, achievement["data"]["endDate"]):
-                    print(
-                        "Invalid: progress achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
-                    )
-                    return False
-                if "moneyToSave" not in achievement["data"] or not isinstance(
-                    achievement["data"]["moneyToSave"], int
-                ):
-                    print(
-                        "Invalid: progress achievement missing 'moneyToSave' or it is not an int"
-                    )
-                    return False
-            elif achievement["type"] == "streak":
-                if (
-                    "startDate" not in achievement["data"]
-                    or "endDate" not in achievement["data"]
-                ):
-                    print(
-                        "Invalid: streak achievement missing 'startDate' or 'endDate'"
-                    )
-                    return False
-                if not isinstance(
-                    achievement["data"]["startDate"], str
-                ) or not isinstance(achievement["data"]["endDate"], str):
-                    print(
-                        "Invalid: streak achievement 'startDate' or 'endDate' is not a string"
-                    )
-                    return False
-                date_regex = r"^\d{4}-\d{2}-\d{2}$"
-                if not re.match(
-                    date_regex, achievement["data"]["startDate"]
-                ) or not re.match(date_regex, achievement["data"]["endDate"]):
-                    print(
-                        "Invalid: streak achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
-                    )
-                    return False
-                if "numConsecutiveDays" not in achievement["data"] or not isinstance(
-                    achievement["data"]["numConsecutiveDays"], int
-                ):
-                    print(
-                        "Invalid: streak achievement missing 'numConsecutiveDays' or it is not an int"
-                    )
-                    return False
-                # if "minimumStreakAmount" not in achievement["data"] or not isinstance(
-                #     achievement["data"]["minimumStreakAmount"], int
-                # ):
-                #     print(
-                #         "Invalid: streak achievement missing 'minimumStreakAmount' or it is not an int"
-                #     )
-                #     return False
-                # if "frequency" not in achievement["data"] or achievement["data"][
-                #     "frequency"
-                # ] not in ["daily", "weekly", "monthly"]:
-                #     print(
-                #         "Invalid: streak achievement missing 'frequency' or it is not valid"
-                #     )
-                #     return False
-            elif achievement["type"] == "game":
-                if (
-                    "startDate" not in achievement["data"]
-                    or "endDate" not in achievement["data"]
-                ):
-                    print("Invalid: game achievement missing 'startDate' or 'endDate'")
-                    return False
-                if not isinstance(
-                    achievement["data"]["startDate"], str
-                ) or not isinstance(achievement["data"]["endDate"], str):
-                    print(
-                        "Invalid: game achievement 'startDate' or 'endDate' is not a string"
-                    )
-                    return False
-                date_regex = r"^\d{4}-\d{2}-\d{2}$"
-                if not re.match(
-                    date_regex, achievement["data"]["startDate"]
-                ) or not re.match(date_regex, achievement["data"]["endDate"]):
-                    print(
-                        "Invalid: game achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
-                    )
-                    return False
-    return True
+            )
 
+        if source == "llm" and PLAN_REUSE_ENABLED:
+            side_writes.append(asyncio.to_thread(save_plan, db, questions_answers, data))
 
-@https_fn.on_request()
+    achievement_id_counter = 0
+    for planet in data.get("planets", []):
+        for achievement in planet.get("achievements", []):
+            achievement["completed"] = False
+            achievement["id"] = achievement_id_counter
+            achievement_id_counter += 1
+
+    async def commit_plan():
+        batch = adb.batch()
+        batch.update(
+            adb.collection("users").document(uid),
+            {
+                "achievements": data,
+                VERSION_FIELD: ACHIEVEMENTS_SCHEMA_VERSION,
+                "currentPlanet": 0,
+                "questionnaire": questions_answers,
+                # Ids restart at 0, so game progress of the old plan is discarded
+                PLAN_ID_FIELD: uuid.uuid4().hex,
+                **write_stamp("achievements"),
+            },
+        )
+        await awrite_achievement_index(adb, batch, uid, data)
+        await batch.commit()
+
+    committed, *side_results = await asyncio.gather(
+        commit_plan(), *side_writes, return_exceptions=True
+    )
+    invalidate_user(uid)
+    end_phase("firestore_write")
+    for error in side_results:
+        if isinstance(error, Exception):
+            logger.error("Error recording plan generation", exc_info=error)
+    if isinstance(committed, NotFound):
+        return cors_response(
+            json.dumps({"error": "User not found"}),
+            status=404,
+        )
+    if isinstance(committed, Exception):
+        raise committed
+
+    return cors_response(
+        json.dumps(
+            {
+                "message": "Achievements generated and stored successfully",
+                "source": source,
+                "achievements": data,
+            }
+        ),
+        status=200,
+    )
+
+
+@https_fn.on_request(
+    concurrency=FUNCTION_CONCURRENCY["generate_ai_achievements"],
+    cpu=1,
+    timeout_sec=FUNCTION_TIMEOUTS_SECONDS["generate_ai_achievements"],
+)
+@instrumented
+@load_shed
 def generate_ai_achievements(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
         data = req.get_json()
-        uid = data.get("uid")
+        end_phase("parse")
         questions_answers = data.get("questions")
 
-        if not uid:
+        if not questions_answers:
             return cors_response(
-                json.dumps({"error": "Missing required field: uid"}), status=400
+                json.dumps({"error": "Invalid questions format"}), status=400
             )
-        if not questions_answers:
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+
+        def execute():
+            retry_after = check_rate_limit(db, "generate_ai_achievements", req, uid)
+            end_phase("rate_limit")
+            if retry_after is not None:
+                return too_many_requests(retry_after)
+            return run(generate_plan_for_user(db, async_db(), uid, questions_answers))
+
+        return idempotent(req, db, uid, "generate_ai_achievements", execute)
+    except Exception:
+        logger.exception("Error generating AI achievements")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request(
+    concurrency=FUNCTION_CONCURRENCY["regenerate_achievements"],
+    cpu=1,
+    timeout_sec=FUNCTION_TIMEOUTS_SECONDS["regenerate_achievements"],
+)
+@instrumented
+@load_shed
+def regenerate_achievements(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
+        data = req.get_json()
+        end_phase("parse")
+        scope = data.get("scope", "remaining")
+        planet = data.get("planet")
+        questions_answers = data.get("questions")
+
+        if scope not in REGENERATION_SCOPES:
+            return cors_response(
+                json.dumps(
+                    {"error": f"scope must be one of {', '.join(REGENERATION_SCOPES)}"}
+                ),
+                status=400,
+            )
+        if planet is not None and (
+            not isinstance(planet, int) or isinstance(planet, bool)
+        ):
+            return cors_response(
+                json.dumps({"error": "planet must be an integer"}), status=400
+            )
+        if questions_answers is not None and not valid_questions(questions_answers):
             return cors_response(
                 json.dumps({"error": "Invalid questions format"}), status=400
             )
+
+        end_phase("validate")
         db: google.cloud.firestore.Client = firestore.client()
+        retry_after = check_rate_limit(db, "regenerate_achievements", req, uid)
+        end_phase("rate_limit")
+        if retry_after is not None:
+            return too_many_requests(retry_after)
         user_ref = db.collection("users").document(uid)
         user_doc = user_ref.get()
+        end_phase("firestore_read")
 
         if not user_doc.exists:
             return cors_response(
                 json.dumps({"error": "User not found"}),
                 status=404,
             )
+
+        user_data = user_doc.to_dict()
+        plan = user_data.get("achievements")
+        if not plan:
+            return cors_response(
+                json.dumps({"error": "User has no achievements to regenerate"}),
+                status=409,
+            )
+        # Merge into (and stamp the version of) a fully migrated tree; check
+        # it before the LLM call, which cannot fix the kept planets
+        plan, _ = upgrade_achievements(plan, user_data.get(VERSION_FIELD, 0))
+        if not valid_achievements(plan):
+            logger.error("Stored achievements of %s are invalid after upgrade", uid)
+            return cors_response(
+                json.dumps({"error": "Stored achievements are invalid"}),
+                status=409,
+            )
+        if questions_answers is None:
+            questions_answers = user_data.get("questionnaire")
+        if not questions_answers:
+            return cors_response(
+                json.dumps({"error": "Missing required field: questions"}), status=400
+            )
+
         try:
-            result = generate_gamified_structure(questions_answers)
-            data = result
-            if not valid_achievements(data):
-                raise ValueError("Generated achievements structure is invalid")
-        except Exception as e:
-            print(f"Error generating gamified structure: {str(e)}")
-            print(f"Traceback: {traceback.format_exc()}")
-            # Fallback to default response if Gemini fails
-            with open("default_response.json", "r") as f:
-                data = json.load(f)
-
-        achievement_id_counter = 0
-        for planet in data.get("planets", []):
-            for achievement in planet.get("achievements", []):
-                achievement["completed"] = False
-                achievement["id"] = achievement_id_counter
-                achievement_id_counter += 1
-        user_ref.update({"achievements": data})
+            planet_indices = planets_to_regenerate(
+                plan, scope, planet, user_data.get("currentPlanet", 0)
+            )
+        except ValueError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=400)
+        if not planet_indices:
+            return cors_response(
+                json.dumps(
+                    {"message": "No planets to regenerate", "achievements": plan}
+                ),
+                status=200,
+            )
+
+        today = parse_plan_date(None).isoformat()
+        exceeded = check_budget(db, today, uid)
+        end_phase("firestore_read")
+        if exceeded:
+            record_rejection(db, today, exceeded)
+            if exceeded == "user":
+                return cors_response(
+                    json.dumps({"error": "Daily plan generation limit reached"}),
+                    status=429,
+                )
+            return cors_response(
+                json.dumps({"error": "Plan generation is temporarily unavailable"}),
+                status=503,
+            )
+
+        usage = {}
+        started = time.perf_counter()
+        try:
+            generated = generate_planets(
+                questions_answers, plan, planet_indices, today, usage
+            )
+            end_phase("llm")
+            generated, _ = upgrade_achievements(generated)
+            merged = merge_regenerated_planets(plan, planet_indices, generated)
+            if not valid_achievements(merged):
+                raise ValueError("Regenerated achievements structure is invalid")
+            end_phase("validate")
+        except Exception:
+            logger.exception("Error regenerating planets")
+            record_llm_outcome(
+                db,
+                today,
+                uid,
+                "generate_planets",
+                "invalid" if usage else "fallback",
+                started,
+                usage,
+            )
+            return cors_response(
+                json.dumps({"error": "Failed to regenerate achievements"}), status=502
+            )
+        record_llm_outcome(db, today, uid, "generate_planets", "success", started, usage)
+
+        batch = db.batch()
+        batch.update(
+            user_ref,
+            {
+                "achievements": merged,
+                VERSION_FIELD: ACHIEVEMENTS_SCHEMA_VERSION,
+                "currentPlanet": current_planet_index(merged),
+                "questionnaire": questions_answers,
+                **write_stamp("achievements"),
+            },
+            option=db.write_option(last_update_time=user_doc.update_time),
+        )
+        write_achievement_index(db, batch, uid, merged)
+        batch.commit()
+        invalidate_user(uid)
+        end_phase("firestore_write")
 
         return cors_response(
             json.dumps(
                 {
-                    "message": "Achievements generated and stored successfully",
-                    "achievements": data,
+                    "message": "Achievements regenerated successfully",
+                    "regeneratedPlanets": planet_indices,
+                    "achievements": merged,
                 }
             ),
             status=200,
         )
-    except Exception as e:
-        print(f"Error generating AI achievements: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error regenerating achievements")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def fetch_achievements(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
-        data = req.get_json()
-        uid = data.get("uid")
-
-        if not uid:
-            return cors_response(
-                json.dumps({"error": "Missing required field: uid"}), status=400
-            )
-
-        if not isinstance(uid, str):
-            return cors_response(
-                json.dumps({"error": "Invalid type for field: uid"}), status=400
-            )
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
 
         db: google.cloud.firestore.Client = firestore.client()
-        user_doc = db.collection("users").document(uid).get()
-        if not user_doc.exists:
+        user_data = get_user_data(db, uid)
+        end_phase("firestore_read")
+        if user_data is None:
             return cors_response(json.dumps({"error": "User not found"}), status=404)
 
-        user_data = user_doc.to_dict()
         achievements = user_data.get("achievements", {})
 
         return cors_response(json.dumps({"achievements": achievements}), status=200)
 
-    except Exception as e:
-        print(f"Error fetching achievements: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("Error fetching achievements")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request()
+@instrumented
+@load_shed
+def fetch_active_achievements(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+
+        try:
+            today = parse_plan_date(data.get("date"))
+        except ValueError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=400)
+
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+        achievements = active_achievements(db, uid, today)
+        end_phase("firestore_read")
+
+        return cors_response(
+            json.dumps({"date": today.isoformat(), "achievements": achievements}),
+            status=200,
+        )
+
+    except Exception:
+        logger.exception("Error fetching active achievements")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def store_game_data(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
         data = req.get_json()
-        uid = data.get("uid")
+        end_phase("parse")
         store_game_data = data.get("gameData")
 
-        if not uid or store_game_data is None:
+        if store_game_data is None:
             return cors_response(
-                json.dumps({"error": "Missing required fields: uid and gameData"}),
+                json.dumps({"error": "Missing required field: gameData"}),
                 status=400,
             )
         if not isinstance(store_game_data, dict):
@@ -634,58 +1027,575 @@ def store_game_data(req: https_fn.Request):
                 json.dumps({"error": "gameData must be a dictionary"}), status=400
             )
 
+        end_phase("validate")
         db: google.cloud.firestore.Client = firestore.client()
-        user_ref = db.collection("users").document(uid)
-        user_doc = user_ref.get()
 
-        if not user_doc.exists:
+        try:
+            game_data_fields, stats = encode_game_data(store_game_data)
+        except GameDataTooLargeError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=413)
+        end_phase("encode")
+
+        def execute():
+            try:
+                # update() fails on a missing document, so no existence read is needed
+                db.collection("users").document(uid).update(
+                    {**game_data_fields, **write_stamp("gameData")}
+                )
+            except NotFound:
+                return cors_response(
+                    json.dumps({"error": "User not found"}),
+                    status=404,
+                )
+            finally:
+                invalidate_user(uid)
+            end_phase("firestore_write")
+            logger.info("Stored game data", extra={"fields": stats})
             return cors_response(
-                json.dumps({"error": "User not found"}),
-                status=404,
+                json.dumps(
+                    {
+                        "message": "Game data stored successfully",
+                        "storedBytes": stats["storedBytes"],
+                    }
+                ),
+                status=200,
             )
 
-        user_ref.update({"gameData": store_game_data})
-        return cors_response(
-            json.dumps({"message": "Game data stored successfully"}),
-            status=200,
-        )
-    except Exception as e:
-        print(f"Error storing game data: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+        return idempotent(req, db, uid, "store_game_data", execute)
+    except Exception:
+        logger.exception("Error storing game data")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
 
 
 @https_fn.on_request()
+@instrumented
+@load_shed
 def fetch_game_data(req: https_fn.Request):
     cors_resp = handle_cors(req)
     if cors_resp:
         return cors_resp
 
     try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
+
+        db: google.cloud.firestore.Client = firestore.client()
+        user_data = get_user_data(db, uid)
+        end_phase("firestore_read")
+        if user_data is None:
+            return cors_response(json.dumps({"error": "User not found"}), status=404)
+
+        game_data = decode_game_data(user_data)
+        end_phase("decode")
+
+        return cors_response(json.dumps({"gameData": game_data}), status=200)
+
+    except Exception:
+        logger.exception("Error fetching game data")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request()
+@instrumented
+@load_shed
+def fetch_stats(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        try:
+            uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
+
+        db: google.cloud.firestore.Client = firestore.client()
+        summary = fetch_summary(db)
+        end_phase("firestore_read")
+        if summary is None:
+            return cors_response(
+                json.dumps({"error": "Stats not available yet"}), status=404
+            )
+
+        return cors_response(json.dumps({"stats": summary}), status=200)
+
+    except Exception:
+        logger.exception("Error fetching stats")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request()
+@instrumented
+@load_shed
+def record_game_events(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
         data = req.get_json()
-        uid = data.get("uid")
+        end_phase("parse")
+        events = data.get("events")
 
-        if not uid:
+        if not isinstance(events, list) or not 0 < len(events) <= MAX_EVENTS_PER_BATCH:
             return cors_response(
-                json.dumps({"error": "Missing required field: uid"}), status=400
+                json.dumps(
+                    {
+                        "error": f"events must be a list of 1 to {MAX_EVENTS_PER_BATCH} events"
+                    }
+                ),
+                status=400,
             )
+        deltas, rejected = aggregate_events(events)
+        if not deltas:
+            return cors_response(
+                json.dumps({"error": "No valid events", "rejected": rejected}),
+                status=400,
+            )
+
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+
+        def execute():
+            today = parse_plan_date(None).isoformat()
+            result = ingest_game_events(db, uid, deltas, today)
+            end_phase("firestore_write")
+            if result is None:
+                return cors_response(
+                    json.dumps({"error": "User not found"}), status=404
+                )
+            if result["completed"]:
+                invalidate_user(uid)
 
-        if not isinstance(uid, str):
             return cors_response(
-                json.dumps({"error": "Invalid type for field: uid"}), status=400
+                json.dumps(
+                    {
+                        "message": "Game events stored successfully",
+                        "accepted": len(events) - len(rejected),
+                        "rejected": rejected,
+                        **result,
+                    }
+                ),
+                status=200,
             )
 
+        # Counters are incremented, so a retried batch must not be applied twice
+        return idempotent(req, db, uid, "record_game_events", execute)
+
+    except Exception:
+        logger.exception("Error ingesting game events")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request(concurrency=FUNCTION_CONCURRENCY["fetch_changes"], cpu=1)
+@instrumented
+@load_shed
+def fetch_changes(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        try:
+            uid = uid_from_request(req)
+        except InvalidTokenError:
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+        end_phase("auth")
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+        token = data.get("token")
+        wait = data.get("wait", MAX_WAIT_SECONDS)
+
+        if token is not None and not isinstance(token, str):
+            return cors_response(
+                json.dumps({"error": "token must be a string"}), status=400
+            )
+        if (
+            not isinstance(wait, (int, float))
+            or isinstance(wait, bool)
+            or not MIN_WAIT_SECONDS <= wait <= MAX_WAIT_SECONDS
+        ):
+            return cors_response(
+                json.dumps(
+                    {
+                        "error": f"wait must be between {MIN_WAIT_SECONDS} and {MAX_WAIT_SECONDS} seconds"
+                    }
+                ),
+                status=400,
+            )
+        try:
+            since = decode_token(token) if token else None
+        except ValueError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=400)
+
+        end_phase("validate")
         db: google.cloud.firestore.Client = firestore.client()
-        user_doc = db.collection("users").document(uid).get()
-        if not user_doc.exists:
+        if since is None:
+            # First call: the current state of every section and a token
+            user_data = get_user_data(db, uid)
+            end_phase("firestore_read")
+        else:
+            remaining = remaining_seconds()
+            if remaining is not None:
+                # Answer before the request's own deadline
+                wait = max(0, min(wait, remaining - 1))
+            exists, user_data = wait_for_changes(db, uid, since, wait)
+            end_phase("watch")
+            if exists and user_data is None:
+                return cors_response(
+                    json.dumps({"token": token, "changes": {}}), status=200
+                )
+        if user_data is None:
             return cors_response(json.dumps({"error": "User not found"}), status=404)
 
-        user_data = user_doc.to_dict()
-        game_data = user_data.get("gameData", {})
+        return cors_response(
+            json.dumps(
+                {
+                    "token": encode_token(section_versions(user_data)),
+                    "changes": changes_since(user_data, since),
+                }
+            ),
+            status=200,
+        )
 
-        return cors_response(json.dumps({"gameData": game_data}), status=200)
+    except Exception:
+        logger.exception("Error fetching changes")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+# Admin functions
+@https_fn.on_request(timeout_sec=FUNCTION_TIMEOUTS_SECONDS["bulk_create_users"])
+@instrumented
+@load_shed
+def bulk_create_users(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
 
-    except Exception as e:
-        print(f"Error fetching game data: {str(e)}")
-        print(f"Traceback: {traceback.format_exc()}")
+    try:
+        if not is_admin_request(req):
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+        users = data.get("users")
+
+        if not isinstance(users, list) or not 0 < len(users) <= MAX_BULK_USERS:
+            return cors_response(
+                json.dumps(
+                    {"error": f"users must be a list of 1 to {MAX_BULK_USERS} users"}
+                ),
+                status=400,
+            )
+
+        # Invalid rows are reported and skipped; the rest are still created
+        results = [None] * len(users)
+        rows = []
+        row_indexes = []
+        seen_emails = set()
+        for index, user in enumerate(users):
+            if not isinstance(user, dict):
+                results[index] = {"index": index, "error": "Invalid user format"}
+                continue
+            email = user.get("email")
+            error = user_fields_error(
+                email, user.get("password"), user.get("firstName"), user.get("lastName")
+            )
+            if error is None and email.lower() in seen_emails:
+                error = "Duplicate email in request"
+            if error:
+                results[index] = {"index": index, "email": email, "error": error}
+                continue
+            seen_emails.add(email.lower())
+            rows.append(user)
+            row_indexes.append(index)
+
+        end_phase("validate")
+        started = time.perf_counter()
+        db: google.cloud.firestore.Client = firestore.client()
+        if rows:
+            for index, result in zip(row_indexes, onboard_users(db, rows)):
+                result["index"] = index
+                results[index] = result
+        elapsed = time.perf_counter() - started
+        end_phase("firestore_write")
+
+        created = sum(1 for result in results if "uid" in result)
+        throughput = created / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            "Onboarded %d of %d users in %.1fs (%.1f users/s)",
+            created,
+            len(users),
+            elapsed,
+            throughput,
+        )
+
+        return cors_response(
+            json.dumps(
+                {
+                    "created": created,
+                    "failed": len(users) - created,
+                    "elapsedMs": round(elapsed * 1000),
+                    "usersPerSecond": round(throughput, 1),
+                    "results": results,
+                }
+            ),
+            status=200,
+        )
+
+    except Exception:
+        logger.exception("Error bulk creating users")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request(timeout_sec=FUNCTION_TIMEOUTS_SECONDS["export_users"])
+@instrumented
+@load_shed
+def export_users(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        if not is_admin_request(req):
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+        fields = data.get("fields")
+        updated_since = data.get("updatedSince")
+        use_gzip = data.get("gzip", False)
+        page_size = data.get("pageSize", 500)
+        cursor = data.get("cursor")
+
+        if fields is not None:
+            if not isinstance(fields, list) or not all(
+                isinstance(field, str) for field in fields
+            ):
+                return cors_response(
+                    json.dumps({"error": "fields must be a list of strings"}),
+                    status=400,
+                )
+            unknown_fields = [field for field in fields if field not in EXPORT_FIELDS]
+            if unknown_fields:
+                return cors_response(
+                    json.dumps(
+                        {"error": f"Unknown fields: {', '.join(unknown_fields)}"}
+                    ),
+                    status=400,
+                )
+        if updated_since is not None and (
+            not isinstance(updated_since, int) or isinstance(updated_since, bool)
+        ):
+            return cors_response(
+                json.dumps({"error": "updatedSince must be a unix timestamp"}),
+                status=400,
+            )
+        if not isinstance(use_gzip, bool):
+            return cors_response(
+                json.dumps({"error": "gzip must be a boolean"}), status=400
+            )
+        if (
+            not isinstance(page_size, int)
+            or isinstance(page_size, bool)
+            or not 0 < page_size <= MAX_PAGE_SIZE
+        ):
+            return cors_response(
+                json.dumps(
+                    {"error": f"pageSize must be between 1 and {MAX_PAGE_SIZE}"}
+                ),
+                status=400,
+            )
+
+        if cursor is not None:
+            try:
+                if not isinstance(cursor, str):
+                    raise ValueError("Invalid cursor")
+                # Checked here: once streaming starts, errors truncate the body
+                decode_cursor(cursor, updated_since)
+            except ValueError as e:
+                return cors_response(json.dumps({"error": str(e)}), status=400)
+
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+        deadline = time.monotonic() + EXPORT_TIME_BUDGET_SECONDS
+        response = cors_response(
+            stream_users_ndjson(
+                db, fields, updated_since, page_size, use_gzip, cursor, deadline
+            ),
+            status=200,
+        )
+        response.headers["Content-Type"] = "application/x-ndjson"
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    except Exception:
+        logger.exception("Error exporting users")
         return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request()
+@instrumented
+@load_shed
+def fetch_due_achievements(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        if not is_admin_request(req):
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+        date_field = data.get("dateField", "endDate")
+        achievement_type = data.get("type")
+        page_size = data.get("pageSize", 500)
+        start_after = data.get("startAfter")
+
+        try:
+            date = parse_plan_date(data.get("date"))
+        except ValueError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=400)
+        if date_field not in REMINDER_DATE_FIELDS:
+            return cors_response(
+                json.dumps(
+                    {"error": f"dateField must be one of {', '.join(REMINDER_DATE_FIELDS)}"}
+                ),
+                status=400,
+            )
+        if achievement_type is not None and achievement_type not in [
+            "progress",
+            "game",
+            "streak",
+        ]:
+            return cors_response(
+                json.dumps({"error": "type must be progress, game or streak"}),
+                status=400,
+            )
+        if (
+            not isinstance(page_size, int)
+            or isinstance(page_size, bool)
+            or not 0 < page_size <= MAX_REMINDER_PAGE_SIZE
+        ):
+            return cors_response(
+                json.dumps(
+                    {"error": f"pageSize must be between 1 and {MAX_REMINDER_PAGE_SIZE}"}
+                ),
+                status=400,
+            )
+        if start_after is not None and not isinstance(start_after, str):
+            return cors_response(
+                json.dumps({"error": "startAfter must be a string"}), status=400
+            )
+
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+        achievements = achievements_due_on(
+            db, date, date_field, achievement_type, page_size, start_after
+        )
+        end_phase("firestore_read")
+        next_page = achievements[-1]["key"] if len(achievements) == page_size else None
+
+        return cors_response(
+            json.dumps(
+                {
+                    "date": date.isoformat(),
+                    "achievements": achievements,
+                    "nextPageStartAfter": next_page,
+                }
+            ),
+            status=200,
+        )
+
+    except Exception:
+        logger.exception("Error fetching due achievements")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+@https_fn.on_request()
+@instrumented
+@load_shed
+def fetch_llm_usage(req: https_fn.Request):
+    cors_resp = handle_cors(req)
+    if cors_resp:
+        return cors_resp
+
+    try:
+        if not is_admin_request(req):
+            return cors_response(json.dumps({"error": "Unauthorized"}), status=401)
+
+        data = req.get_json(silent=True) or {}
+        end_phase("parse")
+        try:
+            date = parse_plan_date(data.get("date"))
+        except ValueError as e:
+            return cors_response(json.dumps({"error": str(e)}), status=400)
+
+        end_phase("validate")
+        db: google.cloud.firestore.Client = firestore.client()
+        usage = daily_usage(db, date.isoformat())
+        end_phase("firestore_read")
+
+        return cors_response(
+            json.dumps({"date": date.isoformat(), "usage": usage}), status=200
+        )
+
+    except Exception:
+        logger.exception("Error fetching LLM usage")
+        return cors_response(json.dumps({"error": "Internal server error"}), status=500)
+
+
+# Scheduled functions
+# Hourly, starting 00:05: the first run of the day does the rollover, and
+# later runs finish anything a run cut short by its deadline left behind
+@scheduler_fn.on_schedule(
+    schedule="5 * * * *",
+    timezone=scheduler_fn.Timezone(PLAN_TIMEZONE),
+    timeout_sec=FUNCTION_TIMEOUTS_SECONDS["rollover_expired_achievements"],
+)
+def rollover_expired_achievements(event: scheduler_fn.ScheduledEvent) -> None:
+    if ROLLOVER_MODE not in ROLLOVER_MODES:
+        logger.error("Invalid ROLLOVER_MODE: %s", ROLLOVER_MODE)
+        return
+
+    db: google.cloud.firestore.Client = firestore.client()
+    today = parse_plan_date(None)
+    deadline = (
+        time.monotonic()
+        + FUNCTION_TIMEOUTS_SECONDS["rollover_expired_achievements"]
+        - DEADLINE_MARGIN_MS / 1000
+    )
+    result = rollover_expired(db, today, ROLLOVER_MODE, deadline)
+    logger.info("Achievement rollover for %s: %s", today.isoformat(), result)
+
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes")
+def materialize_savings_stats(event: scheduler_fn.ScheduledEvent) -> None:
+    db: google.cloud.firestore.Client = firestore.client()
+    materialize_summary(db, parse_plan_date(None).isoformat())
+
+
+@scheduler_fn.on_schedule(schedule="every 15 minutes", timeout_sec=540)
+def resume_account_deletions(event: scheduler_fn.ScheduledEvent) -> None:
+    db: google.cloud.firestore.Client = firestore.client()
+    completed = resume_deletion_jobs(db)
+    if completed:
+        logger.info("Resumed and completed %d account deletions", completed)
+
+
+# Firestore triggers
+@firestore_fn.on_document_created(document="deletionJobs/{uid}", timeout_sec=540)
+def on_deletion_requested(event: firestore_fn.Event) -> None:
+    db: google.cloud.firestore.Client = firestore.client()
+    run_deletion_job(db, event.params["uid"])
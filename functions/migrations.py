@@ -0,0 +1,77 @@
+import copy
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+
+# Stored on each user document next to 'achievements'. Documents written
+# before versioning existed have no field and are treated as version 0.
+VERSION_FIELD = "achievementsVersion"
+
+
+def _iter_achievements(achievements: Dict[str, Any]):
+    for planet in achievements.get("planets", []):
+        if not isinstance(planet, dict):
+            continue
+        for achievement in planet.get("achievements", []):
+            if isinstance(achievement, dict) and isinstance(
+                achievement.get("data"), dict
+            ):
+                yield achievement
+
+
+def _coerce_int_fields(achievements: Dict[str, Any]) -> Dict[str, Any]:
+    """v1: store whole-number amounts as ints (the schema allows floats)"""
+    for achievement in _iter_achievements(achievements):
+        data = achievement["data"]
+        for key in ("moneyToSave", "numConsecutiveDays", "minimumStreakAmount"):
+            value = data.get(key)
+            if isinstance(value, float):
+                data[key] = int(round(value))
+    return achievements
+
+
+def _fill_streak_defaults(achievements: Dict[str, Any]) -> Dict[str, Any]:
+    """v2: every streak carries 'minimumStreakAmount' and 'frequency'"""
+    for achievement in _iter_achievements(achievements):
+        if achievement.get("type") != "streak":
+            continue
+        data = achievement["data"]
+        if data.get("frequency") not in ["daily", "weekly", "monthly"]:
+            data["frequency"] = "daily"
+        if not isinstance(data.get("minimumStreakAmount"), int):
+            # Descriptions read like "Save at least $15 every day ..."
+            match = re.search(r"\$(\d[\d,]*)", achievement.get("description", ""))
+            data["minimumStreakAmount"] = (
+                int(match.group(1).replace(",", "")) if match else 0
+            )
+    return achievements
+
+
+# Ordered transforms; the last key is the current schema version
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _coerce_int_fields,
+    2: _fill_streak_defaults,
+}
+ACHIEVEMENTS_SCHEMA_VERSION = max(MIGRATIONS)
+
+
+def upgrade_achievements(
+    achievements: Dict[str, Any], from_version: int = 0
+) -> Tuple[Dict[str, Any], List[int]]:
+    """
+    Applies every transform newer than from_version to a copy of the tree.
+
+    Args:
+        achievements: Stored or freshly generated achievements structure
+        from_version: Version the tree is currently at
+
+    Returns:
+        The upgraded tree and the list of versions that were applied
+    """
+    upgraded = copy.deepcopy(achievements)
+    applied = []
+    for version in sorted(MIGRATIONS):
+        if version > from_version:
+            upgraded = MIGRATIONS[version](upgraded)
+            applied.append(version)
+    return upgraded, applied
@@ -0,0 +1,397 @@
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import google.cloud.firestore
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_vector_query import DistanceMeasure
+from google.cloud.firestore_v1.vector import Vector
+
+
+PLANS_COLLECTION = "plans"
+# Counters are spread over shards/{n} under these documents, because every
+# generate request increments them; read them with read_counters
+STATS_DOC = ("stats", "planStore")
+TRAFFIC_DOC = ("stats", "answerTraffic")
+COUNTER_SHARDS = 10
+# Euclidean distance: one differing multiple-choice answer is ~1.41, or
+# ~2.83 for the purpose question, whose options are weighted by 2 so a
+# plan for a different goal is never within the threshold
+DEFAULT_MAX_DISTANCE = 1.5
+PURPOSE_QUESTION = 1
+QUESTION_WEIGHTS = {PURPOSE_QUESTION: 2.0}
+# A donor plan is only adapted when the savings goal and the income are each
+# within this factor of the request's; adjacent options are 2-3x apart
+MAX_MONEY_RATIO = 3.0
+
+with open(os.path.join(os.path.dirname(__file__), "questions.json"), "r") as f:
+    QUESTIONS = json.load(f)["questions"]
+
+# Representative value for each non-"Other" option of the numeric questions:
+# dollars for amounts, months for the timeline question
+NUMERIC_OPTION_VALUES = {
+    3: [250, 750, 1500, 3500, 7500],
+    4: [3, 4.5, 9, 18, 30],
+    6: [750, 1750, 3250, 5000, 7500],
+    7: [750, 1500, 2500, 4000, 6000],
+    8: [0, 500, 3000, 7500, 15000],
+}
+NUMERIC_SCALE = {3: 50000, 4: 60, 6: 20000, 7: 20000, 8: 100000}
+GOAL_QUESTION = 3
+TIMELINE_QUESTION = 4
+INCOME_QUESTION = 6
+DURATION_PATTERN = re.compile(
+    r"\b(\d+)(-|\s+)((?:consecutive\s+)?)(day|week|month)(s?)\b", re.IGNORECASE
+)
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSION = sum(len(q["options"]) for q in QUESTIONS) + len(
+    NUMERIC_OPTION_VALUES
+)
+
+
+def _match_answers(questionnaire: List[Dict[str, str]]) -> Dict[int, str]:
+    """Map question ids to answers, by question text and then by position"""
+    by_text = {q["question_text"].strip().lower(): q["id"] for q in QUESTIONS}
+    answers = {}
+    for idx, qa in enumerate(questionnaire):
+        question_id = by_text.get(qa.get("question", "").strip().lower())
+        if question_id is None and idx < len(QUESTIONS):
+            question_id = QUESTIONS[idx]["id"]
+        if question_id is not None:
+            answers[question_id] = qa.get("answer", "").strip()
+    return answers
+
+
+def _parse_number(text: str) -> Optional[float]:
+    match = re.search(r"(\d[\d,]*(?:\.\d+)?)\s*(k)?", text, re.IGNORECASE)
+    if not match:
+        return None
+    value = float(match.group(1).replace(",", ""))
+    return value * 1000 if match.group(2) else value
+
+
+def _numeric_value(question: Dict[str, Any], answer: str) -> Optional[float]:
+    options = question["options"]
+    values = NUMERIC_OPTION_VALUES[question["id"]]
+    if answer in options[: len(values)]:
+        return values[options.index(answer)]
+    value = _parse_number(answer)
+    if value is not None and question["id"] == TIMELINE_QUESTION:
+        if re.search(r"year", answer, re.IGNORECASE):
+            value *= 12
+        elif re.search(r"week", answer, re.IGNORECASE):
+            value /= 4.345
+    return value
+
+
+def answer_amounts(questionnaire: List[Dict[str, str]]) -> Dict[str, float]:
+    """The numeric answers used to adapt a stored plan, keyed by question id"""
+    answers = _match_answers(questionnaire)
+    amounts = {}
+    for question in QUESTIONS:
+        if question["id"] in NUMERIC_OPTION_VALUES and question["id"] in answers:
+            value = _numeric_value(question, answers[question["id"]])
+            if value is not None:
+                amounts[str(question["id"])] = value
+    return amounts
+
+
+def encode_answers(questionnaire: List[Dict[str, str]]) -> List[float]:
+    """
+    One-hot encodes every multiple-choice answer (free text counts as the
+    question's "Other" option, scaled by QUESTION_WEIGHTS) and appends the
+    numeric answers, log-scaled to roughly [0, 1].
+    """
+    answers = _match_answers(questionnaire)
+    amounts = answer_amounts(questionnaire)
+    vector = []
+    for question in QUESTIONS:
+        one_hot = [0.0] * len(question["options"])
+        answer = answers.get(question["id"])
+        weight = QUESTION_WEIGHTS.get(question["id"], 1.0)
+        if answer:
+            if answer in question["options"]:
+                one_hot[question["options"].index(answer)] = weight
+            else:
+                one_hot[-1] = weight
+        vector.extend(one_hot)
+    for question_id in NUMERIC_OPTION_VALUES:
+        value = amounts.get(str(question_id))
+        scale = NUMERIC_SCALE[question_id]
+        vector.append(
+            math.log1p(min(value, scale)) / math.log1p(scale) if value is not None else 0.0
+        )
+    return vector
+
+
+def plan_key(vector: List[float]) -> str:
+    return hashlib.sha256(
+        json.dumps([round(v, 4) for v in vector]).encode("utf-8")
+    ).hexdigest()
+
+
+def _plan_start_date(plan: Dict[str, Any]) -> datetime.date:
+    dates = [
+        achievement["data"]["startDate"]
+        for planet in plan.get("planets", [])
+        for achievement in planet.get("achievements", [])
+    ]
+    return datetime.date.fromisoformat(min(dates))
+
+
+def _round_amount(value: float) -> int:
+    if value >= 100:
+        return int(round(value / 50.0) * 50)
+    return max(1, int(round(value / 5.0) * 5)) if value >= 5 else max(1, int(round(value)))
+
+
+def _money_scale_compatible(
+    stored_amounts: Dict[str, float], amounts: Dict[str, float]
+) -> bool:
+    for key in (str(GOAL_QUESTION), str(INCOME_QUESTION)):
+        stored, wanted = stored_amounts.get(key), amounts.get(key)
+        if stored and wanted and not (
+            1 / MAX_MONEY_RATIO <= wanted / stored <= MAX_MONEY_RATIO
+        ):
+            return False
+    return True
+
+
+def adapt_plan(
+    stored: Dict[str, Any],
+    stored_amounts: Dict[str, float],
+    amounts: Dict[str, float],
+    base_date: datetime.date,
+    today: datetime.date,
+) -> Dict[str, Any]:
+    """
+    Deterministically fits a stored plan to new answers: money amounts (and
+    the dollar figures in descriptions) scale with the savings goal, and the
+    timeline is moved to start today and stretched to the new horizon, along
+    with the day, week and month counts in descriptions.
+    """
+    plan = copy.deepcopy(stored)
+    goal_key, timeline_key = str(GOAL_QUESTION), str(TIMELINE_QUESTION)
+    money_ratio = 1.0
+    if stored_amounts.get(goal_key) and amounts.get(goal_key):
+        money_ratio = amounts[goal_key] / stored_amounts[goal_key]
+    time_ratio = 1.0
+    if stored_amounts.get(timeline_key) and amounts.get(timeline_key):
+        time_ratio = amounts[timeline_key] / stored_amounts[timeline_key]
+
+    def move(date_str: str) -> str:
+        offset = (datetime.date.fromisoformat(date_str) - base_date).days
+        return (today + datetime.timedelta(days=round(offset * time_ratio))).isoformat()
+
+    def scale_text(match: re.Match) -> str:
+        value = float(match.group(1).replace(",", ""))
+        return f"${_round_amount(value * money_ratio):,}"
+
+    def scale_duration(match: re.Match, streak: Optional[Tuple[int, int]]) -> str:
+        value, separator, consecutive, unit, plural = match.groups()
+        count = int(value)
+        if streak and unit.lower() == "day" and count == streak[0]:
+            # The streak length is clamped, not stretched
+            count = streak[1]
+        elif time_ratio != 1.0:
+            count = max(1, round(count * time_ratio))
+        if separator.strip() != "-":
+            plural = "s" if count != 1 else ""
+        return f"{count}{separator}{consecutive}{unit}{plural}"
+
+    for planet in plan.get("planets", []):
+        for achievement in planet.get("achievements", []):
+            data = achievement["data"]
+            data["startDate"] = move(data["startDate"])
+            data["endDate"] = move(data["endDate"])
+            streak = None
+            if achievement["type"] == "streak":
+                # Keep streak lengths in step with the stretched window
+                window = (
+                    datetime.date.fromisoformat(data["endDate"])
+                    - datetime.date.fromisoformat(data["startDate"])
+                ).days + 1
+                if data.get("frequency", "daily") == "daily":
+                    days = data["numConsecutiveDays"]
+                    data["numConsecutiveDays"] = max(1, min(days, window))
+                    streak = (days, data["numConsecutiveDays"])
+            for field in ("moneyToSave", "minimumStreakAmount"):
+                if isinstance(data.get(field), (int, float)):
+                    data[field] = _round_amount(data[field] * money_ratio)
+            if money_ratio != 1.0:
+                achievement["description"] = re.sub(
+                    r"\$(\d[\d,]*(?:\.\d+)?)", scale_text, achievement["description"]
+                )
+            if time_ratio != 1.0 or (streak and streak[0] != streak[1]):
+                achievement["description"] = DURATION_PATTERN.sub(
+                    lambda match: scale_duration(match, streak),
+                    achievement["description"],
+                )
+    return plan
+
+
+def rebase_plan(plan: Dict[str, Any], today: datetime.date) -> Dict[str, Any]:
+    """plan with its timeline moved to start today, amounts unchanged"""
+    return adapt_plan(plan, {}, {}, _plan_start_date(plan), today)
+
+
+def _strip_progress(plan: Dict[str, Any]) -> Dict[str, Any]:
+    stored = copy.deepcopy(plan)
+    for planet in stored.get("planets", []):
+        for achievement in planet.get("achievements", []):
+            for field in ("id", "completed", "expired"):
+                achievement.pop(field, None)
+    return stored
+
+
+def record_answer_traffic(
+    db: google.cloud.firestore.Client, questionnaire: List[Dict[str, str]]
+) -> None:
+    """
+    Counts how often each option is chosen, as {"q<id>": {"<option index>": n}},
+    so batch pre-generation can prioritise the common answer combinations.
+    """
+    answers = _match_answers(questionnaire)
+    counts = {}
+    for question in QUESTIONS:
+        answer = answers.get(question["id"])
+        if not answer:
+            continue
+        option = (
+            question["options"].index(answer)
+            if answer in question["options"]
+            else len(question["options"]) - 1
+        )
+        counts[f"q{question['id']}"] = {str(option): firestore.Increment(1)}
+    if counts:
+        _increment_counters(db, TRAFFIC_DOC, counts)
+
+
+def _shards(db: google.cloud.firestore.Client, doc: Tuple[str, str]):
+    return db.collection(*doc, "shards")
+
+
+def _increment_counters(
+    db: google.cloud.firestore.Client, doc: Tuple[str, str], counts: Dict[str, Any]
+) -> None:
+    _shards(db, doc).document(str(random.randrange(COUNTER_SHARDS))).set(
+        counts, merge=True
+    )
+
+
+def read_counters(
+    db: google.cloud.firestore.Client, doc: Tuple[str, str]
+) -> Dict[str, Any]:
+    """The counters of STATS_DOC or TRAFFIC_DOC summed over their shards"""
+    totals: Dict[str, Any] = {}
+    for snapshot in _shards(db, doc).stream():
+        for key, value in (snapshot.to_dict() or {}).items():
+            if isinstance(value, dict):
+                nested = totals.setdefault(key, {})
+                for name, count in value.items():
+                    nested[name] = nested.get(name, 0) + count
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _record_lookup(db: google.cloud.firestore.Client, outcome: str) -> None:
+    # A lost counter must not turn a hit into an LLM call
+    try:
+        _increment_counters(db, STATS_DOC, {outcome: firestore.Increment(1)})
+    except Exception:
+        logger.warning("Error counting plan store lookup", exc_info=True)
+
+
+def find_reusable_plan(
+    db: google.cloud.firestore.Client,
+    questionnaire: List[Dict[str, str]],
+    today: datetime.date,
+    max_distance: float = DEFAULT_MAX_DISTANCE,
+) -> Tuple[Optional[Dict[str, Any]], Optional[float]]:
+    """
+    Looks for a stored plan generated from the same or similar answers and
+    adapts it to this questionnaire.
+
+    Returns:
+        The adapted plan and its distance, or (None, None) when nothing is
+        close enough
+    """
+    purpose = _match_answers(questionnaire).get(PURPOSE_QUESTION)
+    purpose_options = next(
+        q["options"] for q in QUESTIONS if q["id"] == PURPOSE_QUESTION
+    )
+    if purpose and purpose not in purpose_options:
+        # Free-text goals all encode as "Other" but are different goals
+        _record_lookup(db, "misses")
+        return None, None
+
+    vector = encode_answers(questionnaire)
+    amounts = answer_amounts(questionnaire)
+    plans = db.collection(PLANS_COLLECTION)
+
+    exact = plans.document(plan_key(vector)).get()
+    if exact.exists:
+        match, distance, outcome = exact.to_dict(), 0.0, "exactHits"
+    else:
+        results = list(
+            plans.find_nearest(
+                vector_field="embedding",
+                query_vector=Vector(vector),
+                limit=1,
+                distance_measure=DistanceMeasure.EUCLIDEAN,
+                distance_result_field="distance",
+                distance_threshold=max_distance,
+            ).stream()
+        )
+        if not results:
+            _record_lookup(db, "misses")
+            return None, None
+        match = results[0].to_dict()
+        distance, outcome = match["distance"], "nearestHits"
+
+    if not _money_scale_compatible(match.get("amounts", {}), amounts):
+        # Scaling every amount by more than this distorts the plan
+        _record_lookup(db, "misses")
+        return None, None
+    _record_lookup(db, outcome)
+    plan = adapt_plan(
+        match["plan"],
+        match.get("amounts", {}),
+        amounts,
+        datetime.date.fromisoformat(match["baseDate"]),
+        today,
+    )
+    return plan, distance
+
+
+def save_plan(
+    db: google.cloud.firestore.Client,
+    questionnaire: List[Dict[str, str]],
+    plan: Dict[str, Any],
+    source: str = "llm",
+) -> str:
+    """Stores a validated plan so later similar questionnaires can reuse it"""
+    vector = encode_answers(questionnaire)
+    key = plan_key(vector)
+    db.collection(PLANS_COLLECTION).document(key).set(
+        {
+            "embedding": Vector(vector),
+            "amounts": answer_amounts(questionnaire),
+            "questionnaire": questionnaire,
+            "plan": _strip_progress(plan),
+            "baseDate": _plan_start_date(plan).isoformat(),
+            "source": source,
+            "created": firestore.SERVER_TIMESTAMP,
+        }
+    )
+    return key
@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import google.cloud.firestore
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from async_runtime import run
+from load_control import call_timeout
+
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Window counters are flat documents "{endpoint}:{key hash}:{window}:{shard}"
+# with an expiresAt TTL field, so old windows are cleaned up by Firestore.
+RATE_LIMIT_COLLECTION = "rateLimits"
+RATE_LIMIT_SHARDS = 4
+MAX_LOCAL_BUCKETS = 10000
+
+# limit requests per window seconds, shared by all instances; burst is the
+# in-instance token bucket's capacity. key is "uid" or "ip".
+DEFAULT_RATE_LIMITS = {
+    "create_user": {"limit": 5, "window": 3600, "burst": 3, "key": "ip"},
+    "generate_ai_achievements": {"limit": 5, "window": 3600, "burst": 2, "key": "uid"},
+    "regenerate_achievements": {"limit": 10, "window": 3600, "burst": 3, "key": "uid"},
+}
+RATE_LIMIT_FIELDS = ["limit", "window", "burst", "key"]
+
+
+def _load_rate_limits(overrides: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """DEFAULT_RATE_LIMITS with each endpoint's overridden fields merged in"""
+    limits = {name: dict(config) for name, config in DEFAULT_RATE_LIMITS.items()}
+    for endpoint, config in overrides.items():
+        merged = {**limits.get(endpoint, {}), **config}
+        missing = [field for field in RATE_LIMIT_FIELDS if field not in merged]
+        if missing:
+            raise ValueError(
+                f"RATE_LIMITS[{endpoint!r}] is missing {', '.join(missing)}"
+            )
+        if merged["key"] not in ("uid", "ip"):
+            raise ValueError(f"RATE_LIMITS[{endpoint!r}] key must be uid or ip")
+        limits[endpoint] = merged
+    return limits
+
+
+RATE_LIMITS = _load_rate_limits(json.loads(os.getenv("RATE_LIMITS", "{}")))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT", "true").lower() == "true"
+
+
+class TokenBucket:
+    """In-instance buckets per key, refilled at rate tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """0 when a token was taken, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket(endpoint: str) -> TokenBucket:
+    with _buckets_lock:
+        if endpoint not in _buckets:
+            config = RATE_LIMITS[endpoint]
+            _buckets[endpoint] = TokenBucket(
+                config["limit"] / config["window"], config["burst"]
+            )
+        return _buckets[endpoint]
+
+
+def client_ip(req) -> str:
+    # Google's front end appends the address it saw to whatever the client
+    # sent, so only the last entry can be trusted
+    forwarded = req.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return req.remote_addr or "unknown"
+
+
+def _increment(shard_ref, expires_at: datetime.datetime) -> None:
+    try:
+        shard_ref.set(
+            {"count": firestore.Increment(1), "expiresAt": expires_at},
+            merge=True,
+            timeout=call_timeout(),
+        )
+    except Exception:
+        logger.warning("Error incrementing rate limit counter", exc_info=True)
+
+
+def _read_shards(db: google.cloud.firestore.Client, shard_refs) -> int:
+    return sum(
+        (snapshot.to_dict() or {}).get("count", 0)
+        for snapshot in db.get_all(shard_refs, timeout=call_timeout())
+    )
+
+
+async def _read_and_increment(db, shard_refs, shard_ref, expires_at) -> int:
+    count, _ = await asyncio.gather(
+        asyncio.to_thread(_read_shards, db, shard_refs),
+        asyncio.to_thread(_increment, shard_ref, expires_at),
+    )
+    return count
+
+
+def check_rate_limit(
+    db: google.cloud.firestore.Client, endpoint: str, req, uid: Optional[str] = None
+) -> Optional[int]:
+    """
+    Seconds the caller should wait before retrying, or None if the request
+    may proceed. The local bucket rejects bursts without touching
+    Firestore; otherwise the window's shards are read in one get_all while
+    one of them is incremented, in a single round trip. The read is taken
+    not to include this request, so it is counted as count + 1; when the
+    read does see its increment, the caller is limited one request early.
+    Rejected requests still count towards the window. A failed increment
+    is logged and the request allowed.
+    """
+    config = RATE_LIMITS.get(endpoint)
+    if not RATE_LIMIT_ENABLED or config is None:
+        return None
+    subject = uid if config["key"] == "uid" and uid else client_ip(req)
+
+    wait = _bucket(endpoint).take(subject)
+    if wait > 0:
+        return math.ceil(wait)
+
+    now = time.time()
+    window = config["window"]
+    window_start = int(now // window) * window
+    key_hash = hashlib.sha256(subject.encode("utf-8")).hexdigest()[:16]
+    collection = db.collection(RATE_LIMIT_COLLECTION)
+    shard_refs = [
+        collection.document(f"{endpoint}:{key_hash}:{window_start}:{n}")
+        for n in range(RATE_LIMIT_SHARDS)
+    ]
+    expires_at = datetime.datetime.fromtimestamp(
+        window_start + 2 * window, tz=datetime.timezone.utc
+    )
+    # Written before the response: background work is throttled (or lost)
+    # once an instance has answered
+    count = run(
+        _read_and_increment(db, shard_refs, random.choice(shard_refs), expires_at)
+    )
+    if count + 1 > config["limit"]:
+        return math.ceil(window_start + window - now)
+    return None
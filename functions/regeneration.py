@@ -0,0 +1,54 @@
+import copy
+from typing import Any, Dict, List, Optional
+
+
+REGENERATION_SCOPES = ["planet", "remaining"]
+
+
+def planets_to_regenerate(
+    plan: Dict[str, Any], scope: str, planet: Optional[int], current_planet: int
+) -> List[int]:
+    """
+    Zero-based planet indices to replace: either the one requested planet,
+    or every planet after the user's current one.
+    """
+    planet_count = len(plan.get("planets", []))
+    if scope == "planet":
+        if planet is None or not 0 <= planet < planet_count:
+            raise ValueError(f"planet must be between 0 and {planet_count - 1}")
+        return [planet]
+    if scope == "remaining":
+        return list(range(current_planet + 1, planet_count))
+    raise ValueError(f"Unknown regeneration scope: {scope}")
+
+
+def merge_regenerated_planets(
+    plan: Dict[str, Any], planet_indices: List[int], generated: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Returns a copy of plan where each planet in planet_indices keeps its
+    name, image and completed achievements and takes its remaining
+    achievements from the matching generated planet. New achievements get
+    fresh ids above every id already used, so existing ids never change.
+    """
+    merged = copy.deepcopy(plan)
+    next_id = 1 + max(
+        (
+            achievement.get("id", -1)
+            for planet in merged.get("planets", [])
+            for achievement in planet.get("achievements", [])
+        ),
+        default=-1,
+    )
+
+    for planet_index, new_planet in zip(planet_indices, generated.get("planets", [])):
+        planet = merged["planets"][planet_index]
+        kept = [a for a in planet.get("achievements", []) if a.get("completed")]
+        for achievement in new_planet.get("achievements", []):
+            achievement["completed"] = False
+            achievement["id"] = next_id
+            next_id += 1
+            kept.append(achievement)
+        planet["achievements"] = kept
+
+    return merged
@@ -0,0 +1,112 @@
+import os
+import random
+import time
+from typing import Any, Dict, Optional
+
+import google.cloud.firestore
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+
+load_dotenv()
+
+# Counters are spread over STATS_SHARDS documents in stats/savings/shards so
+# deposits are not limited by one document's write rate: "total-{n}" holds
+# all-time totals and "{date}-{n}" the counters of one day. Readers use
+# stats/summary, which materialize_summary rewrites from the shards.
+STATS_DOC = ("stats", "savings")
+SUMMARY_DOC = ("stats", "summary")
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", "10"))
+
+
+def _shards(db: google.cloud.firestore.Client):
+    return db.collection(*STATS_DOC, "shards")
+
+
+def record_deposit(
+    transaction,
+    db: google.cloud.firestore.Client,
+    date: str,
+    amount: float,
+    new_saver_planet: Optional[int],
+) -> None:
+    """
+    Adds a deposit to one random shard as part of the deposit transaction.
+    new_saver_planet is the depositor's current planet on their first
+    deposit of the day, and None otherwise.
+    """
+    shard = random.randrange(STATS_SHARDS)
+    transaction.set(
+        _shards(db).document(f"total-{shard}"),
+        {"totalMoney": firestore.Increment(amount)},
+        merge=True,
+    )
+    daily = {
+        "deposits": firestore.Increment(1),
+        "depositAmount": firestore.Increment(amount),
+    }
+    if new_saver_planet is not None:
+        daily["activeSavers"] = {str(new_saver_planet): firestore.Increment(1)}
+    transaction.set(_shards(db).document(f"{date}-{shard}"), daily, merge=True)
+
+
+def _sum_shards(snapshots) -> Dict[str, Any]:
+    totals: Dict[str, Any] = {}
+    for snapshot in snapshots:
+        for field, value in (snapshot.to_dict() or {}).items():
+            if isinstance(value, dict):
+                counts = totals.setdefault(field, {})
+                for key, count in value.items():
+                    counts[key] = counts.get(key, 0) + count
+            else:
+                totals[field] = totals.get(field, 0) + value
+    return totals
+
+
+def materialize_summary(
+    db: google.cloud.firestore.Client, date: str
+) -> Dict[str, Any]:
+    """Sums the total and the date's shards into stats/summary (2N reads, 1 write)"""
+    shards = _shards(db)
+    refs = [shards.document(f"total-{n}") for n in range(STATS_SHARDS)] + [
+        shards.document(f"{date}-{n}") for n in range(STATS_SHARDS)
+    ]
+    snapshots = list(db.get_all(refs))
+    total = _sum_shards(s for s in snapshots if s.id.startswith("total-"))
+    today = _sum_shards(s for s in snapshots if not s.id.startswith("total-"))
+    summary = {
+        "totalMoney": total.get("totalMoney", 0),
+        "date": date,
+        "depositsToday": today.get("deposits", 0),
+        "depositAmountToday": today.get("depositAmount", 0),
+        "activeSaversByPlanet": today.get("activeSavers", {}),
+        "updated": int(time.time()),
+    }
+    db.collection(SUMMARY_DOC[0]).document(SUMMARY_DOC[1]).set(summary)
+    return summary
+
+
+def fetch_summary(db: google.cloud.firestore.Client) -> Optional[Dict[str, Any]]:
+    snapshot = db.collection(SUMMARY_DOC[0]).document(SUMMARY_DOC[1]).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def reconcile_total_money(db: google.cloud.firestore.Client) -> float:
+    """
+    Corrects the all-time total to the sum of all balances (balances from
+    before the counters existed, or writes that bypassed add_money).
+    Deposits made while this runs may be counted twice or not at all.
+    Returns the correction applied.
+    """
+    result = db.collection("users").sum("money", alias="money").get()
+    balances = result[0][0].value or 0
+    shards = _shards(db)
+    counted = _sum_shards(
+        db.get_all([shards.document(f"total-{n}") for n in range(STATS_SHARDS)])
+    ).get("totalMoney", 0)
+    correction = balances - counted
+    if correction:
+        shards.document("total-0").set(
+            {"totalMoney": firestore.Increment(correction)}, merge=True
+        )
+    return correction
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Off unless CAPTURE_SAMPLE_RATE > 0. Records go to CAPTURE_PATH as JSONL
+# (emulators), or without it to the "capture" logger, whose lines a log
+# sink can export (deployed functions). scripts/replay_traffic.py replays them.
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0"))
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+CAPTURE_MAX_BODY_BYTES = int(os.getenv("CAPTURE_MAX_BODY_BYTES", "65536"))
+# Body fields replaced by placeholders; the replayer fills in its own values.
+# "answer" covers the questionnaire, whose answers include income, expenses
+# and savings
+REDACTED_FIELDS = ["email", "password", "firstName", "lastName", "answer"]
+# Replaced by "<field:N>", N being the value's JSON size, so the replayer can
+# send a stand-in of the same size
+SIZED_FIELDS = ["gameData"]
+# Request headers kept because they change how a request is handled
+KEPT_HEADERS = ["Idempotency-Key", "X-Request-Timeout-Ms"]
+
+logger = logging.getLogger(__name__)
+capture_logger = logging.getLogger("capture")
+_file_lock = threading.Lock()
+
+
+def _client_id(req) -> Optional[str]:
+    """Pseudonym for the caller's ID token, stable for its session"""
+    header = req.headers.get("Authorization", "")
+    if not header:
+        return None
+    return hashlib.sha256(header.encode("utf-8")).hexdigest()[:16]
+
+
+def _sampled(client: Optional[str]) -> bool:
+    # Whole sessions are sampled, so replayed users see coherent sequences
+    if client is None:
+        return random.random() < CAPTURE_SAMPLE_RATE
+    return int(client[:8], 16) / 0xFFFFFFFF < CAPTURE_SAMPLE_RATE
+
+
+def _placeholder(key: str, item: Any) -> Any:
+    if key in REDACTED_FIELDS:
+        return f"<{key}>"
+    if key in SIZED_FIELDS:
+        return f"<{key}:{len(json.dumps(item, separators=(',', ':')))}>"
+    return sanitize(item)
+
+
+def sanitize(value: Any) -> Any:
+    """
+    value with REDACTED_FIELDS replaced by "<field>" and SIZED_FIELDS by
+    "<field:size>" placeholders, recursively
+    """
+    if isinstance(value, dict):
+        return {key: _placeholder(key, item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    return value
+
+
+def capture_request(
+    req, endpoint: str, status: int, started: float, duration_ms: float
+) -> None:
+    """Records a handled request, if sampled. Never raises."""
+    if CAPTURE_SAMPLE_RATE <= 0 or req.method == "OPTIONS":
+        return
+    try:
+        client = _client_id(req)
+        if not _sampled(client):
+            return
+        raw = req.get_data(cache=True)
+        record = {
+            "t": round(started, 3),
+            "endpoint": endpoint,
+            "method": req.method,
+            "client": client,
+            "admin": bool(req.headers.get("X-Admin-Key")),
+            "headers": {h: req.headers[h] for h in KEPT_HEADERS if h in req.headers},
+            "status": status,
+            "durationMs": round(duration_ms, 1),
+        }
+        if len(raw) > CAPTURE_MAX_BODY_BYTES:
+            record["bodyBytes"] = len(raw)
+        elif raw:
+            record["body"] = sanitize(json.loads(raw))
+
+        line = json.dumps(record, separators=(",", ":"))
+        if CAPTURE_PATH:
+            with _file_lock, open(CAPTURE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            capture_logger.info(line)
+    except Exception:
+        logger.warning("Error capturing request", exc_info=True)
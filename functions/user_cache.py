@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import google.cloud.firestore
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from load_control import call_timeout
+
+
+load_dotenv()
+
+# Incremented by every write to a user document, so a cached copy can be
+# told apart from a newer one
+DOC_VERSION_FIELD = "version"
+# Per-section counters, incremented by writes that change that section, so
+# the change feed can tell clients what changed
+SECTION_VERSIONS_FIELD = "sectionVersions"
+SECTIONS = ["money", "achievements", "gameData"]
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+
+
+def write_stamp(*sections: str) -> Dict[str, Any]:
+    """
+    Fields every user document write sets alongside its own changes.
+    sections are the SECTIONS the write changes; their keys are field paths,
+    so pass sections only to update() calls.
+    """
+    stamp = {"updated": int(time.time()), DOC_VERSION_FIELD: firestore.Increment(1)}
+    for section in sections:
+        stamp[f"{SECTION_VERSIONS_FIELD}.{section}"] = firestore.Increment(1)
+    return stamp
+
+
+class UserCache:
+    """
+    Bounded LRU of user documents that expire after ttl seconds. Writes on
+    this instance invalidate their entry; writes on other instances show
+    up once the entry expires.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[uid]
+                return None
+            self._entries.move_to_end(uid)
+            return data
+
+    def put(self, uid: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            cached = self._entries.get(uid)
+            # A slow read must not replace a newer copy fetched meanwhile
+            if cached is not None and cached[0].get(DOC_VERSION_FIELD, 0) > data.get(
+                DOC_VERSION_FIELD, 0
+            ):
+                return
+            self._entries[uid] = (data, time.monotonic() + self.ttl)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, uid: str) -> None:
+        with self._lock:
+            self._entries.pop(uid, None)
+
+
+_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_SIZE)
+
+
+def get_user_data(
+    db: google.cloud.firestore.Client, uid: str
+) -> Optional[Dict[str, Any]]:
+    """
+    The user's document, from the cache when fresh. None when the user does
+    not exist (misses are not cached). Callers must not modify the result.
+    """
+    data = _cache.get(uid)
+    if data is not None:
+        return data
+    snapshot = db.collection("users").document(uid).get(timeout=call_timeout())
+    if not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    if USER_CACHE_TTL_SECONDS > 0:
+        _cache.put(uid, data)
+    return data
+
+
+async def aget_user_data(
+    adb: google.cloud.firestore.AsyncClient, uid: str
+) -> Optional[Dict[str, Any]]:
+    """get_user_data through the async Firestore client"""
+    data = _cache.get(uid)
+    if data is not None:
+        return data
+    snapshot = await adb.collection("users").document(uid).get(
+        timeout=call_timeout()
+    )
+    if not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    if USER_CACHE_TTL_SECONDS > 0:
+        _cache.put(uid, data)
+    return data
+
+
+def invalidate_user(uid: str) -> None:
+    _cache.invalidate(uid)
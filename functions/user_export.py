@@ -0,0 +1,160 @@
+import base64
+import json
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+import google.cloud.firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from game_data_codec import CODEC_FIELD, decode_game_data
+
+
+# Top-level user document fields that may be requested in an export
+EXPORT_FIELDS = [
+    "firstName",
+    "lastName",
+    "email",
+    "joined",
+    "updated",
+    "version",
+    "money",
+    "achievements",
+    "gameData",
+]
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Opaque resume cursor for the given query position"""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, updated_since: Optional[int]) -> Dict[str, Any]:
+    """
+    Query position of a resume cursor; raises ValueError when it is
+    malformed or was issued for an export with(out) updated_since
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(position, dict) or not isinstance(
+        position.get("__name__"), str
+    ):
+        raise ValueError("Invalid cursor")
+    if ("updated" in position) != (updated_since is not None):
+        raise ValueError("Cursor does not match updatedSince")
+    return position
+
+
+def _encode_line(uid: str, data: dict, fields: List[str]) -> str:
+    row = {"uid": uid}
+    for field in fields:
+        if field in data:
+            row[field] = data[field]
+    if "gameData" in row:
+        row["gameData"] = decode_game_data(data)
+    return json.dumps(row, separators=(",", ":"), default=str) + "\n"
+
+
+def iter_user_pages(
+    db: google.cloud.firestore.Client,
+    fields: List[str],
+    updated_since: Optional[int] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    start_after: Optional[Dict[str, Any]] = None,
+) -> Iterator[list]:
+    """
+    Walks the users collection one page at a time using query cursors.
+
+    Each page is a separate query resuming after the last document of the
+    previous page, so only one page of snapshots is held in memory and no
+    single RPC stays open for the whole collection. start_after resumes
+    after a position from decode_cursor.
+    """
+    query = db.collection("users")
+    projection = list(fields)
+    # Stored gameData cannot be decoded without its codec version
+    if "gameData" in projection:
+        projection.append(CODEC_FIELD)
+    if updated_since is not None:
+        query = query.where(filter=FieldFilter("updated", ">=", updated_since))
+        query = query.order_by("updated")
+        # The cursor needs the ordering field even if it was not requested
+        if "updated" not in projection:
+            projection.append("updated")
+    query = query.order_by("__name__").select(projection).limit(page_size)
+
+    last_doc = start_after
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last_doc = page[-1]
+
+
+def stream_users_ndjson(
+    db: google.cloud.firestore.Client,
+    fields: Optional[List[str]] = None,
+    updated_since: Optional[int] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    use_gzip: bool = False,
+    cursor: Optional[str] = None,
+    deadline: Optional[float] = None,
+) -> Iterator[bytes]:
+    """
+    Streams user documents as newline-delimited JSON.
+
+    Args:
+        db: Firestore client
+        fields: Top-level fields to include (defaults to all of EXPORT_FIELDS)
+        updated_since: Only export users whose 'updated' timestamp is >= this value
+        page_size: Number of documents fetched per query page
+        use_gzip: Compress the stream as a single gzip member
+        cursor: Resume after the position of a previous export's cursor line
+        deadline: Monotonic time after which no further page is started
+
+    Yields:
+        Encoded chunks, one per page of users. When the deadline stops the
+        export early, the last line is {"cursor": ...} to resume from.
+    """
+    fields = list(fields) if fields else list(EXPORT_FIELDS)
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if use_gzip else None
+    start_after = decode_cursor(cursor, updated_since) if cursor else None
+
+    def encode(chunk: bytes) -> bytes:
+        return compressor.compress(chunk) if compressor is not None else chunk
+
+    pages = iter_user_pages(db, fields, updated_since, page_size, start_after)
+    position = None
+    while True:
+        if deadline is not None and position and time.monotonic() >= deadline:
+            line = json.dumps({"cursor": encode_cursor(position)}) + "\n"
+            yield encode(line.encode("utf-8"))
+            break
+        page = next(pages, None)
+        if page is None:
+            break
+        data = [doc.to_dict() or {} for doc in page]
+        position = {"__name__": page[-1].id}
+        if updated_since is not None:
+            position = {"updated": data[-1].get("updated"), **position}
+        chunk = encode(
+            "".join(
+                _encode_line(doc.id, doc_data, fields)
+                for doc, doc_data in zip(page, data)
+            ).encode("utf-8")
+        )
+        if chunk:
+            yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
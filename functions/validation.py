@@ -0,0 +1,202 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+def valid_questions(questions_answers):
+    logger.debug("Validating questions: %s", questions_answers)
+    if not isinstance(questions_answers, list):
+        logger.info("Invalid: questions_answers is not a list")
+        return False
+    for idx, item in enumerate(questions_answers):
+        if not isinstance(item, dict):
+            logger.info("Invalid: item at index %d is not a dictionary", idx)
+            return False
+        if "question" not in item or "answer" not in item:
+            logger.info("Invalid: item at index %d missing 'question' or 'answer' key", idx)
+            return False
+        if not isinstance(item["question"], str) or not isinstance(item["answer"], str):
+            logger.info(
+                "Invalid: 'question' or 'answer' in item at index %d is not a string",
+                idx,
+            )
+            return False
+        if len(item["question"].strip()) == 0 or len(item["answer"].strip()) == 0:
+            logger.info(
+                "Invalid: 'question' or 'answer' in item at index %d is empty or whitespace",
+                idx,
+            )
+            return False
+    return True
+
+
+def valid_achievements(achievements):
+    logger.debug("Validating achievements: %s", achievements)
+    if not isinstance(achievements, dict):
+        logger.info("Invalid: achievements is not a dictionary")
+        return False
+    if "planets" not in achievements:
+        logger.info("Invalid: 'planets' key missing in achievements")
+        return False
+    if not isinstance(achievements["planets"], list):
+        logger.info("Invalid: 'planets' is not a list")
+        return False
+    for planet in achievements["planets"]:
+        if not isinstance(planet, dict):
+            logger.info("Invalid: planet entry is not a dictionary")
+            return False
+        if (
+            "name" not in planet
+            or "image" not in planet
+            or "achievements" not in planet
+        ):
+            logger.info("Invalid: planet missing 'name', 'image', or 'achievements' key")
+            return False
+        if not isinstance(planet["name"], str) or not isinstance(planet["image"], str):
+            logger.info("Invalid: planet 'name' or 'image' is not a string")
+            return False
+        if not isinstance(planet["achievements"], list):
+            logger.info("Invalid: planet 'achievements' is not a list")
+            return False
+        for achievement in planet["achievements"]:
+            if not isinstance(achievement, dict):
+                logger.info("Invalid: achievement entry is not a dictionary")
+                return False
+            if (
+                "name" not in achievement
+                or "description" not in achievement
+                or "type" not in achievement
+            ):
+                logger.info(
+                    "Invalid: achievement missing 'name', 'description', or 'type' key"
+                )
+                return False
+            if not isinstance(achievement["name"], str) or not isinstance(
+                achievement["description"], str
+            ):
+                logger.info("Invalid: achievement 'name' or 'description' is not a string")
+                return False
+            if achievement["type"] not in ["progress", "game", "streak"]:
+                logger.info(
+                    "Invalid: achievement 'type' is not valid (%s)", achievement.get("type")
+                )
+                return False
+            if "data" not in achievement:
+                logger.info("Invalid: achievement missing 'data' key")
+                return False
+            if not isinstance(achievement["data"], dict):
+                logger.info("Invalid: achievement 'data' is not a dictionary")
+                return False
+            # Validate achievement["data"] based on achievement["type"]
+            if achievement["type"] == "progress":
+                if (
+                    "startDate" not in achievement["data"]
+                    or "endDate" not in achievement["data"]
+                ):
+                    logger.info(
+                        "Invalid: progress achievement missing 'startDate' or 'endDate'"
+                    )
+                    return False
+                if not isinstance(
+                    achievement["data"]["startDate"], str
+                ) or not isinstance(achievement["data"]["endDate"], str):
+                    logger.info(
+                        "Invalid: progress achievement 'startDate' or 'endDate' is not a string"
+                    )
+                    return False
+                date_regex = r"^\d{4}-\d{2}-\d{2}$"
+                if not re.match(
+                    date_regex, achievement["data"]["startDate"]
+                ) or not re.match(date_regex, achievement["data"]["endDate"]):
+                    logger.info(
+                        "Invalid: progress achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
+                    )
+                    return False
+                if "moneyToSave" not in achievement["data"] or not isinstance(
+                    achievement["data"]["moneyToSave"], int
+                ):
+                    logger.info(
+                        "Invalid: progress achievement missing 'moneyToSave' or it is not an int"
+                    )
+                    return False
+            elif achievement["type"] == "streak":
+                if (
+                    "startDate" not in achievement["data"]
+                    or "endDate" not in achievement["data"]
+                ):
+                    logger.info(
+                        "Invalid: streak achievement missing 'startDate' or 'endDate'"
+                    )
+                    return False
+                if not isinstance(
+                    achievement["data"]["startDate"], str
+                ) or not isinstance(achievement["data"]["endDate"], str):
+                    logger.info(
+                        "Invalid: streak achievement 'startDate' or 'endDate' is not a string"
+                    )
+                    return False
+                date_regex = r"^\d{4}-\d{2}-\d{2}$"
+                if not re.match(
+                    date_regex, achievement["data"]["startDate"]
+                ) or not re.match(date_regex, achievement["data"]["endDate"]):
+                    logger.info(
+                        "Invalid: streak achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
+                    )
+                    return False
+                if "numConsecutiveDays" not in achievement["data"] or not isinstance(
+                    achievement["data"]["numConsecutiveDays"], int
+                ):
+                    logger.info(
+                        "Invalid: streak achievement missing 'numConsecutiveDays' or it is not an int"
+                    )
+                    return False
+                if "minimumStreakAmount" not in achievement["data"] or not isinstance(
+                    achievement["data"]["minimumStreakAmount"], int
+                ):
+                    logger.info(
+                        "Invalid: streak achievement missing 'minimumStreakAmount' or it is not an int"
+                    )
+                    return False
+                if "frequency" not in achievement["data"] or achievement["data"][
+                    "frequency"
+                ] not in ["daily", "weekly", "monthly"]:
+                    logger.info(
+                        "Invalid: streak achievement missing 'frequency' or it is not valid"
+                    )
+                    return False
+            elif achievement["type"] == "game":
+                if (
+                    "startDate" not in achievement["data"]
+                    or "endDate" not in achievement["data"]
+                ):
+                    logger.info("Invalid: game achievement missing 'startDate' or 'endDate'")
+                    return False
+                if not isinstance(
+                    achievement["data"]["startDate"], str
+                ) or not isinstance(achievement["data"]["endDate"], str):
+                    logger.info(
+                        "Invalid: game achievement 'startDate' or 'endDate' is not a string"
+                    )
+                    return False
+                date_regex = r"^\d{4}-\d{2}-\d{2}$"
+                if not re.match(
+                    date_regex, achievement["data"]["startDate"]
+                ) or not re.match(date_regex, achievement["data"]["endDate"]):
+                    logger.info(
+                        "Invalid: game achievement 'startDate' or 'endDate' does not match YYYY-MM-DD"
+                    )
+                    return False
+                goal = achievement["data"].get("goal")
+                if goal is not None and (
+                    not isinstance(goal, dict)
+                    or not isinstance(goal.get("metric"), str)
+                    or not isinstance(goal.get("value"), (int, float))
+                    or isinstance(goal.get("value"), bool)
+                    or goal["value"] <= 0
+                ):
+                    logger.info(
+                        "Invalid: game achievement 'goal' needs a 'metric' string and a positive 'value'"
+                    )
+                    return False
+    return True
@@ -0,0 +1,73 @@
+"""
+Sets the "updated" field on user documents written before every write
+stamped it.
+
+export_users filters on "updated" when given updatedSince, and Firestore
+queries skip documents that lack the field, so those users would never
+appear in an incremental export. They are stamped with the current time, so
+the next incremental export includes each of them once.
+
+Usage:
+    python scripts/backfill_updated.py --dry-run
+    python scripts/backfill_updated.py --page-size 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from firebase_admin import initialize_app, firestore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    initialize_app()
+    db = firestore.client()
+    query = (
+        db.collection("users")
+        .order_by("__name__")
+        .select(["updated"])
+        .limit(args.page_size)
+    )
+    writer = None if args.dry_run else db.bulk_writer()
+    now = int(time.time())
+    scanned = missing = 0
+    started = time.perf_counter()
+
+    while True:
+        page = list(query.stream())
+        for doc in page:
+            scanned += 1
+            if "updated" in (doc.to_dict() or {}):
+                continue
+            missing += 1
+            if writer is not None:
+                writer.update(doc.reference, {"updated": now})
+        if len(page) < args.page_size:
+            break
+        query = query.start_after(page[-1])
+
+    if writer is not None:
+        writer.close()
+    print(
+        json.dumps(
+            {
+                "scanned": scanned,
+                "missing": missing,
+                "dry_run": args.dry_run,
+                "elapsed_s": round(time.perf_counter() - started, 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Seeds the Firestore emulator with synthetic users and measures the NDJSON
+export: documents per second, bytes written and peak RSS of this process.
+
+Usage (with the emulators running):
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:7099 python scripts/benchmark_export.py --seed 1000000
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:7099 python scripts/benchmark_export.py --gzip
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from firebase_admin import initialize_app, firestore  # noqa: E402
+from user_export import stream_users_ndjson  # noqa: E402
+
+DEFAULT_RESPONSE_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "functions", "default_response.json"
+)
+
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def seed_users(db, count):
+    with open(DEFAULT_RESPONSE_PATH, "r") as f:
+        achievements = json.load(f)
+    now = int(time.time())
+    writer = db.bulk_writer()
+    users = db.collection("users")
+    for i in range(count):
+        writer.set(
+            users.document(f"bench-{i:08d}"),
+            {
+                "firstName": "Bench",
+                "lastName": "User",
+                "email": f"bench{i}@example.com",
+                "joined": now,
+                "updated": now - (i % 86400),
+                "money": i % 5000,
+                "achievements": achievements,
+            },
+        )
+        if (i + 1) % 50000 == 0:
+            writer.flush()
+            print(f"seeded {i + 1}/{count}")
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seed", type=int, default=0, help="users to create first")
+    parser.add_argument("--fields", nargs="*", default=None)
+    parser.add_argument("--updated-since", type=int, default=None)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--output", default=os.devnull)
+    args = parser.parse_args()
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST must point at the Firestore emulator")
+
+    initialize_app()
+    db = firestore.client()
+
+    if args.seed:
+        seed_started = time.perf_counter()
+        seed_users(db, args.seed)
+        print(f"seeded {args.seed} users in {time.perf_counter() - seed_started:.1f}s")
+
+    rss_before = peak_rss_mb()
+    docs = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    with open(args.output, "wb") as out:
+        for chunk in stream_users_ndjson(
+            db, args.fields, args.updated_since, args.page_size, args.gzip
+        ):
+            out.write(chunk)
+            total_bytes += len(chunk)
+            if not args.gzip:
+                docs += chunk.count(b"\n")
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "elapsed_s": round(elapsed, 2),
+        "bytes": total_bytes,
+        "mb_per_s": round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        "peak_rss_mb_before": round(rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "gzip": args.gzip,
+        "page_size": args.page_size,
+    }
+    if not args.gzip:
+        report["docs"] = docs
+        report["docs_per_s"] = round(docs / elapsed, 1) if elapsed else None
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
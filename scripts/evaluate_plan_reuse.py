@@ -0,0 +1,132 @@
+"""
+Measures how well nearest-neighbor plan reuse stands in for the LLM.
+
+Every LLM-generated plan in the `plans` collection (live or batch) is
+treated as ground truth in turn: its nearest *other* stored plan is adapted
+to its answers exactly as generate_ai_achievements would, and the result is
+compared with what the LLM actually produced. Also prints the live hit/miss counters.
+
+Usage:
+    python scripts/evaluate_plan_reuse.py --max-distance 1.5
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from firebase_admin import initialize_app, firestore  # noqa: E402
+from google.cloud.firestore_v1.base_query import FieldFilter  # noqa: E402
+from plan_store import (  # noqa: E402
+    DEFAULT_MAX_DISTANCE,
+    PLANS_COLLECTION,
+    STATS_DOC,
+    adapt_plan,
+    read_counters,
+)
+
+
+def _plan_end(plan):
+    return max(
+        datetime.date.fromisoformat(a["data"]["endDate"])
+        for planet in plan["planets"]
+        for a in planet["achievements"]
+    )
+
+
+def _planet_targets(plan):
+    return [
+        max(
+            [a["data"].get("moneyToSave", 0) for a in planet["achievements"]] or [0]
+        )
+        for planet in plan["planets"]
+    ]
+
+
+def compare(adapted, actual, base_date):
+    """Quality deltas of an adapted plan against the LLM's plan"""
+    target_errors = [
+        abs(a - b) / b
+        for a, b in zip(_planet_targets(adapted), _planet_targets(actual))
+        if b
+    ]
+    type_matches = [
+        sorted(x["type"] for x in p["achievements"])
+        == sorted(x["type"] for x in q["achievements"])
+        for p, q in zip(adapted["planets"], actual["planets"])
+    ]
+    return {
+        "planet_count_delta": len(adapted["planets"]) - len(actual["planets"]),
+        "target_rel_error": statistics.mean(target_errors) if target_errors else 0.0,
+        "horizon_delta_days": (_plan_end(adapted) - base_date).days
+        - (_plan_end(actual) - base_date).days,
+        "type_mix_match": sum(type_matches) / len(type_matches) if type_matches else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-distance", type=float, default=DEFAULT_MAX_DISTANCE)
+    parser.add_argument("--limit", type=int, default=2000)
+    args = parser.parse_args()
+
+    initialize_app()
+    db = firestore.client()
+
+    plans = [
+        doc.to_dict()
+        for doc in db.collection(PLANS_COLLECTION)
+        .where(filter=FieldFilter("source", "in", ["llm", "batch"]))
+        .limit(args.limit)
+        .stream()
+    ]
+    vectors = [list(plan["embedding"]) for plan in plans]
+
+    hits = []
+    for i, truth in enumerate(plans):
+        best, best_distance = None, math.inf
+        for j, candidate in enumerate(plans):
+            if i == j:
+                continue
+            distance = math.dist(vectors[i], vectors[j])
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        if best is None or best_distance > args.max_distance:
+            continue
+        base_date = datetime.date.fromisoformat(truth["baseDate"])
+        adapted = adapt_plan(
+            best["plan"],
+            best.get("amounts", {}),
+            truth.get("amounts", {}),
+            datetime.date.fromisoformat(best["baseDate"]),
+            base_date,
+        )
+        hits.append({"distance": best_distance, **compare(adapted, truth["plan"], base_date)})
+
+    report = {
+        "plans": len(plans),
+        "max_distance": args.max_distance,
+        "leave_one_out_hit_rate": round(len(hits) / len(plans), 3) if plans else None,
+    }
+    for key in ("distance", "target_rel_error", "horizon_delta_days", "type_mix_match"):
+        values = [hit[key] for hit in hits]
+        if values:
+            report[f"mean_{key}"] = round(statistics.mean(values), 3)
+            report[f"max_{key}"] = round(max(values, key=abs), 3)
+
+    counters = read_counters(db, STATS_DOC)
+    lookups = sum(counters.get(k, 0) for k in ("exactHits", "nearestHits", "misses"))
+    report["live_counters"] = counters
+    if lookups:
+        report["live_hit_rate"] = round(
+            (counters.get("exactHits", 0) + counters.get("nearestHits", 0)) / lookups, 3
+        )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Local stand-in for the Gemini API used by load tests and CI.
+
+Point the functions at it with LLM_PROVIDER=http and
+LLM_STUB_URL=http://127.0.0.1:8089 (e.g. in functions/.env.local). Each
+request is answered by functions/llm.py's StubProvider, so latency and
+failures follow the configured distribution and seed.
+
+Usage:
+    python scripts/llm_stub_server.py --latency lognormal:9000:0.35 --failure-rate 0.02 --seed 7
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from llm import StubProvider  # noqa: E402
+
+
+def make_handler(stub):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/generate":
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            operation = request.get("operation", "")
+            delay, text = stub.respond(operation, request.get("metadata"))
+            # Block only this request's thread so concurrent calls overlap
+            time.sleep(delay)
+            if text is None:
+                self.send_error(503, "Injected stub failure")
+                return
+            body = json.dumps(
+                {
+                    "text": text,
+                    "model": "stub",
+                    "prompt_tokens": (
+                        len(request.get("systemInstruction", ""))
+                        + len(request.get("prompt", ""))
+                    )
+                    // 4,
+                    "completion_tokens": len(text) // 4,
+                    "latency_ms": round(delay * 1000),
+                }
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if self.server.verbose:
+                super().log_message(format, *args)
+
+    return StubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="fixed:0", help="see llm.parse_latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    stub = StubProvider(args.latency, args.failure_rate, args.invalid_rate, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(stub))
+    server.daemon_threads = True
+    server.verbose = args.verbose
+    print(f"LLM stub listening on http://{args.host}:{args.port}/generate")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
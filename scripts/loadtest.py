@@ -0,0 +1,328 @@
+"""
+Load test for the HTTP functions running in the Firebase emulators.
+
+Seeds users through create_user and signs each one in against the Auth
+emulator for an ID token, then drives a weighted mix of endpoints
+from concurrent workers and reports p50/p95/p99 latency, throughput and
+errors per endpoint. Results can be saved as a baseline and later runs
+compared against it; a regression makes the script exit non-zero.
+
+Start the emulators with a stubbed LLM so generate_ai_achievements is
+deterministic and offline, e.g. in functions/.env.local:
+    LLM_PROVIDER=stub
+    LLM_STUB_LATENCY=lognormal:8000:0.3
+    LLM_STUB_SEED=1
+    RATE_LIMIT=false
+
+Usage:
+    python scripts/loadtest.py --users 200 --duration 60 --concurrency 32 --save-baseline loadtest-baseline.json
+    python scripts/loadtest.py --users 200 --duration 60 --concurrency 32 --baseline loadtest-baseline.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+DEFAULT_MIX = {
+    "add_money": 35,
+    "fetch_user_data": 25,
+    "fetch_achievements": 15,
+    "fetch_game_data": 10,
+    "store_game_data": 13,
+    "generate_ai_achievements": 2,
+}
+
+
+def default_base_url():
+    with open(os.path.join(ROOT, ".firebaserc"), "r") as f:
+        project = json.load(f)["projects"]["default"]
+    return f"http://127.0.0.1:5001/{project}/us-central1"
+
+
+def default_auth_url():
+    with open(os.path.join(ROOT, "firebase.json"), "r") as f:
+        port = json.load(f)["emulators"]["auth"]["port"]
+    return f"http://127.0.0.1:{port}/identitytoolkit.googleapis.com/v1"
+
+
+def load_questions():
+    with open(os.path.join(ROOT, "functions", "questions.json"), "r") as f:
+        return json.load(f)["questions"]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Client:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def call(self, endpoint, body, headers=None):
+        """POST body to endpoint; returns (status, parsed body, latency ms)"""
+        request = urllib.request.Request(
+            f"{self.base_url}/{endpoint}",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", **(headers or {})},
+        )
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, raw = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, raw = e.code, e.read()
+        except Exception:
+            status, raw = 0, b""
+        latency = (time.perf_counter() - started) * 1000
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = None
+        return status, payload, latency
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+
+    def add(self, endpoint, status, latency):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            statuses = self.statuses[endpoint]
+            errors = sum(n for s, n in statuses.items() if not s.startswith("2"))
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "p50_ms": round(percentile(values, 0.50), 1),
+                "p95_ms": round(percentile(values, 0.95), 1),
+                "p99_ms": round(percentile(values, 0.99), 1),
+                "mean_ms": round(statistics.mean(values), 1),
+                "error_rate": round(errors / len(values), 4),
+                "statuses": statuses,
+            }
+        return endpoints
+
+
+class Workload:
+    """Builds request bodies for each endpoint for a random seeded user"""
+
+    def __init__(self, users, questions, seed):
+        self.users = users
+        self.questions = questions
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def next_request(self, mix):
+        with self.lock:
+            endpoint = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+            user = self.rng.choice(self.users)
+            if endpoint == "add_money":
+                body = {"amount": self.rng.randint(1, 200)}
+            elif endpoint == "store_game_data":
+                body = {
+                    "gameData": {
+                        "level": self.rng.randint(1, 50),
+                        "score": self.rng.randint(0, 100000),
+                        "inventory": [self.rng.randint(0, 99) for _ in range(20)],
+                    },
+                }
+            elif endpoint == "generate_ai_achievements":
+                body = {
+                    "questions": [
+                        {
+                            "question": q["question_text"],
+                            "answer": self.rng.choice(q["options"][:-1]),
+                        }
+                        for q in self.questions
+                    ],
+                }
+            else:
+                body = {}
+        return endpoint, user, body
+
+
+def sign_in(auth_url, email, password):
+    """ID token for a user from the Auth emulator, which accepts any API key"""
+    auth_client = Client(auth_url, timeout=30)
+    status, payload, _ = auth_client.call(
+        "accounts:signInWithPassword?key=emulator",
+        {"email": email, "password": password, "returnSecureToken": True},
+    )
+    if status != 200:
+        raise RuntimeError(f"sign-in failed with {status}: {payload}")
+    return payload["idToken"]
+
+
+def seed_users(client, auth_url, count, concurrency, run_id):
+    def create(i):
+        email = f"load-{run_id}-{i}@example.com"
+        password = "loadtest-password"
+        status, payload, _ = client.call(
+            "create_user",
+            {
+                "email": email,
+                "password": password,
+                "firstName": "Load",
+                "lastName": "Tester",
+            },
+        )
+        if status != 201:
+            raise RuntimeError(f"create_user failed with {status}: {payload}")
+        return {
+            "uid": payload["uid"],
+            "email": email,
+            "token": sign_in(auth_url, email, password),
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(create, range(count)))
+
+
+def run_load(client, workload, mix, duration, concurrency, max_requests):
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+    issued = [0]
+    issued_lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with issued_lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+            endpoint, user, body = workload.next_request(mix)
+            status, _, latency = client.call(endpoint, body, workload_headers(user))
+            recorder.add(endpoint, status, latency)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+def workload_headers(user):
+    return {"Authorization": f"Bearer {user['token']}"}
+
+
+def compare(results, baseline, tolerance):
+    """Endpoints whose p95 latency or throughput regressed beyond tolerance"""
+    regressions = []
+    for endpoint, current in results.items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{endpoint}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms"
+            )
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{endpoint}: throughput {before['throughput_rps']} -> {current['throughput_rps']} rps"
+            )
+        if current["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(
+                f"{endpoint}: error rate {before['error_rate']} -> {current['error_rate']}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default=None)
+    parser.add_argument("--auth-url", default=None)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--max-requests", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--save-baseline", default=None)
+    parser.add_argument("--output", default=None, help="write the full report here")
+    parser.add_argument("--cleanup", action="store_true", help="delete seeded users")
+    args = parser.parse_args()
+
+    client = Client(args.base_url or default_base_url(), args.timeout)
+    run_id = uuid.uuid4().hex[:8]
+
+    seed_started = time.perf_counter()
+    users = seed_users(
+        client, args.auth_url or default_auth_url(), args.users, args.concurrency, run_id
+    )
+    seed_elapsed = time.perf_counter() - seed_started
+
+    workload = Workload(users, load_questions(), args.seed)
+    results = run_load(
+        client, workload, args.mix, args.duration, args.concurrency, args.max_requests
+    )
+    report = {
+        "run_id": run_id,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "mix": args.mix,
+        "seed_users_rps": round(args.users / seed_elapsed, 2) if seed_elapsed else None,
+        "endpoints": results,
+    }
+
+    if args.cleanup:
+        for user in users:
+            client.call("delete_user", {}, workload_headers(user))
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Upgrades every stored achievements tree to the current schema version.
+
+The users collection is split into document-id ranges that are processed by
+a pool of worker processes. Each shard walks its range page by page, applies
+the transforms from functions/migrations.py, re-validates the result and
+writes it back through a rate-limited BulkWriter. After every page the shard
+records its position in a checkpoint file, so rerunning the same command
+after an interruption skips finished shards and resumes the others. Documents
+whose write failed are kept in the checkpoint and retried by the next run; a
+shard is only finished once none are left.
+
+With --backfill-index, the achievementIndex entries of every stored plan are
+(re)written too, so plans generated before the index existed are seen by the
+rollover and the active/due lookups.
+
+Usage:
+    python scripts/migrate_achievements.py --dry-run
+    python scripts/migrate_achievements.py --workers 8 --max-ops-per-second 1000
+    python scripts/migrate_achievements.py --backfill-index
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from achievement_index import INDEX_COLLECTION, index_entries  # noqa: E402
+from firebase_admin import initialize_app, firestore  # noqa: E402
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions  # noqa: E402
+from migrations import (  # noqa: E402
+    ACHIEVEMENTS_SCHEMA_VERSION,
+    VERSION_FIELD,
+    upgrade_achievements,
+)
+from user_cache import write_stamp  # noqa: E402
+from validation import valid_achievements  # noqa: E402
+
+# Firebase Auth uids are drawn from this alphabet (already in byte order)
+UID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+MAX_INVALID_SAMPLES = 20
+
+_db = None
+
+
+def shard_bounds(shard_count):
+    """Split the document-id space into contiguous [lo, hi) ranges"""
+    space = len(UID_ALPHABET) ** 2
+    cuts = []
+    for i in range(1, shard_count):
+        position = i * space // shard_count
+        cuts.append(
+            UID_ALPHABET[position // len(UID_ALPHABET)]
+            + UID_ALPHABET[position % len(UID_ALPHABET)]
+        )
+    lows = [None] + cuts
+    highs = cuts + [None]
+    return list(zip(lows, highs))
+
+
+def _init_worker():
+    global _db
+    initialize_app()
+    _db = firestore.client()
+
+
+def _empty_stats():
+    return {
+        "scanned": 0,
+        "no_achievements": 0,
+        "up_to_date": 0,
+        "upgraded": 0,
+        "invalid": 0,
+        "write_failures": 0,
+        "index_entries": 0,
+        "retried": 0,
+        "unwritten": 0,
+        "applied": {},
+        "invalid_uids": [],
+    }
+
+
+def _load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def run_shard(task):
+    index, lo, hi, options = task
+    checkpoint_path = os.path.join(options["checkpoint_dir"], f"shard-{index:04d}.json")
+    checkpoint = _load_checkpoint(checkpoint_path) or {
+        "last": None,
+        "scanned_all": False,
+        "failed": [],
+        "done": False,
+        "stats": _empty_stats(),
+    }
+    if checkpoint["done"]:
+        return checkpoint["stats"]
+    stats = checkpoint["stats"]
+    retry_uids = checkpoint["failed"]
+    checkpoint["failed"] = []
+    # Write callbacks run on the BulkWriter's threads. pending maps each
+    # written document's path to (uid, applied versions or None for index
+    # entries).
+    lock = threading.Lock()
+    pending = {}
+    index_collection = _db.collection(INDEX_COLLECTION)
+
+    query = _db.collection("users").order_by("__name__")
+    if hi is not None:
+        query = query.end_before({"__name__": hi})
+    if checkpoint["last"] is not None:
+        query = query.start_after({"__name__": checkpoint["last"]})
+    elif lo is not None:
+        query = query.start_at({"__name__": lo})
+    query = query.limit(options["page_size"])
+
+    writer = None
+    if not options["dry_run"]:
+        writer = _db.bulk_writer(
+            options=BulkWriterOptions(
+                initial_ops_per_second=options["initial_ops_per_second"],
+                max_ops_per_second=options["max_ops_per_second"],
+            )
+        )
+
+        def on_result(reference, result, _writer):
+            with lock:
+                _, applied = pending.pop(reference.path)
+                if applied is None:
+                    stats["index_entries"] += 1
+                else:
+                    count_upgrade(applied)
+
+        def on_error(failure, _writer):
+            # Precondition failures mean the user wrote in the meantime; the
+            # next run reads the document again, so don't retry here
+            retry = failure.attempts < 3 and failure.code != 9
+            with lock:
+                stats["write_failures"] += 1
+                if not retry:
+                    uid, _ = pending.pop(failure.operation.reference.path)
+                    if uid not in checkpoint["failed"]:
+                        checkpoint["failed"].append(uid)
+            return retry
+
+        writer.on_write_result(on_result)
+        writer.on_write_error(on_error)
+
+    def count_upgrade(applied):
+        stats["upgraded"] += 1
+        for applied_version in applied:
+            key = str(applied_version)
+            stats["applied"][key] = stats["applied"].get(key, 0) + 1
+
+    def backfill_index(uid, achievements):
+        entries = index_entries(uid, achievements)
+        if writer is None:
+            stats["index_entries"] += len(entries)
+            return
+        for doc_id, entry in entries.items():
+            ref = index_collection.document(doc_id)
+            with lock:
+                pending[ref.path] = (uid, None)
+            writer.set(ref, entry)
+
+    def migrate(doc):
+        data = doc.to_dict() or {}
+        achievements = data.get("achievements")
+        if not achievements:
+            stats["no_achievements"] += 1
+            return
+        version = data.get(VERSION_FIELD, 0)
+        if version >= ACHIEVEMENTS_SCHEMA_VERSION:
+            stats["up_to_date"] += 1
+            if options["backfill_index"]:
+                backfill_index(doc.id, achievements)
+            return
+
+        upgraded, applied = upgrade_achievements(achievements, version)
+        if not valid_achievements(upgraded):
+            stats["invalid"] += 1
+            if len(stats["invalid_uids"]) < MAX_INVALID_SAMPLES:
+                stats["invalid_uids"].append(doc.id)
+            return
+
+        if options["backfill_index"]:
+            backfill_index(doc.id, upgraded)
+        if writer is None:
+            count_upgrade(applied)
+            return
+        with lock:
+            pending[doc.reference.path] = (doc.id, applied)
+        writer.update(
+            doc.reference,
+            {
+                "achievements": upgraded,
+                VERSION_FIELD: ACHIEVEMENTS_SCHEMA_VERSION,
+                **write_stamp(),
+            },
+            option=_db.write_option(last_update_time=doc.update_time),
+        )
+
+    def flush():
+        if writer is not None:
+            writer.flush()
+        stats["unwritten"] = len(checkpoint["failed"])
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    if retry_uids:
+        refs = [_db.collection("users").document(uid) for uid in retry_uids]
+        for doc in _db.get_all(refs):
+            stats["retried"] += 1
+            if doc.exists:
+                migrate(doc)
+        flush()
+
+    while not checkpoint["scanned_all"]:
+        page = list(query.stream())
+        for doc in page:
+            stats["scanned"] += 1
+            migrate(doc)
+
+        if len(page) < options["page_size"]:
+            checkpoint["scanned_all"] = True
+        if page:
+            checkpoint["last"] = page[-1].id
+            query = query.start_after({"__name__": checkpoint["last"]})
+        flush()
+
+    if writer is not None:
+        writer.close()
+    checkpoint["done"] = not checkpoint["failed"]
+    _save_checkpoint(checkpoint_path, checkpoint)
+    return stats
+
+
+def merge_stats(results):
+    total = _empty_stats()
+    for stats in results:
+        for key, value in stats.items():
+            if key == "applied":
+                for version, count in value.items():
+                    total["applied"][version] = total["applied"].get(version, 0) + count
+            elif key == "invalid_uids":
+                room = MAX_INVALID_SAMPLES - len(total["invalid_uids"])
+                total["invalid_uids"].extend(value[:room])
+            else:
+                total[key] += value
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, default=None, help="default 4 per worker")
+    parser.add_argument("--page-size", type=int, default=300)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--backfill-index",
+        action="store_true",
+        help="also write the achievementIndex entries of every stored plan",
+    )
+    parser.add_argument("--initial-ops-per-second", type=int, default=500)
+    parser.add_argument(
+        "--max-ops-per-second",
+        type=int,
+        default=2000,
+        help="write budget shared by all workers",
+    )
+    parser.add_argument("--checkpoint-dir", default=".migration-checkpoints")
+    args = parser.parse_args()
+
+    shard_count = args.shards or args.workers * 4
+    run_name = f"v{ACHIEVEMENTS_SCHEMA_VERSION}-{'dry-run' if args.dry_run else 'apply'}"
+    if args.backfill_index:
+        run_name += "-index"
+    checkpoint_dir = os.path.join(args.checkpoint_dir, run_name)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    per_worker_max = max(1, args.max_ops_per_second // args.workers)
+    options = {
+        "checkpoint_dir": checkpoint_dir,
+        "page_size": args.page_size,
+        "dry_run": args.dry_run,
+        "backfill_index": args.backfill_index,
+        "initial_ops_per_second": min(args.initial_ops_per_second, per_worker_max),
+        "max_ops_per_second": per_worker_max,
+    }
+    tasks = [
+        (index, lo, hi, options)
+        for index, (lo, hi) in enumerate(shard_bounds(shard_count))
+    ]
+
+    started = time.perf_counter()
+    with Pool(processes=args.workers, initializer=_init_worker) as pool:
+        results = pool.map(run_shard, tasks, chunksize=1)
+    total = merge_stats(results)
+    total["target_version"] = ACHIEVEMENTS_SCHEMA_VERSION
+    total["dry_run"] = args.dry_run
+    total["elapsed_s"] = round(time.perf_counter() - started, 2)
+    print(json.dumps(total, indent=2))
+
+
+if __name__ == "__main__":
+    main()
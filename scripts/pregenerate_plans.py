@@ -0,0 +1,212 @@
+"""
+Pre-generates plans for the most common answer combinations.
+
+Per-question option frequencies come from the stats/answerTraffic shards
+(written by generate_ai_achievements). Treating questions as independent, the most
+likely complete questionnaires are enumerated best-first, and every
+combination that has no stored plan yet is generated with bounded
+concurrency and retries, validated, and saved to the plan store. Live
+requests with the same answers are then served as exact plan-store hits.
+
+Calls are dated in PLAN_TIMEZONE like the handlers' and count towards the
+global daily LLM budget; once it is spent the remaining combinations are
+skipped, so the batch never takes the budget live requests depend on.
+
+Usage:
+    python scripts/pregenerate_plans.py --top 500 --concurrency 4
+    python scripts/pregenerate_plans.py --top 500 --dry-run
+"""
+import argparse
+import datetime
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from firebase_admin import initialize_app, firestore  # noqa: E402
+from gemini import generate_gamified_structure  # noqa: E402
+from llm_usage import check_budget, record_llm_call  # noqa: E402
+from migrations import upgrade_achievements  # noqa: E402
+from plan_store import (  # noqa: E402
+    PLANS_COLLECTION,
+    QUESTIONS,
+    TRAFFIC_DOC,
+    encode_answers,
+    plan_key,
+    read_counters,
+    save_plan,
+)
+from validation import valid_achievements  # noqa: E402
+
+
+def option_weights(traffic, smoothing):
+    """
+    Per question, (option index, probability) pairs sorted most likely first.
+    "Other" is free text and cannot be pre-generated, so it is left out.
+    """
+    weights = []
+    for question in QUESTIONS:
+        counts = traffic.get(f"q{question['id']}", {})
+        choices = range(len(question["options"]) - 1)
+        totals = {i: counts.get(str(i), 0) + smoothing for i in choices}
+        norm = sum(totals.values())
+        weights.append(
+            sorted(((i, totals[i] / norm) for i in choices), key=lambda x: -x[1])
+        )
+    return weights
+
+
+def top_combinations(weights, count):
+    """Best-first enumeration of the count most probable answer tuples"""
+    log_weights = [[math.log(p) for _, p in options] for options in weights]
+    start = tuple(0 for _ in weights)
+    heap = [(-sum(lw[0] for lw in log_weights), start)]
+    seen = {start}
+    results = []
+    while heap and len(results) < count:
+        neg_score, ranks = heapq.heappop(heap)
+        results.append(
+            (math.exp(-neg_score), [weights[q][r][0] for q, r in enumerate(ranks)])
+        )
+        for q, rank in enumerate(ranks):
+            if rank + 1 < len(weights[q]):
+                nxt = ranks[:q] + (rank + 1,) + ranks[q + 1 :]
+                if nxt not in seen:
+                    seen.add(nxt)
+                    score = neg_score + log_weights[q][rank] - log_weights[q][rank + 1]
+                    heapq.heappush(heap, (score, nxt))
+    return results
+
+
+def questionnaire_for(option_indices):
+    return [
+        {"question": question["question_text"], "answer": question["options"][i]}
+        for question, i in zip(QUESTIONS, option_indices)
+    ]
+
+
+class BudgetSpent(Exception):
+    pass
+
+
+def generate_validated(db, questionnaire, attempts, timezone):
+    for attempt in range(1, attempts + 1):
+        date = datetime.datetime.now(ZoneInfo(timezone)).date().isoformat()
+        if check_budget(db, date, None):
+            raise BudgetSpent(f"global LLM budget for {date} is spent")
+        usage = {}
+        outcome = "invalid"
+        started = time.perf_counter()
+        try:
+            result = generate_gamified_structure(questionnaire, usage)
+            plan, _ = upgrade_achievements(result)
+            if usage.get("parsed") is not False and valid_achievements(plan):
+                outcome = "success"
+                return plan
+            error = "invalid structure"
+        except Exception as e:
+            outcome = "invalid" if usage else "fallback"
+            error = str(e)
+        finally:
+            # Batch calls count towards the global daily totals, under no uid
+            record_llm_call(
+                db,
+                date,
+                None,
+                "generate_gamified_structure",
+                outcome,
+                (time.perf_counter() - started) * 1000,
+                usage,
+            )
+        if attempt < attempts:
+            # Exponential backoff with jitter keeps retries off the rate limit
+            time.sleep(min(60, 2**attempt) * (0.5 + random.random()))
+    raise RuntimeError(f"giving up after {attempts} attempts: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--top", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--attempts", type=int, default=3)
+    parser.add_argument("--smoothing", type=float, default=1.0)
+    parser.add_argument(
+        "--timezone", default=os.getenv("PLAN_TIMEZONE", "America/Chicago")
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    initialize_app()
+    db = firestore.client()
+
+    traffic = read_counters(db, TRAFFIC_DOC)
+    combinations = top_combinations(option_weights(traffic, args.smoothing), args.top)
+
+    plans = db.collection(PLANS_COLLECTION)
+    pending = []
+    for probability, option_indices in combinations:
+        questionnaire = questionnaire_for(option_indices)
+        pending.append(
+            (probability, questionnaire, plans.document(plan_key(encode_answers(questionnaire))))
+        )
+    existing = {
+        snapshot.id
+        for snapshot in db.get_all([ref for _, _, ref in pending])
+        if snapshot.exists
+    }
+    todo = [item for item in pending if item[2].id not in existing]
+
+    report = {
+        "combinations": len(combinations),
+        "already_stored": len(existing),
+        "to_generate": len(todo),
+        "traffic_covered": round(sum(p for p, _, _ in pending), 4),
+    }
+    if args.dry_run:
+        print(json.dumps(report, indent=2))
+        return
+
+    generated = 0
+    failed = 0
+    skipped = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = {
+            pool.submit(
+                generate_validated, db, questionnaire, args.attempts, args.timezone
+            ): questionnaire
+            for _, questionnaire, _ in todo
+        }
+        for future in as_completed(futures):
+            questionnaire = futures[future]
+            try:
+                save_plan(db, questionnaire, future.result(), source="batch")
+                generated += 1
+            except BudgetSpent:
+                skipped += 1
+            except Exception as e:
+                failed += 1
+                print(f"Error pre-generating plan: {str(e)}")
+            if (generated + failed + skipped) % 25 == 0:
+                print(f"{generated + failed + skipped}/{len(todo)} done")
+
+    report.update(
+        {
+            "generated": generated,
+            "failed": failed,
+            "skipped_budget": skipped,
+            "elapsed_s": round(time.perf_counter() - started, 1),
+        }
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
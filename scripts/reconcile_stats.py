@@ -0,0 +1,39 @@
+"""
+Brings the savings stats' all-time total in line with the sum of all user
+balances, then rewrites stats/summary. Run it once after deploying the
+stats counters, and whenever the total is suspected to have drifted.
+
+Usage:
+    python scripts/reconcile_stats.py
+    FIRESTORE_EMULATOR_HOST=127.0.0.1:7099 python scripts/reconcile_stats.py
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "functions"))
+
+from firebase_admin import initialize_app, firestore  # noqa: E402
+from savings_stats import materialize_summary, reconcile_total_money  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--timezone", default=os.getenv("PLAN_TIMEZONE", "America/Chicago")
+    )
+    args = parser.parse_args()
+
+    initialize_app()
+    db = firestore.client()
+    correction = reconcile_total_money(db)
+    today = datetime.datetime.now(ZoneInfo(args.timezone)).date().isoformat()
+    summary = materialize_summary(db, today)
+    print(json.dumps({"correction": correction, "summary": summary}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
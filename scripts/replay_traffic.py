@@ -0,0 +1,244 @@
+"""
+Replays captured production traffic against the emulators and compares runs.
+
+Capture is opt-in: set CAPTURE_SAMPLE_RATE (and CAPTURE_PATH for a JSONL
+file, otherwise records go to the "capture" logger). Each distinct captured
+client is replayed as a freshly seeded emulator user, redacted fields get
+generated values (questionnaire answers are options picked per client, and
+gameData is a stand-in of the captured size), and requests are re-issued at their original relative
+times divided by --speed (0 replays as fast as --concurrency allows).
+
+Start the emulators as for scripts/loadtest.py (stubbed LLM, RATE_LIMIT=false).
+
+Usage:
+    python scripts/replay_traffic.py replay capture.jsonl --speed 2 --output before.json
+    python scripts/replay_traffic.py replay capture.jsonl --speed 2 --output after.json
+    python scripts/replay_traffic.py compare before.json after.json --tolerance 0.15
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from loadtest import (
+    Client,
+    Recorder,
+    compare,
+    default_auth_url,
+    default_base_url,
+    load_questions,
+    percentile,
+    seed_users,
+    workload_headers,
+)
+
+REPLAY_PASSWORD = "replay-password"
+OPTIONS_BY_QUESTION = {q["question_text"]: q["options"] for q in load_questions()}
+
+
+def load_capture(path, limit=0):
+    """Captured records sorted by time; accepts raw records or exported log lines"""
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "endpoint" not in record and "message" in record:
+                record = json.loads(record["message"])
+            records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+def _stable_index(*parts):
+    return int(hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _answer(client, question):
+    """A non-"Other" option, the same for a client on every run"""
+    options = OPTIONS_BY_QUESTION.get(question)
+    if not options:
+        return "Not sure yet"
+    return options[_stable_index(client or "", question) % (len(options) - 1)]
+
+
+def _game_data(size):
+    """A gameData dict whose JSON is about size bytes"""
+    rng = random.Random(size)
+    return {"inventory": [rng.randint(10, 99) for _ in range(max(1, size // 3))]}
+
+
+def fill_placeholders(value, run_id, counter, client=None):
+    """Replaces the capture's "<field>" placeholders with values valid for a replay"""
+    if isinstance(value, dict):
+        filled = {
+            k: fill_placeholders(v, run_id, counter, client) for k, v in value.items()
+        }
+        if filled.get("answer") == "<answer>":
+            filled["answer"] = _answer(client, value.get("question", ""))
+        return filled
+    if isinstance(value, list):
+        return [fill_placeholders(v, run_id, counter, client) for v in value]
+    if isinstance(value, str):
+        sized = re.fullmatch(r"<gameData:(\d+)>", value)
+        if sized:
+            return _game_data(int(sized.group(1)))
+    if value == "<email>":
+        counter[0] += 1
+        return f"replay-{run_id}-{counter[0]}@example.com"
+    if value == "<password>":
+        return REPLAY_PASSWORD
+    if value in ("<firstName>", "<lastName>"):
+        return "Replay"
+    return value
+
+
+def captured_latencies(records):
+    """Per-endpoint latency percentiles as measured in production"""
+    by_endpoint = {}
+    for record in records:
+        by_endpoint.setdefault(record["endpoint"], []).append(record["durationMs"])
+    return {
+        endpoint: {
+            "requests": len(values),
+            "p50_ms": percentile(sorted(values), 0.50),
+            "p95_ms": percentile(sorted(values), 0.95),
+            "p99_ms": percentile(sorted(values), 0.99),
+        }
+        for endpoint, values in sorted(by_endpoint.items())
+    }
+
+
+def replay(client, records, users, speed, concurrency, admin_key, run_id):
+    """Issues every record at its scheduled time; returns (report, max lag ms)"""
+    recorder = Recorder()
+    counter = [0]
+    counter_lock = threading.Lock()
+    max_lag = [0.0]
+
+    def issue(record, scheduled):
+        lag = (time.perf_counter() - scheduled) * 1000
+        headers = dict(record.get("headers", {}))
+        if record.get("client"):
+            headers.update(workload_headers(users[record["client"]]))
+        if record.get("admin") and admin_key:
+            headers["X-Admin-Key"] = admin_key
+        with counter_lock:
+            max_lag[0] = max(max_lag[0], lag)
+            body = fill_placeholders(
+                record.get("body", {}), run_id, counter, record.get("client")
+            )
+        status, _, latency = client.call(record["endpoint"], body, headers)
+        recorder.add(record["endpoint"], status, latency)
+
+    started = time.perf_counter()
+    first = records[0]["t"]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if "bodyBytes" in record:
+                # Bodies over CAPTURE_MAX_BODY_BYTES were not captured
+                continue
+            scheduled = started + ((record["t"] - first) / speed if speed else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, record, scheduled)
+    return recorder.report(time.perf_counter() - started), round(max_lag[0], 1)
+
+
+def print_comparison(before, after):
+    print(f"{'endpoint':32} {'p50 ms':<18} {'p95 ms':<18} {'p99 ms':<18}")
+    for endpoint, current in after["endpoints"].items():
+        previous = before["endpoints"].get(endpoint)
+        if not previous:
+            continue
+        cells = [
+            f"{previous[key]:>7} -> {current[key]:<7}"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+        ]
+        print(f"{endpoint:32} {' '.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("replay", help="replay a capture")
+    replay_parser.add_argument("capture")
+    replay_parser.add_argument("--base-url", default=None)
+    replay_parser.add_argument("--auth-url", default=None)
+    replay_parser.add_argument("--speed", type=float, default=1.0)
+    replay_parser.add_argument("--concurrency", type=int, default=64)
+    replay_parser.add_argument("--limit", type=int, default=0, help="first N records")
+    replay_parser.add_argument("--timeout", type=float, default=120.0)
+    replay_parser.add_argument("--admin-key", default=os.getenv("ADMIN_API_KEY"))
+    replay_parser.add_argument("--output", default=None)
+
+    compare_parser = commands.add_parser("compare", help="compare two replays")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before, "r") as f:
+            before = json.load(f)
+        with open(args.after, "r") as f:
+            after = json.load(f)
+        print_comparison(before, after)
+        regressions = compare(after["endpoints"], before, args.tolerance)
+        if regressions:
+            print("REGRESSIONS:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions")
+        return
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        sys.exit("capture is empty")
+    client = Client(args.base_url or default_base_url(), args.timeout)
+    run_id = uuid.uuid4().hex[:8]
+
+    clients = sorted({r["client"] for r in records if r.get("client")})
+    seeded = seed_users(
+        client,
+        args.auth_url or default_auth_url(),
+        len(clients),
+        min(args.concurrency, 16),
+        run_id,
+    )
+    users = dict(zip(clients, seeded))
+
+    results, max_lag = replay(
+        client, records, users, args.speed, args.concurrency, args.admin_key, run_id
+    )
+    report = {
+        "run_id": run_id,
+        "capture": args.capture,
+        "records": len(records),
+        "clients": len(clients),
+        "speed": args.speed,
+        "concurrency": args.concurrency,
+        "max_dispatch_lag_ms": max_lag,
+        "captured": captured_latencies(records),
+        "endpoints": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()